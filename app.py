@@ -4,11 +4,13 @@ FastAPI Web服务
 """
 import uuid
 import json
+import asyncio
+import hashlib
 import tempfile
 import os
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from pathlib import Path
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, File, UploadFile
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, File, Form, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import HTMLResponse, StreamingResponse
@@ -30,12 +32,20 @@ except ImportError:
 # 导入模块化的RAG服务
 try:
     from core.simple_rag_service import SimpleRAGService as DocumentRAGService
+    from core.ingestion_jobs import IngestionJobManager
     from core.config import config
     RAG_ENABLED = True
     
     # 使用配置文件中的路径，auto自动选择最优的向量存储
     _rag_service = DocumentRAGService(vector_store_type="auto", store_path=config.get_vector_db_path())
     
+    # 后台摄取任务队列（上传接口和 Gradio 共用），启动时会恢复未完成的任务
+    _job_manager = IngestionJobManager(_rag_service)
+    
+    def get_job_manager():
+        """获取摄取任务管理器"""
+        return _job_manager
+    
     def get_rag_service():
         """获取RAG服务实例"""
         return _rag_service
@@ -66,12 +76,32 @@ try:
     def chat_with_documents(message: str, history=None):
         """与文档聊天"""
         # 目前简单实现，不使用history，直接调用RAG
-        response = _rag_service.rag_chat(message)
-        return {"response": response}
+        # 先检索一次，回答和来源共用同一批命中结果
+        retrieval = _rag_service.retrieve(message, k=3)
+        response = _rag_service.rag_chat(message, retrieval=retrieval)
+        return {
+            "response": response,
+            "has_context": retrieval.has_context,
+            "sources": retrieval.to_sources()
+        }
+    
+    def chat_with_documents_stream(message: str, history=None, retrieval=None):
+        """流式与文档聊天（传入 retrieval 时复用已有检索结果）"""
+        return _rag_service.rag_chat_stream(message, retrieval=retrieval)
+    
+    async def achat_with_documents(message: str, history=None):
+        """异步与文档聊天"""
+        retrieval = await _rag_service.aretrieve(message, k=3)
+        response = await _rag_service.arag_chat(message, retrieval=retrieval)
+        return {
+            "response": response,
+            "has_context": retrieval.has_context,
+            "sources": retrieval.to_sources()
+        }
     
-    def chat_with_documents_stream(message: str, history=None):
-        """流式与文档聊天"""
-        return _rag_service.rag_chat_stream(message)
+    def achat_with_documents_stream(message: str, history=None, retrieval=None):
+        """异步流式与文档聊天，返回异步生成器"""
+        return _rag_service.arag_chat_stream(message, retrieval=retrieval)
     
     def delete_document(document_id: str):
         """删除文档"""
@@ -116,6 +146,7 @@ class DocumentUploadResponse(BaseModel):
     success: bool
     message: str
     document_id: str = None
+    job_id: str = None  # 后台摄取任务ID，通过 /api/documents/jobs/{job_id} 查询进度
     error: str = None
     file_info: Dict[str, Any] = None
 
@@ -153,17 +184,17 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 # 挂载 Gradio 界面到 /gradio 路径
 if GRADIO_ENABLED and RAG_ENABLED:
     try:
-        # 导入 ChatModel
-        from core.models import ChatModel
+        # 获取共享的 ChatModel 实例（用于普通聊天，与会话和RAG服务共用同一个客户端）
+        from core.models import get_chat_model
         
-        # 创建 ChatModel 实例（用于普通聊天）
-        chat_model = ChatModel()
+        chat_model = get_chat_model()
         
         # 创建 Gradio 应用
         gradio_app = create_gradio_app(
             chat_model=chat_model,
             session_manager=session_manager,
-            rag_service=_rag_service
+            rag_service=_rag_service,
+            job_manager=_job_manager
         )
         
         # 挂载到 FastAPI
@@ -308,8 +339,8 @@ async def chat_endpoint(request: ChatRequest):
         # 获取会话
         session = session_manager.get_session(session_id)
         
-        # 生成响应
-        response = session.chat(request.message)
+        # 生成响应（异步，不阻塞其他客户端）
+        response = await session.achat(request.message)
         
         return ChatResponse(response=response, session_id=session_id)
     
@@ -320,20 +351,18 @@ async def chat_endpoint(request: ChatRequest):
 @app.get("/api/sessions")
 async def list_sessions():
     """获取所有会话列表"""
-    sessions = []
-    for session_id in session_manager.list_sessions():
-        session = session_manager.get_session(session_id)
-        sessions.append(SessionInfo(
-            session_id=session_id,
-            message_count=len(session.get_history())
-        ))
+    # 只读取消息数，不会创建会话，也不会把已换出的会话恢复到内存
+    sessions = [
+        SessionInfo(session_id=session_id, message_count=message_count)
+        for session_id, message_count in session_manager.list_session_info().items()
+    ]
     return {"sessions": sessions}
 
 
 @app.get("/api/sessions/{session_id}/history")
 async def get_session_history(session_id: str):
     """获取指定会话的历史记录"""
-    if session_id not in session_manager.list_sessions():
+    if not session_manager.has_session(session_id):
         raise HTTPException(status_code=404, detail="Session not found")
     
     session = session_manager.get_session(session_id)
@@ -379,9 +408,44 @@ async def rag_status():
     }
 
 
+async def save_upload_stream(file: UploadFile, save_path: Path, max_size: int):
+    """
+    把上传文件分块写入磁盘，同时增量计算SHA-256
+    
+    先写入 .part 临时文件，完成后再重命名；超过大小上限时立即停止读取并删除临时文件
+    
+    Returns:
+        (文件大小, SHA-256十六进制摘要)；超过大小上限时返回 (None, None)
+    """
+    part_path = save_path.with_name(save_path.name + ".part")
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(part_path, 'wb') as f:
+            while True:
+                chunk = await file.read(config.upload_chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_size:
+                    break
+                hasher.update(chunk)
+                # 磁盘写入放到线程中，避免阻塞事件循环
+                await asyncio.to_thread(f.write, chunk)
+        if size > max_size:
+            os.unlink(part_path)
+            return None, None
+        os.replace(part_path, save_path)
+        return size, hasher.hexdigest()
+    except BaseException:
+        if part_path.exists():
+            os.unlink(part_path)
+        raise
+
+
 @app.post("/api/documents/upload", response_model=DocumentUploadResponse)
-async def upload_document(file: UploadFile = File(...)):
-    """上传文档并处理"""
+async def upload_document(file: UploadFile = File(...), document_id: Optional[str] = Form(None)):
+    """上传文档并处理（指定 document_id 时作为该文档的新版本，只重新嵌入变化的文本块）"""
     if not RAG_ENABLED:
         raise HTTPException(status_code=503, detail="RAG功能不可用")
     
@@ -395,9 +459,10 @@ async def upload_document(file: UploadFile = File(...)):
             detail=f"不支持的文件类型: {file_extension}. 支持的类型: {list(allowed_extensions)}"
         )
     
-    # 检查文件大小（限制为10MB）
-    if file.size and file.size > 10 * 1024 * 1024:
-        raise HTTPException(status_code=400, detail="文件大小不能超过10MB")
+    # 检查文件大小（客户端声明了大小时直接拒绝，未声明时在写入过程中检查）
+    size_limit_mb = config.max_upload_size // (1024 * 1024)
+    if file.size and file.size > config.max_upload_size:
+        raise HTTPException(status_code=400, detail=f"文件大小不能超过{size_limit_mb}MB")
     
     try:
         # 使用配置文件中的上传目录
@@ -409,36 +474,35 @@ async def upload_document(file: UploadFile = File(...)):
         unique_filename = f"{uuid.uuid4().hex[:8]}_{file.filename}"
         save_path = uploads_dir / unique_filename
         
-        # 保存文件到配置的上传目录
-        content = await file.read()
-        with open(save_path, 'wb') as f:
-            f.write(content)
-        
-        # 处理文档
-        result = process_uploaded_file(str(save_path))
+        # 分块写入配置的上传目录，内存占用与文件大小无关
+        size, content_hash = await save_upload_stream(file, save_path, config.max_upload_size)
+        if size is None:
+            raise HTTPException(status_code=400, detail=f"文件大小不能超过{size_limit_mb}MB")
         
-        # 注意：这里不删除文件，保留在data目录中供后续使用
+        # 提交到后台摄取队列，立即返回任务ID
+        # 注意：这里不删除文件，保留在data目录中供后续使用（也用于重启后恢复任务）；
+        # 内容与已有文档相同时由摄取任务删除
+        try:
+            job = get_job_manager().submit(str(save_path), filename=file.filename, content_hash=content_hash,
+                                           replace_document_id=document_id)
+        except RuntimeError as e:
+            os.unlink(save_path)
+            raise HTTPException(status_code=503, detail=str(e))
         
-        if result["success"]:
-            return DocumentUploadResponse(
-                success=True,
-                message=result["message"],
-                document_id=result.get("document_id"),
-                file_info={
-                    "filename": file.filename,
-                    "size": len(content),
-                    "type": file_extension,
-                    "chunks_created": result.get("chunks_created", 0),
-                    "total_docs_in_store": result.get("total_docs_in_store", 0)
-                }
-            )
-        else:
-            return DocumentUploadResponse(
-                success=False,
-                message="文档处理失败",
-                error=result.get("error", "未知错误")
-            )
+        return DocumentUploadResponse(
+            success=True,
+            message="文档已加入处理队列",
+            job_id=job.job_id,
+            file_info={
+                "filename": file.filename,
+                "size": size,
+                "type": file_extension,
+                "sha256": content_hash
+            }
+        )
             
+    except HTTPException:
+        raise
     except Exception as e:
         # 如果出错，删除已保存的文件（如果存在）
         if 'save_path' in locals() and os.path.exists(save_path):
@@ -447,6 +511,28 @@ async def upload_document(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"处理文档时出错: {str(e)}")
 
 
+@app.get("/api/documents/jobs")
+async def list_ingestion_jobs():
+    """获取文档摄取任务列表"""
+    if not RAG_ENABLED:
+        raise HTTPException(status_code=503, detail="RAG功能不可用")
+    
+    jobs = get_job_manager().list_jobs()
+    return {"jobs": [job.to_dict() for job in jobs], "pending": get_job_manager().pending_count()}
+
+
+@app.get("/api/documents/jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """获取文档摄取任务的阶段、分块进度和吞吐量"""
+    if not RAG_ENABLED:
+        raise HTTPException(status_code=503, detail="RAG功能不可用")
+    
+    job = get_job_manager().get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
 @app.post("/api/documents/chat", response_model=ChatResponse)
 async def chat_with_documents_endpoint(request: RAGChatRequest):
     """基于文档的问答"""
@@ -462,7 +548,7 @@ async def chat_with_documents_endpoint(request: RAGChatRequest):
         history = session.get_history()
         
         # 使用RAG进行对话
-        result = chat_with_documents(request.message, history)
+        result = await achat_with_documents(request.message, history)
         
         # 将对话添加到会话历史
         session.add_message("user", request.message)
@@ -494,9 +580,9 @@ async def chat_with_documents_stream_endpoint(request: RAGChatRequest):
         history = session.get_history()
         
         # 流式生成器
-        def generate_stream():
+        async def generate_stream():
             full_response = ""
-            for chunk in chat_with_documents_stream(request.message, history):
+            async for chunk in achat_with_documents_stream(request.message, history):
                 full_response += chunk
                 yield f"data: {json.dumps({'chunk': chunk})}\n\n"
             
@@ -614,6 +700,39 @@ async def clear_document_store():
         raise HTTPException(status_code=500, detail=result["error"])
 
 
+@app.post("/api/documents/store/vacuum")
+async def vacuum_document_store():
+    """在后台压缩向量存储，物理移除已软删除文档的向量"""
+    if not RAG_ENABLED:
+        raise HTTPException(status_code=503, detail="RAG功能不可用")
+    
+    rag_service = get_rag_service()
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG服务不可用")
+    
+    result = rag_service.start_vacuum()
+    if not result["success"]:
+        raise HTTPException(status_code=501, detail=result.get("error", result["message"]))
+    return result
+
+
+@app.post("/api/documents/store/retrain")
+async def retrain_document_store():
+    """按配置的目标参数重新训练IVF类向量索引（复用已存储的向量）"""
+    if not RAG_ENABLED:
+        raise HTTPException(status_code=503, detail="RAG功能不可用")
+    
+    rag_service = get_rag_service()
+    if rag_service is None:
+        raise HTTPException(status_code=503, detail="RAG服务不可用")
+    
+    # 重新训练可能耗时较长，放到线程中执行，不阻塞事件循环
+    result = await asyncio.to_thread(rag_service.retrain_index)
+    if not result["success"]:
+        raise HTTPException(status_code=501, detail=result.get("error", result["message"]))
+    return result
+
+
 @app.post("/api/documents/search")
 async def search_documents(request: dict):
     """搜索相关文档"""
@@ -630,7 +749,7 @@ async def search_documents(request: dict):
     if rag_service is None:
         raise HTTPException(status_code=503, detail="RAG服务不可用")
     
-    results = rag_service.search_documents(query, k=k)
+    results = await rag_service.asearch_documents(query, k=k)
     return {"documents": results, "query": query, "count": len(results)}
 
 
@@ -650,6 +769,8 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
             message_data = json.loads(data)
             user_message = message_data.get("message", "")
             use_documents = message_data.get("use_documents", False)
+            # 每条消息重新获取会话：连接空闲期间会话可能已被移出内存
+            session = session_manager.get_session(session_id)
             
             print(f"📝 用户消息: {user_message}")  # 调试信息
             print(f"🔖 使用文档模式: {use_documents}")  # 调试信息
@@ -679,7 +800,16 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                 print("📚 启动文档问答模式...")  # 调试信息
                 history = session.get_history()
                 try:
-                    for chunk in chat_with_documents_stream(user_message, history):
+                    # 只检索一次：同一批命中结果既用于生成回答，也用于返回来源
+                    retrieval = None
+                    try:
+                        retrieval = await get_rag_service().aretrieve(user_message, k=3)
+                        sources = retrieval.to_sources()
+                        print(f"📄 找到相关文档: {len(sources)}个")  # 调试信息
+                    except Exception as e:
+                        print(f"⚠️ 获取文档信息错误: {str(e)}")  # 调试信息
+                    
+                    async for chunk in achat_with_documents_stream(user_message, history, retrieval=retrieval):
                         full_response += chunk
                         await manager.send_message(json.dumps({
                             "type": "assistant_chunk",
@@ -695,23 +825,13 @@ async def websocket_endpoint(websocket: WebSocket, session_id: str):
                         "type": "assistant_chunk",
                         "content": error_msg
                     }), session_id)
-                
-                # 获取相关文档信息
-                try:
-                    rag_service = get_rag_service()
-                    if rag_service:
-                        docs = rag_service.search_documents(user_message, k=3)
-                        sources = [{"preview": doc["content"][:100] + "...", 
-                                   "relevance": doc["relevance"]} for doc in docs]
-                        print(f"📄 找到相关文档: {len(sources)}个")  # 调试信息
-                except Exception as e:
-                    print(f"⚠️ 获取文档信息错误: {str(e)}")  # 调试信息
+
             else:
                 # 使用普通聊天模式
                 print("💬 启动普通聊天模式...")  # 调试信息
                 try:
                     chunk_count = 0
-                    for chunk in session.chat_stream(user_message):
+                    async for chunk in session.achat_stream(user_message):
                         chunk_count += 1
                         full_response += chunk
                         await manager.send_message(json.dumps({
@@ -760,6 +880,7 @@ async def health_check():
     return {
         "status": "healthy",
         "session_count": session_manager.get_session_count(),
+        "session_store": session_manager.get_stats(),
         "model": config.ollama_model,
         "rag_available": RAG_ENABLED
     }
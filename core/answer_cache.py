@@ -0,0 +1,152 @@
+"""
+语义回答缓存模块
+相近的问题检索到同一批文本块时直接返回已生成的回答，省去一次LLM调用
+
+缓存键：(模型名, 检索到的块ID集合)，同一个键下再按查询向量的余弦相似度匹配；
+文档被删除或重新摄取时，所有用到该文档的条目都会失效
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+
+@dataclass
+class CachedAnswer:
+    """一条缓存的回答"""
+
+    query: str
+    vector: List[float]  # 归一化后的查询向量
+    answer: str
+    chunks: List[str]  # 流式生成时的分块，回放时按原样逐块输出
+    document_ids: frozenset
+    created: float = field(default_factory=time.monotonic)
+    hits: int = 0
+
+
+@dataclass
+class AnswerLookup:
+    """一次缓存查找的结果，未命中时生成回答后用同一组键和向量写回"""
+
+    key: tuple
+    vector: List[float]
+    epoch: int
+    cached: Optional[CachedAnswer] = None
+
+
+def _normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+class SemanticAnswerCache:
+    """
+    进程内语义回答缓存
+
+    先按 (模型名, 块ID集合) 精确定位候选，再比较查询向量的余弦相似度，
+    因此每次查询只需要和极少量条目比较
+    """
+
+    def __init__(self, similarity_threshold: float = 0.95, max_entries: int = 1000, ttl: float = 3600):
+        self.similarity_threshold = similarity_threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries: "OrderedDict[tuple, List[CachedAnswer]]" = OrderedDict()  # 键 -> 条目列表（LRU顺序）
+        self._size = 0
+        self._epoch = 0  # 每次失效时递增，生成期间发生失效的回答不写入缓存
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model: str, chunk_ids: Iterable[str]) -> tuple:
+        return model, frozenset(chunk_ids)
+
+    @property
+    def epoch(self) -> int:
+        """当前失效轮次，生成回答前记录，写入时传回"""
+        return self._epoch
+
+    def _expired(self, entry: CachedAnswer) -> bool:
+        return self.ttl > 0 and time.monotonic() - entry.created >= self.ttl
+
+    def get(self, key: tuple, vector: List[float]) -> Optional[CachedAnswer]:
+        """查找相似度不低于阈值的缓存回答"""
+        vector = _normalize(vector)
+        with self._lock:
+            entries = self._entries.get(key)
+            best, best_similarity = None, self.similarity_threshold
+            if entries:
+                alive = [entry for entry in entries if not self._expired(entry)]
+                self._size -= len(entries) - len(alive)
+                entries[:] = alive
+                for entry in alive:
+                    similarity = sum(a * b for a, b in zip(vector, entry.vector))
+                    if similarity >= best_similarity:
+                        best, best_similarity = entry, similarity
+                if not alive:
+                    del self._entries[key]
+                else:
+                    self._entries.move_to_end(key)
+            if best is None:
+                self.misses += 1
+                return None
+            best.hits += 1
+            self.hits += 1
+            return best
+
+    def put(self, key: tuple, query: str, vector: List[float], answer: str, chunks: List[str],
+            document_ids: Iterable[str], epoch: int) -> bool:
+        """写入回答；生成期间有文档失效（epoch 已变化）时放弃写入"""
+        with self._lock:
+            if epoch != self._epoch:
+                return False
+            entry = CachedAnswer(query=query, vector=_normalize(vector), answer=answer,
+                                 chunks=list(chunks), document_ids=frozenset(document_ids))
+            self._entries.setdefault(key, []).append(entry)
+            self._entries.move_to_end(key)
+            self._size += 1
+            while self._size > self.max_entries and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._size -= len(evicted)
+            return True
+
+    def invalidate_documents(self, document_ids: Iterable[str]) -> int:
+        """使用到指定文档的条目全部失效，返回移除的条目数"""
+        document_ids = set(document_ids)
+        removed = 0
+        with self._lock:
+            self._epoch += 1
+            for key in list(self._entries):
+                entries = self._entries[key]
+                alive = [entry for entry in entries if not (entry.document_ids & document_ids)]
+                removed += len(entries) - len(alive)
+                if alive:
+                    self._entries[key] = alive
+                else:
+                    del self._entries[key]
+            self._size -= removed
+        if removed:
+            print(f"🧹 回答缓存：文档 {sorted(document_ids)} 变化，移除 {removed} 条缓存")
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._epoch += 1
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": True,
+                "entries": self._size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+                "similarity_threshold": self.similarity_threshold
+            }
@@ -0,0 +1,343 @@
+"""
+BM25 关键词检索模块
+基于倒排索引的 BM25 检索，与向量检索通过倒数排名融合（RRF）合并结果
+
+型号、错误码等关键词查询在向量检索中容易漏召回，BM25 按词项精确匹配，
+而且不需要调用嵌入模型
+"""
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from langchain.schema import Document
+except ImportError:  # 依赖不可用时由RAG服务统一报告
+    Document = None
+
+
+# 连续的CJK字符（中日韩表意文字、假名、韩文音节）
+_CJK_RUN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+")
+# 拉丁字母/数字词，允许内部带 - _ . / 连接（如 "ERR-1024"、"v2.3.1"、"TCP/IP"）
+_WORD = re.compile(r"[0-9a-z]+(?:[-_./][0-9a-z]+)*")
+_WORD_PARTS = re.compile(r"[0-9a-z]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    CJK感知的分词
+
+    - CJK文本：切分为相邻二元组（"向量检索" -> "向量" "量检" "检索"），单字成段时保留单字
+    - 拉丁文本：转小写；带连接符的词同时保留整体和各部分（"ERR-1024" -> "err-1024" "err" "1024"）
+    """
+    text = text.lower()
+    tokens = []
+    for run in _CJK_RUN.findall(text):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    for word in _WORD.findall(_CJK_RUN.sub(" ", text)):
+        tokens.append(word)
+        parts = _WORD_PARTS.findall(word)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+
+def reciprocal_rank_fusion(result_lists: Iterable[List[Tuple["Document", float]]], k: int = 60,
+                           limit: int = None) -> List[Tuple["Document", float]]:
+    """
+    倒数排名融合：score = Σ 1 / (k + rank)，只依赖排名，不需要对齐不同检索器的分数尺度
+
+    同一文本块以 (文档ID, 文本内容) 识别：早期写入的块在不同检索器中的 chunk_id 可能不一致
+    """
+    fused: Dict[tuple, float] = {}
+    documents: Dict[tuple, "Document"] = {}
+    for results in result_lists:
+        for rank, (doc, _) in enumerate(results, start=1):
+            key = (doc.metadata.get("document_id"), doc.page_content)
+            fused[key] = fused.get(key, 0.0) + 1.0 / (k + rank)
+            documents.setdefault(key, doc)
+    ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)
+    if limit is not None:
+        ranked = ranked[:limit]
+    return [(documents[key], score) for key, score in ranked]
+
+
+class BM25Index:
+    """
+    增量维护的 BM25 倒排索引
+
+    以文本块为单位建立索引：文档写入向量存储时同步加入，删除时同步移除。
+    持久化时只保存文本块的内容和元数据，加载时重新建立倒排表：
+    - 快照：全部文本块的JSON（index_path）
+    - 日志：快照之后的增删记录，每次保存只追加新记录（index_path + ".log"），
+      累计到阈值后压缩为新快照
+    """
+
+    def __init__(self, index_path: Optional[str] = None, k1: float = 1.5, b: float = 0.75,
+                 compact_threshold: int = 20000):
+        self.index_path = Path(index_path) if index_path else None  # None 表示不持久化
+        self.k1 = k1
+        self.b = b
+        self.compact_threshold = compact_threshold  # 日志中累计多少个文本块后压缩为快照
+
+        self._chunks: Dict[str, dict] = {}  # chunk_id -> {"text", "metadata"}
+        self._postings: Dict[str, Dict[str, int]] = {}  # 词项 -> {chunk_id: 词频}
+        self._lengths: Dict[str, int] = {}  # chunk_id -> 词项数
+        self._by_document: Dict[str, set] = {}  # document_id -> chunk_id 集合
+        self._total_length = 0
+        self._pending_ops: List[dict] = []  # 尚未写入日志的增删记录
+        self._log_chunks = 0  # 自上次快照以来日志中的文本块数
+        self._needs_compact = False  # 清空后需要重写快照
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._chunks)
+
+    @property
+    def log_path(self) -> Optional[Path]:
+        if self.index_path is None:
+            return None
+        return self.index_path.with_suffix(self.index_path.suffix + ".log")
+
+    def _index_chunk(self, chunk_id: str, text: str, metadata: dict):
+        """建立单个文本块的倒排（调用方持有锁）"""
+        if chunk_id in self._chunks:
+            self._unindex_chunk(chunk_id)
+        terms = tokenize(text)
+        self._chunks[chunk_id] = {"text": text, "metadata": metadata}
+        self._lengths[chunk_id] = len(terms)
+        self._total_length += len(terms)
+        for term, tf in Counter(terms).items():
+            self._postings.setdefault(term, {})[chunk_id] = tf
+        document_id = metadata.get("document_id")
+        if document_id is not None:
+            self._by_document.setdefault(document_id, set()).add(chunk_id)
+
+    def _unindex_chunk(self, chunk_id: str):
+        """移除单个文本块的倒排（调用方持有锁）"""
+        chunk = self._chunks.pop(chunk_id, None)
+        if chunk is None:
+            return
+        self._total_length -= self._lengths.pop(chunk_id, 0)
+        for term in set(tokenize(chunk["text"])):
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self._postings[term]
+        document_id = chunk["metadata"].get("document_id")
+        chunk_ids = self._by_document.get(document_id)
+        if chunk_ids is not None:
+            chunk_ids.discard(chunk_id)
+            if not chunk_ids:
+                del self._by_document[document_id]
+
+    def add_documents(self, documents: List["Document"]) -> int:
+        """加入文本块（需要带 chunk_id 元数据），返回加入的数量"""
+        added = {}
+        with self._lock:
+            for doc in documents:
+                chunk_id = doc.metadata.get("chunk_id")
+                if not chunk_id:
+                    continue
+                self._index_chunk(chunk_id, doc.page_content, dict(doc.metadata))
+                added[chunk_id] = self._chunks[chunk_id]
+            if added:
+                self._pending_ops.append({"op": "add", "chunks": added})
+        return len(added)
+
+    def remove_chunks(self, chunk_ids: Iterable[str]) -> int:
+        """按块ID移除文本块，返回移除的数量"""
+        removed = []
+        with self._lock:
+            for chunk_id in chunk_ids:
+                if chunk_id in self._chunks:
+                    self._unindex_chunk(chunk_id)
+                    removed.append(chunk_id)
+            if removed:
+                self._pending_ops.append({"op": "remove", "ids": removed})
+        return len(removed)
+
+    def remove_document(self, document_id: str) -> int:
+        """移除文档的全部文本块"""
+        with self._lock:
+            return self.remove_chunks(list(self._by_document.get(document_id, ())))
+
+    def has_document(self, document_id: str) -> bool:
+        return document_id in self._by_document
+
+    def clear(self):
+        with self._lock:
+            self._chunks.clear()
+            self._postings.clear()
+            self._lengths.clear()
+            self._by_document.clear()
+            self._total_length = 0
+            self._pending_ops = []
+            self._needs_compact = True
+
+    def search(self, query: str, k: int = 4,
+               exclude_document_ids: Iterable[str] = None) -> List[Tuple["Document", float]]:
+        """BM25 检索，返回按分数降序的 (文档块, 分数) 列表"""
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        excluded = set(exclude_document_ids or [])
+
+        with self._lock:
+            n = len(self._chunks)
+            if n == 0:
+                return []
+            avg_length = self._total_length / n or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for chunk_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._lengths[chunk_id] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+
+            if excluded:
+                scores = {
+                    chunk_id: score for chunk_id, score in scores.items()
+                    if self._chunks[chunk_id]["metadata"].get("document_id") not in excluded
+                }
+            top = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+            return [
+                (Document(page_content=self._chunks[chunk_id]["text"],
+                          metadata=dict(self._chunks[chunk_id]["metadata"])), score)
+                for chunk_id, score in top
+            ]
+
+    def save(self) -> bool:
+        """
+        保存到磁盘：只把上次保存之后的增删记录追加到日志，
+        快照不存在、索引被清空或日志累计到阈值时重写快照
+        """
+        if self.index_path is None:
+            return True
+        with self._lock:
+            if self._needs_compact or not self.index_path.exists():
+                return self.compact()
+            if not self._pending_ops:
+                return True
+            try:
+                self._append_log(self._pending_ops)
+                self._log_chunks += sum(
+                    len(op["chunks"]) if op["op"] == "add" else len(op["ids"]) for op in self._pending_ops
+                )
+                self._pending_ops = []
+            except Exception as e:
+                print(f"⚠️  追加BM25日志失败: {e}")
+                return False
+            if self._log_chunks >= self.compact_threshold:
+                print(f"🗜️ BM25日志累计 {self._log_chunks} 个文本块，压缩为快照...")
+                return self.compact()
+            return True
+
+    def compact(self) -> bool:
+        """把全部文本块写为新快照并清空日志（先写临时文件再替换，避免保存中断留下损坏的索引）"""
+        if self.index_path is None:
+            return True
+        with self._lock:
+            try:
+                self.index_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.index_path.with_suffix(self.index_path.suffix + ".tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"version": 1, "chunks": self._chunks}, f, ensure_ascii=False)
+                os.replace(tmp_path, self.index_path)
+                # 替换快照和删除日志之间中断时，重放日志的结果与快照一致（增删都是幂等的）
+                if self.log_path.exists():
+                    os.unlink(self.log_path)
+                self._pending_ops = []
+                self._log_chunks = 0
+                self._needs_compact = False
+                return True
+            except Exception as e:
+                print(f"⚠️  保存BM25索引失败: {e}")
+                return False
+
+    def _append_log(self, ops: List[dict]):
+        """把增删记录逐行追加到日志并刷盘"""
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            for op in ops:
+                f.write(json.dumps(op, ensure_ascii=False))
+                f.write("\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay_log(self) -> int:
+        """在快照上重放日志（调用方持有锁），返回重放的记录数"""
+        if not self.log_path.exists():
+            return 0
+
+        replayed = 0
+        valid_offset = 0
+        with open(self.log_path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("记录不完整")
+                    op = json.loads(line.decode('utf-8'))
+                except Exception as e:
+                    # 最后一行可能因进程中断而不完整，丢弃它
+                    print(f"⚠️  BM25日志尾部记录损坏，已忽略: {e}")
+                    break
+                valid_offset += len(line)
+                if op.get("op") == "add":
+                    for chunk_id, chunk in op["chunks"].items():
+                        self._index_chunk(chunk_id, chunk["text"], chunk["metadata"])
+                    self._log_chunks += len(op["chunks"])
+                elif op.get("op") == "remove":
+                    for chunk_id in op["ids"]:
+                        self._unindex_chunk(chunk_id)
+                    self._log_chunks += len(op["ids"])
+                replayed += 1
+
+        # 截掉损坏的尾部，后续追加从完整记录之后开始
+        if valid_offset < self.log_path.stat().st_size:
+            with open(self.log_path, 'r+b') as f:
+                f.truncate(valid_offset)
+        return replayed
+
+    def load(self) -> bool:
+        """从磁盘加载快照、重放日志并重建倒排表，快照不存在时返回 False"""
+        if self.index_path is None or not self.index_path.exists():
+            return False
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with self._lock:
+                self.clear()
+                for chunk_id, chunk in data.get("chunks", {}).items():
+                    self._index_chunk(chunk_id, chunk["text"], chunk["metadata"])
+                self._log_chunks = 0
+                replayed = self._replay_log()
+                self._pending_ops = []
+                self._needs_compact = False
+            print(f"📂 已加载BM25索引: {len(self._chunks)} 个文本块，{len(self._postings)} 个词项"
+                  + (f"（重放 {replayed} 条日志记录）" if replayed else ""))
+            return True
+        except Exception as e:
+            print(f"⚠️  加载BM25索引失败: {e}")
+            return False
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": True,
+                "chunks": len(self._chunks),
+                "terms": len(self._postings),
+                "documents": len(self._by_document)
+            }
@@ -0,0 +1,131 @@
+"""
+文本分块模块
+提供可配置的分块策略，并为每种配置生成版本号，记录文档是由哪个分块器切分的
+
+分块模式：
+- character: 按字符数切分（默认，与原先的 RecursiveCharacterTextSplitter 行为一致）
+- token:     按token数切分，块大小不超过嵌入模型的上下文长度
+- sentence:  按句子边界切分，识别中文标点（。！？；）和英文句号
+"""
+import math
+import re
+
+try:
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+except ImportError:  # 依赖不可用时由RAG服务统一报告
+    RecursiveCharacterTextSplitter = None
+
+from .config import config
+
+
+# 各模式的分块算法版本，某个模式的切分结果变化时只递增该模式，其他模式的文档不必重新处理
+# v2: sentence/token 模式把句末标点保留在句子末尾（v1 会把标点切到下一块开头）
+CHUNKER_VERSIONS = {"character": 1, "token": 2, "sentence": 2}
+
+CHUNKING_MODES = ("character", "token", "sentence")
+
+# 句子感知的分隔符：段落 > 换行 > 中英文句末标点 > 分句标点 > 空格 > 单字符
+SENTENCE_SEPARATORS = [
+    "\n\n", "\n",
+    "。", "！", "？", ". ", "! ", "? ",
+    "；", "; ", "，", ", ",
+    " ", ""
+]
+
+# CJK统一表意文字、假名、韩文音节和全角标点：每个字符约等于一个token
+_CJK_PATTERN = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef\u3000-\u303f]")
+
+_tiktoken_encoding = None
+_tiktoken_checked = False
+
+
+def _get_tiktoken_encoding():
+    """尝试加载 tiktoken 编码器（可选依赖），只尝试一次"""
+    global _tiktoken_encoding, _tiktoken_checked
+    if not _tiktoken_checked:
+        _tiktoken_checked = True
+        try:
+            import tiktoken
+            _tiktoken_encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tiktoken_encoding = None
+    return _tiktoken_encoding
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算token数（未安装 tiktoken 时使用）
+    CJK字符按每字一个token计算，其余非空白字符按每4个字符一个token计算
+    """
+    cjk = len(_CJK_PATTERN.findall(text))
+    other = len(text) - cjk - sum(1 for ch in text if ch.isspace())
+    return cjk + math.ceil(max(other, 0) / 4)
+
+
+def count_tokens(text: str) -> int:
+    """计算文本的token数：优先使用 tiktoken，否则使用估算"""
+    encoding = _get_tiktoken_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+def _resolve_params(mode: str = None, chunk_size: int = None, chunk_overlap: int = None,
+                    warn: bool = False) -> tuple:
+    """补全并校验分块参数"""
+    mode = mode or config.chunking_mode
+    if mode not in CHUNKING_MODES:
+        raise ValueError(f"不支持的分块模式: {mode}，可选值: {list(CHUNKING_MODES)}")
+
+    chunk_size = chunk_size or config.chunk_size
+    chunk_overlap = config.chunk_overlap if chunk_overlap is None else chunk_overlap
+    if mode == "token" and chunk_size > config.embedding_max_tokens:
+        if warn:
+            print(f"⚠️ 块大小 {chunk_size} 超过嵌入模型上下文 {config.embedding_max_tokens} tokens，已自动调整")
+        chunk_size = config.embedding_max_tokens
+    if chunk_overlap >= chunk_size:
+        raise ValueError(f"chunk_overlap ({chunk_overlap}) 必须小于 chunk_size ({chunk_size})")
+    return mode, chunk_size, chunk_overlap
+
+
+def create_text_splitter(mode: str = None, chunk_size: int = None, chunk_overlap: int = None):
+    """
+    按配置创建文本分割器
+
+    Args:
+        mode: 分块模式，默认使用 config.chunking_mode
+        chunk_size: 块大小（character/sentence 模式为字符数，token 模式为token数）
+        chunk_overlap: 相邻块的重叠大小，单位同 chunk_size
+    """
+    mode, chunk_size, chunk_overlap = _resolve_params(mode, chunk_size, chunk_overlap, warn=True)
+
+    if mode == "character":
+        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    if mode == "sentence":
+        return RecursiveCharacterTextSplitter(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            separators=SENTENCE_SEPARATORS,
+            keep_separator="end"  # 标点留在所属句子的末尾，而不是下一块的开头
+        )
+    # token 模式：同样按句子边界切分，但长度按token计算
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        separators=SENTENCE_SEPARATORS,
+        keep_separator="end",
+        length_function=count_tokens
+    )
+
+
+def get_chunker_version(mode: str = None, chunk_size: int = None, chunk_overlap: int = None) -> str:
+    """
+    分块器版本标识，例如 "character-v1:1000/200"、"sentence-v2:1000/200"、"token-v2(tiktoken):512/64"
+    相同的标识保证相同的文本切分结果
+    """
+    mode, chunk_size, chunk_overlap = _resolve_params(mode, chunk_size, chunk_overlap)
+    name = f"{mode}-v{CHUNKER_VERSIONS[mode]}"
+    if mode == "token":
+        name += "(tiktoken)" if _get_tiktoken_encoding() is not None else "(estimate)"
+    return f"{name}:{chunk_size}/{chunk_overlap}"
+
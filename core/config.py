@@ -20,6 +20,12 @@ class Config:
     ollama_base_url: str = "http://localhost:11434"
     ollama_model: str = "deepseek-r1:1.5b"
     ollama_embedding_model: str = "nomic-embed-text"  # 嵌入模型
+    ollama_keep_alive: str = "30m"  # 最后一次请求后模型（及其KV缓存）在Ollama中保留的时长
+    ollama_num_ctx: Optional[int] = None  # 模型上下文长度，None 时不传，使用模型在Ollama中的默认值
+    ollama_num_predict: Optional[int] = None  # 单次回答最多生成的token数，None 使用Ollama默认值
+    # 提示词模式: "text" 历史和文档拼进一条用户消息; "chat" 使用原生 system/user/assistant 消息，
+    # 前缀（系统提示、摘要、历史）保持稳定，Ollama 可以复用上一轮的KV缓存
+    prompt_mode: str = "text"
     
     # FastAPI配置
     host: str = "0.0.0.0"  # 允许外部访问
@@ -36,23 +42,110 @@ class Config:
     select_history_length: int = 10  # 聊天历史长度
     max_history_length: int = 50  # 最大聊天历史长度
     streaming: bool = True  # 是否启用流式响应
+    max_resident_sessions: int = 1000  # 常驻内存的最大会话数，超出后按LRU换出（历史仍在历史存储中）
+    session_idle_ttl: int = 1800  # 会话空闲多少秒后换出内存，<=0 表示不按空闲时间换出
+    # 聊天历史后端: "sqlite" 持久化（WAL模式，只追加写入）; "memory" 进程内环形缓冲区，重启后丢失
+    history_backend: str = "sqlite"
+    history_store_path: str = "data/chat_history.sqlite3"  # 聊天历史数据库路径
+    session_retention_ttl: int = 7 * 24 * 3600  # 会话最后一条消息之后保留的秒数，<=0 表示永久保留
+    # 历史上下文模式: "window" 只带最近 select_history_length 条原文; "summary" 更早的消息压缩为滚动摘要
+    history_mode: str = "window"
+    history_window_block: int = 4  # window 模式下历史起点每累计多少条才整体前移一次（前移之间提示词前缀不变，1 表示逐条滑动）
+    history_summary_batch: int = 4  # 移出窗口的消息累计多少条后合并进摘要一次（每次合并调用一次LLM）
+    history_summary_max_tokens: int = 256  # 摘要的目标长度（token）
     
     # 数据库配置
     database_url: Optional[str] = None  # 为后续SQL数据库扩展预留
     vector_db_path: str = "data/vector_store"  # 向量数据库路径
     document_metadata_path: str = "data/document_metadata.json"  # 文档元数据路径
     upload_path: str = "data/uploads"  # 文档上传路径
+    max_upload_size: int = 10 * 1024 * 1024  # 单个上传文件的最大字节数
+    upload_chunk_size: int = 1024 * 1024  # 上传文件按块写入磁盘的块大小（字节）
     
     # 向量存储配置
-    # 可选值: "auto", "chromadb", "faiss_ip", "faiss_l2", "faiss_hnsw", "memory"
+    # 可选值: "auto", "chromadb", "faiss_ip", "faiss_l2", "faiss_hnsw", "faiss_ivf", "faiss_ivfpq", "memory"
     # auto: 自动选择可用的向量存储（按优先级：faiss_ip > chromadb > faiss_l2 > faiss_hnsw > memory）
     vector_store_type: str = "auto"  # 向量存储类型
     chromadb_collection_name: str = "rag_documents"  # ChromaDB集合名称
+    # FAISS持久化模式: "snapshot" 每次保存完整重写索引; "append" 追加写日志，定期压缩为快照
+    faiss_persistence_mode: str = "append"
+    faiss_wal_compact_threshold: int = 20000  # 日志累计多少个向量后压缩为快照
+    # FAISS近似索引参数（faiss_hnsw / faiss_ivf / faiss_ivfpq）
+    faiss_hnsw_m: int = 32  # HNSW每个节点的邻居数
+    faiss_hnsw_ef_construction: int = 200  # HNSW建图时的候选队列长度
+    faiss_hnsw_ef_search: int = 64  # HNSW查询时的候选队列长度，越大召回越高、越慢
+    faiss_ivf_nlist: int = 1024  # IVF聚类中心数（向量数达到 nlist×39 前先用平面索引暂存，之后训练）
+    faiss_ivf_nprobe: int = 16  # IVF查询时访问的聚类数
+    faiss_pq_m: int = 16  # PQ子量化器数量（需整除向量维度，否则自动调整）
+    faiss_pq_nbits: int = 8  # 每个子量化器的编码位数
+    faiss_train_sample_size: int = 50000  # IVF训练最多使用的向量数
+    # 软删除压缩：物理移除已删除文档的向量（FAISS等不支持直接删除的存储）
+    vacuum_auto_enabled: bool = True  # 软删除后是否按比例自动触发后台压缩
+    vacuum_deleted_ratio: float = 0.2  # 已删除块占总块数的比例达到该值时自动压缩
+    vacuum_min_deleted_chunks: int = 50  # 已删除块少于该数量时不自动压缩
     
     # RAG 文档处理配置
-    chunk_size: int = 1000  # 文本分块大小
-    chunk_overlap: int = 200  # 文本分块重叠大小
-    
+    # 分块模式: "character" 按字符数; "token" 按token数; "sentence" 按句子边界（识别中文标点）
+    chunking_mode: str = "character"
+    chunk_size: int = 1000  # 文本分块大小（token 模式下为token数）
+    chunk_overlap: int = 200  # 文本分块重叠大小（单位同 chunk_size）
+    embedding_max_tokens: int = 2048  # 嵌入模型的上下文长度，token 模式下块大小不会超过该值
+
+    # 嵌入流水线配置
+    embedding_batch_size: int = 32  # 每个嵌入批次包含的文本块数量
+    embedding_max_workers: int = 4  # 同时向Ollama发起嵌入请求的批次数
+    embedding_max_retries: int = 3  # 单个批次失败后的最大重试次数
+    embedding_retry_backoff: float = 1.0  # 重试基础等待秒数（指数退避）
+
+    # 嵌入缓存配置（按 嵌入模型+文本哈希 持久化到磁盘，所有向量存储共享）
+    embedding_cache_enabled: bool = True  # 是否启用嵌入缓存
+    embedding_cache_path: str = "data/embedding_cache.sqlite3"  # 嵌入缓存数据库路径
+    embedding_cache_max_entries: int = 200000  # 缓存条目上限，超出后按LRU淘汰
+
+    # 查询向量缓存配置（进程内，重复问题不再重新嵌入）
+    query_cache_enabled: bool = True  # 是否启用查询向量缓存
+    query_cache_max_entries: int = 1024  # 最大缓存查询数
+    query_cache_ttl: int = 600  # 缓存存活时间（秒），<=0 表示不过期
+
+    # 混合检索配置（BM25关键词检索 + 向量检索，按倒数排名融合）
+    hybrid_search_enabled: bool = True  # 是否启用BM25关键词检索
+    bm25_index_path: str = "data/bm25_index.json"  # BM25索引持久化路径（内存向量存储不持久化）
+    bm25_k1: float = 1.5  # BM25词频饱和参数
+    bm25_b: float = 0.75  # BM25文档长度归一化参数
+    bm25_compact_threshold: int = 20000  # BM25日志累计多少个文本块后压缩为快照
+    hybrid_candidate_k: int = 20  # 每路检索取回的候选数（不少于最终返回数）
+    rrf_k: int = 60  # 倒数排名融合常数，越大排名靠后的结果权重越高
+
+    # RAG 上下文配置（控制交给LLM的提示词长度）
+    llm_context_window: int = 2048  # 聊天模型的上下文窗口（tokens）
+    llm_answer_reserve_tokens: int = 512  # 为模型回答预留的tokens
+    rag_context_max_tokens: int = 1024  # 文档上下文最多占用的tokens
+    rag_context_min_tail_tokens: int = 64  # 剩余预算少于该值时不再截断放入低分文本块
+
+    # 语义回答缓存（相近的问题检索到相同文本块时直接复用已生成的回答）
+    answer_cache_enabled: bool = True  # 是否启用回答缓存
+    answer_cache_similarity: float = 0.95  # 查询向量余弦相似度不低于该值才视为同一问题
+    answer_cache_max_entries: int = 1000  # 最大缓存回答数
+    answer_cache_ttl: int = 3600  # 缓存存活时间（秒），<=0 表示不过期
+
+    # 重排序配置（检索之后、构建上下文之前对候选重新排序）
+    # 可选值: "none" 不重排序; "lexical" 词项覆盖率; "cross_encoder" 本地交叉编码器（需 sentence-transformers）
+    reranker_type: str = "lexical"
+    reranker_model: str = "BAAI/bge-reranker-base"  # cross_encoder 使用的模型
+    rerank_candidates: int = 12  # 参与重排序的候选数（不少于最终返回数）
+    rerank_batch_size: int = 16  # 每批交给重排序器的候选数
+    rerank_latency_budget_ms: int = 300  # 重排序耗时预算（毫秒），预计或实际超出时保持检索顺序；<=0 不限制
+    rerank_cache_max_entries: int = 4096  # (查询, 文本块) 分数缓存的条目上限
+
+    # 异步接口配置
+    rag_executor_workers: int = 8  # 执行阻塞操作（检索、文档解析）的线程池大小
+
+    # 后台文档摄取任务配置
+    ingestion_workers: int = 2  # 同时处理的上传文档数
+    ingestion_max_pending: int = 100  # 排队+执行中的任务上限，超出时拒绝新上传
+    ingestion_job_history: int = 200  # 保留的已完成任务记录数
+    ingestion_jobs_path: str = "data/ingestion_jobs.json"  # 任务状态持久化路径
+
     # ChromaDB 远程服务器配置（可选）
     # 如果设置了 chromadb_remote_host，将使用远程服务器而不是本地存储
     chromadb_remote_host: Optional[str] = None  # 远程服务器地址，例如: "192.168.1.100" 或 "chromadb.example.com"
@@ -85,6 +178,43 @@ class Config:
             return self.upload_path
         return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.upload_path)
 
+    def get_embedding_cache_path(self) -> str:
+        """获取嵌入缓存数据库的绝对路径"""
+        if os.path.isabs(self.embedding_cache_path):
+            return self.embedding_cache_path
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.embedding_cache_path)
+
+    def get_bm25_index_path(self) -> str:
+        """获取BM25索引文件的绝对路径"""
+        if os.path.isabs(self.bm25_index_path):
+            return self.bm25_index_path
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.bm25_index_path)
+
+    def get_history_store_path(self) -> str:
+        """获取聊天历史数据库的绝对路径"""
+        if os.path.isabs(self.history_store_path):
+            return self.history_store_path
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.history_store_path)
+
+    def get_ingestion_jobs_path(self) -> str:
+        """获取摄取任务状态文件的绝对路径"""
+        if os.path.isabs(self.ingestion_jobs_path):
+            return self.ingestion_jobs_path
+        return os.path.join(os.path.dirname(os.path.dirname(__file__)), self.ingestion_jobs_path)
+
+    def get_faiss_index_params(self) -> dict:
+        """获取FAISS近似索引参数"""
+        return {
+            "hnsw_m": self.faiss_hnsw_m,
+            "hnsw_ef_construction": self.faiss_hnsw_ef_construction,
+            "hnsw_ef_search": self.faiss_hnsw_ef_search,
+            "ivf_nlist": self.faiss_ivf_nlist,
+            "ivf_nprobe": self.faiss_ivf_nprobe,
+            "pq_m": self.faiss_pq_m,
+            "pq_nbits": self.faiss_pq_nbits,
+            "train_sample_size": self.faiss_train_sample_size
+        }
+
     def get_ssl_cert_path(self) -> str:
         """获取SSL证书的绝对路径"""
         if os.path.isabs(self.ssl_cert_path):
@@ -0,0 +1,168 @@
+"""
+上下文构建模块
+把检索结果组装成交给LLM的文档上下文，控制提示词的token数：
+
+- 去重：同一文档中被其他文本块完全包含的块直接丢弃
+- 合并：同一文档中首尾重叠的相邻块（分块重叠部分）拼接为一段，重叠部分只出现一次
+- 预算：按相关性顺序放入各段，总token数不超过预算；放不下的低分尾部截断或丢弃
+"""
+import re
+from dataclasses import dataclass, field
+from typing import List, Tuple
+
+from .chunking import count_tokens
+
+
+# 截断时优先停在句末
+_SENTENCE_END = re.compile(r"[。！？；.!?;\n]")
+
+
+@dataclass
+class _Segment:
+    """同一文档中由若干相邻文本块合并而成的一段文本"""
+
+    document_id: str
+    filename: str
+    text: str
+    rank: int  # 组成该段的文本块中最靠前的检索排名
+    chunks: int = 1
+
+
+@dataclass
+class ContextStats:
+    """一次上下文构建的统计信息"""
+
+    hits: int = 0
+    segments: int = 0
+    tokens: int = 0
+    budget: int = 0
+    dropped: int = 0
+    truncated: bool = False
+    sources: List[str] = field(default_factory=list)
+
+
+def _overlap_length(head: str, tail: str, min_overlap: int) -> int:
+    """head 的结尾与 tail 的开头重叠的字符数（不足 min_overlap 视为不重叠）"""
+    if len(head) < min_overlap or len(tail) < min_overlap:
+        return 0
+    probe = tail[:min_overlap]
+    start = max(0, len(head) - len(tail))
+    position = head.find(probe, start)
+    while position != -1:
+        # 从前往后找，第一个匹配的位置就是最长的重叠
+        if tail.startswith(head[position:]):
+            return len(head) - position
+        position = head.find(probe, position + 1)
+    return 0
+
+
+class ContextBuilder:
+    """按token预算组装文档上下文"""
+
+    def __init__(self, max_tokens: int = 1024, min_overlap: int = 20, min_tail_tokens: int = 64):
+        """
+        Args:
+            max_tokens: 文档上下文的token预算
+            min_overlap: 判定两个文本块首尾相连所需的最少重叠字符数
+            min_tail_tokens: 剩余预算少于该值时不再截断放入下一段，直接丢弃（第一段总会截断放入）
+        """
+        self.max_tokens = max_tokens
+        self.min_overlap = min_overlap
+        self.min_tail_tokens = min_tail_tokens
+
+    def _merge(self, hits: List[Tuple[object, float]]) -> List[_Segment]:
+        """去重并合并同一文档中的重叠文本块，返回按最佳排名排序的段落"""
+        segments: List[_Segment] = []
+        for rank, (doc, _) in enumerate(hits):
+            text = doc.page_content.strip()
+            if not text:
+                continue
+            document_id = doc.metadata.get("document_id")
+            segment = _Segment(document_id, doc.metadata.get("filename", ""), text, rank)
+
+            # 反复与同一文档的已有段落合并，直到不再变化（一个块可能把两段连起来）
+            merged = True
+            while merged:
+                merged = False
+                for other in segments:
+                    if other.document_id != document_id or document_id is None:
+                        continue
+                    if segment.text in other.text or other.text in segment.text:
+                        combined = other.text if segment.text in other.text else segment.text
+                    elif _overlap_length(other.text, segment.text, self.min_overlap):
+                        overlap = _overlap_length(other.text, segment.text, self.min_overlap)
+                        combined = other.text + segment.text[overlap:]
+                    elif _overlap_length(segment.text, other.text, self.min_overlap):
+                        overlap = _overlap_length(segment.text, other.text, self.min_overlap)
+                        combined = segment.text + other.text[overlap:]
+                    else:
+                        continue
+                    segments.remove(other)
+                    segment = _Segment(document_id, segment.filename, combined,
+                                       min(segment.rank, other.rank), segment.chunks + other.chunks)
+                    merged = True
+                    break
+            segments.append(segment)
+        return sorted(segments, key=lambda s: s.rank)
+
+    @staticmethod
+    def _truncate(text: str, max_tokens: int) -> str:
+        """截断到不超过 max_tokens，尽量停在句末"""
+        low, high = 0, len(text)
+        while low < high:  # 二分查找能放下的最长前缀
+            mid = (low + high + 1) // 2
+            if count_tokens(text[:mid]) <= max_tokens - 1:  # 为省略号留一个token
+                low = mid
+            else:
+                high = mid - 1
+        cut = text[:low]
+        ends = [m.end() for m in _SENTENCE_END.finditer(cut)]
+        if ends and ends[-1] >= len(cut) // 2:
+            cut = cut[:ends[-1]]
+        return cut.rstrip() + "…"
+
+    def build(self, hits: List[Tuple[object, float]], max_tokens: int = None) -> Tuple[str, ContextStats]:
+        """
+        组装上下文
+
+        Args:
+            hits: 按相关性排序的 (文档块, 分数) 列表
+            max_tokens: 本次的token预算，默认使用构造时的预算
+
+        Returns:
+            (上下文文本, 统计信息)
+        """
+        budget = self.max_tokens if max_tokens is None else max_tokens
+        stats = ContextStats(hits=len(hits), budget=budget)
+        parts = []
+        used = 0
+        included_chunks = 0
+        for segment in self._merge(hits):
+            header = f"[{len(parts) + 1}] {segment.filename}\n" if segment.filename else f"[{len(parts) + 1}]\n"
+            cost = count_tokens(header) + count_tokens(segment.text) + 1
+            remaining = budget - used
+            if cost <= remaining:
+                parts.append(header + segment.text)
+                used += cost
+                included_chunks += segment.chunks
+                stats.sources.append(segment.filename)
+                continue
+            # 放不下完整段落：剩余预算足够时截断放入，之后的低分段落全部丢弃；
+            # 排名最靠前的段落只要还有预算就截断放入，不受 min_tail_tokens 限制
+            text_budget = remaining - count_tokens(header) - 1
+            if not parts and text_budget < 2:
+                header = ""  # 预算连标题都放不下时只放正文
+                text_budget = remaining - 1
+            if text_budget >= self.min_tail_tokens or (not parts and text_budget >= 2):
+                text = self._truncate(segment.text, text_budget)
+                parts.append(header + text)
+                used += count_tokens(header) + count_tokens(text) + 1
+                included_chunks += segment.chunks
+                stats.sources.append(segment.filename)
+                stats.truncated = True
+            break
+
+        stats.segments = len(parts)
+        stats.tokens = used
+        stats.dropped = len(hits) - included_chunks
+        return "\n\n".join(parts), stats
@@ -0,0 +1,113 @@
+"""
+流式文档加载模块
+按页/按块惰性读取文档并切分为文本块，解析与嵌入可以同时进行，内存占用与文件大小无关
+"""
+import codecs
+from pathlib import Path
+from typing import Iterable, Iterator
+
+try:
+    from langchain.schema import Document
+    from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
+except ImportError:  # 依赖不可用时由RAG服务统一报告
+    Document = None
+
+# 支持的文件类型
+SUPPORTED_EXTENSIONS = {'.pdf', '.txt', '.doc', '.docx'}
+
+# 文本文件编码探测顺序（latin1 可以解码任意字节，作为最后的兜底）
+CANDIDATE_ENCODINGS = ("utf-8-sig", "utf-8", "gbk", "latin1")
+
+ENCODING_SAMPLE_SIZE = 64 * 1024  # 编码探测读取的前缀字节数
+TEXT_BLOCK_SIZE = 256 * 1024  # 文本文件每次读取的字符数
+
+
+def detect_encoding(file_path: str, sample_size: int = ENCODING_SAMPLE_SIZE) -> str:
+    """
+    根据文件前缀探测文本编码（只读取一次前缀）
+
+    使用增量解码器，前缀末尾被截断的多字节字符不会被误判为解码失败
+    """
+    with open(file_path, 'rb') as f:
+        sample = f.read(sample_size)
+
+    for encoding in CANDIDATE_ENCODINGS:
+        decoder = codecs.getincrementaldecoder(encoding)()
+        try:
+            decoder.decode(sample, final=False)
+            return encoding
+        except UnicodeDecodeError:
+            continue
+    return "latin1"
+
+
+def iter_text_blocks(file_path: str, encoding: str = None,
+                     block_size: int = TEXT_BLOCK_SIZE) -> Iterator[str]:
+    """
+    按块读取文本文件
+
+    前缀之后出现个别无法解码的字节时以替换字符代替，不会中断整个文件的处理
+    """
+    encoding = encoding or detect_encoding(file_path)
+    with open(file_path, 'r', encoding=encoding, errors='replace') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                return
+            yield block
+
+
+def iter_pages(file_path: str) -> Iterator["Document"]:
+    """
+    惰性加载文档，按页（PDF）或按块（TXT）产出 Document
+
+    Raises:
+        ValueError: 不支持的文件类型
+    """
+    file_extension = Path(file_path).suffix.lower()
+
+    if file_extension == '.pdf':
+        # lazy_load 逐页解析，不会一次性读入全部页面
+        yield from PyPDFLoader(file_path).lazy_load()
+    elif file_extension == '.txt':
+        encoding = detect_encoding(file_path)
+        for block in iter_text_blocks(file_path, encoding):
+            yield Document(page_content=block, metadata={"source": file_path})
+    elif file_extension in ('.doc', '.docx'):
+        # docx2txt 只能整体解析，Word 文档通常不大
+        try:
+            yield from Docx2txtLoader(file_path).load()
+        except Exception as e:
+            raise ValueError(f"Word 文档处理失败: {str(e)}") from e
+    else:
+        raise ValueError(f"不支持的文件类型: {file_extension}")
+
+
+def split_stream(documents: Iterable["Document"], text_splitter, continuous: bool = False) -> Iterator["Document"]:
+    """
+    惰性切分文档流
+
+    Args:
+        documents: Document 的可迭代对象
+        text_splitter: LangChain 文本分割器（需实现 split_text）
+        continuous: 输入块是否是同一段连续文本被截断的结果（如按块读取的TXT）。
+            为 True 时把每块最后一个文本块留到下一块一起切分，块边界不会切断句子
+    """
+    carry = ""
+    metadata = {}
+    for document in documents:
+        metadata = document.metadata
+        pieces = text_splitter.split_text(carry + document.page_content if continuous else document.page_content)
+        if continuous and pieces:
+            carry = pieces.pop()
+        for piece in pieces:
+            yield Document(page_content=piece, metadata=dict(metadata))
+
+    if carry:
+        yield Document(page_content=carry, metadata=dict(metadata))
+
+
+def iter_document_chunks(file_path: str, text_splitter) -> Iterator["Document"]:
+    """加载并切分文档，惰性产出文本块"""
+    continuous = Path(file_path).suffix.lower() == '.txt'
+    return split_stream(iter_pages(file_path), text_splitter, continuous=continuous)
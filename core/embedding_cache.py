@@ -0,0 +1,254 @@
+"""
+嵌入缓存模块
+基于内容寻址的持久化嵌入缓存，所有向量存储共享同一份缓存
+"""
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # 依赖不可用时退化为普通基类，保证模块可以被导入
+    Embeddings = object
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：统一Unicode形式并折叠空白，避免格式差异导致缓存不命中"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def text_hash(text: str) -> str:
+    """计算规范化文本的哈希值"""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    磁盘嵌入缓存（SQLite）
+    键：(嵌入模型名称, 规范化文本哈希)；超过容量上限时按最近访问时间淘汰
+    """
+
+    def __init__(self, db_path: str, max_entries: int = 200000):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        # 嵌入流水线会在多个线程中访问缓存，连接由锁保护
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_access ON embeddings(last_access)")
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def _pack(vector: List[float]) -> bytes:
+        return array("f", vector).tobytes()
+
+    @staticmethod
+    def _unpack(blob: bytes) -> List[float]:
+        values = array("f")
+        values.frombytes(blob)
+        return values.tolist()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        """批量查询，返回命中的 {哈希: 向量}，并刷新命中项的访问时间"""
+        unique_hashes = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            # SQLite 单条语句的参数数量有限，分段查询
+            for start in range(0, len(unique_hashes), 500):
+                part = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *part]
+                ).fetchall()
+                for row_hash, blob in rows:
+                    found[row_hash] = self._unpack(blob)
+
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                    [(now, model, h) for h in found]
+                )
+                self._conn.commit()
+
+            hit_count = sum(1 for h in hashes if h in found)
+            self.hits += hit_count
+            self.misses += len(hashes) - hit_count
+        return found
+
+    def put_many(self, model: str, items: Dict[str, List[float]]):
+        """批量写入向量，写入后检查容量并淘汰最久未访问的条目"""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)",
+                [(model, h, self._pack(v), now) for h, v in items.items()]
+            )
+            self._count += self._conn.total_changes - before
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """超过容量时淘汰最久未访问的条目（一次淘汰到容量的90%，避免频繁淘汰）"""
+        if self.max_entries <= 0 or self._count <= self.max_entries:
+            return
+        to_remove = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN ("
+            " SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+            (to_remove,)
+        )
+        self._count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        print(f"🧹 嵌入缓存淘汰 {to_remove} 条最久未使用的记录")
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._count = 0
+
+    def get_stats(self) -> dict:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "path": str(self.db_path),
+            "entries": self._count,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class QueryEmbeddingCache:
+    """
+    进程内查询向量缓存
+    按 LRU 顺序保存最近的查询向量，超过存活时间的条目视为失效
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # 键 -> (写入时间, 向量)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """查询缓存，命中时移动到LRU队尾"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                created, vector = entry
+                if self.ttl <= 0 or time.monotonic() - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]  # 已过期
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: List[float]):
+        """写入缓存，超过条目上限时淘汰最久未使用的条目"""
+        with self._lock:
+            self._entries[key] = (time.monotonic(), vector)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> dict:
+        """获取缓存统计信息"""
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    带缓存的嵌入模型包装器
+    位于RAG服务与各向量存储之间，对存储透明：存储照常调用 embed_documents/embed_query
+    """
+
+    def __init__(self, embeddings, model_name: str, cache: EmbeddingCache = None,
+                 query_cache: QueryEmbeddingCache = None):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.cache = cache
+        self.query_cache = query_cache
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """嵌入文档：先查缓存，只把未命中的文本发送给底层模型"""
+        if self.cache is None:
+            return self.embeddings.embed_documents(texts)
+
+        hashes = [text_hash(t) for t in texts]
+        cached = self.cache.get_many(self.model_name, hashes)
+
+        # 相同内容只嵌入一次
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), vectors))
+            self.cache.put_many(self.model_name, computed)
+            cached.update(computed)
+
+        return [cached[h] for h in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """嵌入查询文本：重复的查询直接使用进程内缓存的向量"""
+        if self.query_cache is None:
+            return self.embeddings.embed_query(text)
+
+        key = f"{self.model_name}:{text_hash(text)}"
+        vector = self.query_cache.get(key)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.query_cache.put(key, vector)
+        return vector
+
+    def get_stats(self) -> dict:
+        """获取缓存统计信息"""
+        return {
+            "documents": self.cache.get_stats() if self.cache else {"enabled": False},
+            "queries": self.query_cache.get_stats() if self.query_cache else {"enabled": False}
+        }
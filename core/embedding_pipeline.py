@@ -0,0 +1,122 @@
+"""
+嵌入流水线模块
+将文档块按批次并发地发送给嵌入模型，向量计算完成后再统一写入向量存储
+"""
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Generator, Iterable, List, Optional, Tuple
+
+from .config import config
+
+
+class EmbeddingPipeline:
+    """
+    批量并发嵌入流水线
+    职责：分批、并发、背压和失败重试，不关心向量最终写到哪里
+    """
+
+    def __init__(self, embeddings, batch_size: int = None, max_workers: int = None,
+                 max_retries: int = None, retry_backoff: float = None):
+        """
+        Args:
+            embeddings: 嵌入模型（需实现 embed_documents）
+            batch_size: 每批文本块数量
+            max_workers: 同时向嵌入服务发起请求的批次数
+            max_retries: 单个批次失败后的最大重试次数
+            retry_backoff: 重试基础等待秒数（指数退避）
+        """
+        self.embeddings = embeddings
+        self.batch_size = max(1, batch_size or config.embedding_batch_size)
+        self.max_workers = max(1, max_workers or config.embedding_max_workers)
+        self.max_retries = config.embedding_max_retries if max_retries is None else max_retries
+        self.retry_backoff = config.embedding_retry_backoff if retry_backoff is None else retry_backoff
+        # 背压：最多允许 max_workers * 2 个批次处于排队/执行状态，超过时暂停读取输入
+        self.max_in_flight = self.max_workers * 2
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """嵌入单个批次，失败时按指数退避重试"""
+        attempt = 0
+        while True:
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                if len(vectors) != len(texts):
+                    raise RuntimeError(f"嵌入结果数量不匹配: 期望 {len(texts)}，实际 {len(vectors)}")
+                return vectors
+            except Exception as e:
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** (attempt - 1))
+                print(f"⚠️ 嵌入批次失败（第 {attempt} 次重试，{delay:.1f}s 后）: {e}")
+                time.sleep(delay)
+
+    def _iter_input_batches(self, documents: Iterable) -> Generator[list, None, None]:
+        """惰性地把输入切分为批次，不会一次性读完整个输入"""
+        iterator = iter(documents)
+        while True:
+            batch = list(islice(iterator, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
+    def iter_batches(self, documents: Iterable,
+                     progress_callback: Optional[Callable[[int], None]] = None
+                     ) -> Generator[Tuple[list, List[List[float]]], None, None]:
+        """
+        按输入顺序逐批产出 (文档块列表, 向量列表)
+
+        Args:
+            documents: 文档块的可迭代对象（可以是生成器）
+            progress_callback: 每完成一个批次后回调，参数为该批次的块数
+
+        Yields:
+            (batch_documents, batch_vectors)
+        """
+        input_batches = self._iter_input_batches(documents)
+        pending = {}  # 批次序号 -> (文档块, future)
+        next_submit = 0
+        next_yield = 0
+        exhausted = False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="embed") as executor:
+            try:
+                while True:
+                    # 填充在途批次，直到达到背压上限或输入耗尽
+                    while not exhausted and len(pending) < self.max_in_flight:
+                        batch = next(input_batches, None)
+                        if batch is None:
+                            exhausted = True
+                            break
+                        texts = [doc.page_content for doc in batch]
+                        pending[next_submit] = (batch, executor.submit(self._embed_batch, texts))
+                        next_submit += 1
+
+                    if next_yield not in pending:
+                        return
+
+                    # 按提交顺序取结果；队首批次未完成时阻塞等待，其余批次继续在后台执行
+                    batch, future = pending.pop(next_yield)
+                    next_yield += 1
+                    vectors = future.result()  # 重试耗尽时在这里抛出异常
+                    if progress_callback:
+                        progress_callback(len(batch))
+                    yield batch, vectors
+            finally:
+                for _, future in pending.values():
+                    future.cancel()
+
+    def embed_documents(self, documents: Iterable,
+                        progress_callback: Optional[Callable[[int], None]] = None) -> Tuple[list, List[List[float]]]:
+        """
+        嵌入全部文档块
+
+        Returns:
+            (文档块列表, 对应的向量列表)，顺序与输入一致
+        """
+        all_documents = []
+        all_vectors = []
+        for batch, vectors in self.iter_batches(documents, progress_callback):
+            all_documents.extend(batch)
+            all_vectors.extend(vectors)
+        return all_documents, all_vectors
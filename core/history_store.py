@@ -0,0 +1,280 @@
+"""
+聊天历史存储模块
+会话的历史记录保存在可插拔的后端中，ChatSession 只在内存中保留最近的一段窗口
+
+- MemoryHistoryStore: 进程内环形缓冲区，每个会话最多保留固定条数，重启后丢失
+- SQLiteHistoryStore: SQLite（WAL模式）只追加存储，每条消息一次 INSERT，重启后仍可恢复
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Dict, List
+
+from .config import config
+
+
+class MemoryHistoryStore:
+    """
+    内存历史存储
+    每个会话一个定长 deque（环形缓冲区）；会话数超过上限时丢弃最久未写入的会话
+    """
+
+    durable = False
+
+    def __init__(self, max_length: int = 50, max_sessions: int = 10000):
+        self.max_length = max_length
+        self.max_sessions = max_sessions
+        self._buffers: "OrderedDict[str, deque]" = OrderedDict()
+        self._summaries: Dict[str, str] = {}  # 会话ID -> 早期对话的滚动摘要
+        self._lock = threading.Lock()
+
+    def load(self, session_id: str, limit: int = None) -> List[dict]:
+        with self._lock:
+            buffer = self._buffers.get(session_id)
+            messages = list(buffer) if buffer else []
+        return messages[-limit:] if limit else messages
+
+    def append(self, session_id: str, message: dict):
+        with self._lock:
+            buffer = self._buffers.get(session_id)
+            if buffer is None:
+                buffer = self._buffers[session_id] = deque(maxlen=self.max_length)
+            buffer.append(message)
+            self._buffers.move_to_end(session_id)
+            while self.max_sessions > 0 and len(self._buffers) > self.max_sessions:
+                evicted, _ = self._buffers.popitem(last=False)
+                self._summaries.pop(evicted, None)
+
+    def load_summary(self, session_id: str) -> str:
+        with self._lock:
+            return self._summaries.get(session_id, "")
+
+    def save_summary(self, session_id: str, summary: str):
+        with self._lock:
+            self._summaries[session_id] = summary
+
+    def clear(self, session_id: str):
+        self.delete(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            self._summaries.pop(session_id, None)
+            return self._buffers.pop(session_id, None) is not None
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return session_id in self._buffers
+
+    def release(self, session_id: str):
+        """会话换出内存时调用；内存存储本身就是历史记录，没有需要释放的缓存"""
+    
+    def list_sessions(self) -> Dict[str, int]:
+        """会话ID -> 消息数"""
+        with self._lock:
+            return {session_id: len(buffer) for session_id, buffer in self._buffers.items()}
+    
+    def session_count(self) -> int:
+        """有历史记录的会话数"""
+        with self._lock:
+            return len(self._buffers)
+
+    def purge_older_than(self, max_age: float) -> int:
+        return 0  # 内存存储按会话数淘汰
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {"backend": "memory", "sessions": len(self._buffers), "max_length": self.max_length}
+
+
+class SQLiteHistoryStore:
+    """
+    SQLite 历史存储（WAL模式，只追加）
+
+    每条消息一行，写入只是一次 INSERT，不会重写整段历史；
+    某个会话的行数超过保留条数的两倍时，一次性删除较早的消息。
+    会话数和消息总数第一次使用时统计一次，之后随写入和删除维护，状态查询不扫描整张表
+    """
+
+    durable = True
+
+    def __init__(self, db_path: str, max_length: int = 50):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_length = max_length
+        self._counts: Dict[str, int] = {}  # 会话ID -> 表中的行数（首次写入时读取，会话删除或换出时移除）
+        self._totals = None  # (会话数, 消息总数)，第一次使用时统计
+        self._lock = threading.Lock()
+
+        # 多个线程（Web请求、Gradio回调）都会访问，连接由锁保护
+        self._conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " role TEXT NOT NULL,"
+            " content TEXT NOT NULL,"
+            " timestamp TEXT,"
+            " created REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id, id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            " session_id TEXT PRIMARY KEY,"
+            " summary TEXT NOT NULL,"
+            " updated REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    def load(self, session_id: str, limit: int = None) -> List[dict]:
+        """读取会话最近的 limit 条消息（按时间顺序）"""
+        limit = limit or self.max_length
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content, timestamp FROM messages WHERE session_id = ?"
+                " ORDER BY id DESC LIMIT ?",
+                (session_id, limit)
+            ).fetchall()
+        return [{"role": role, "content": content, "timestamp": timestamp}
+                for role, content, timestamp in reversed(rows)]
+
+    def append(self, session_id: str, message: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO messages (session_id, role, content, timestamp, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, message["role"], message["content"], message.get("timestamp"), time.time())
+            )
+            count = self._counts.get(session_id)
+            if count is None:
+                count = self._conn.execute(
+                    "SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)
+                ).fetchone()[0]
+            else:
+                count += 1
+            self._adjust_totals_locked(1 if count == 1 else 0, 1)
+            if self.max_length > 0 and count > self.max_length * 2:
+                cursor = self._conn.execute(
+                    "DELETE FROM messages WHERE session_id = ? AND id <= ("
+                    " SELECT id FROM messages WHERE session_id = ? ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                    (session_id, session_id, self.max_length)
+                )
+                self._adjust_totals_locked(0, -cursor.rowcount)
+                count = self.max_length
+            self._counts[session_id] = count
+            self._conn.commit()
+    
+    def _load_totals_locked(self) -> tuple:
+        """(会话数, 消息总数)，只在第一次调用时扫描表（调用方持有锁）"""
+        if self._totals is None:
+            self._totals = tuple(self._conn.execute(
+                "SELECT COUNT(DISTINCT session_id), COUNT(*) FROM messages"
+            ).fetchone())
+        return self._totals
+    
+    def _adjust_totals_locked(self, sessions: int, messages: int):
+        """写入或删除后更新已统计的总数；还没有统计过时不需要维护（调用方持有锁）"""
+        if self._totals is not None:
+            self._totals = (self._totals[0] + sessions, self._totals[1] + messages)
+
+    def load_summary(self, session_id: str) -> str:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary FROM summaries WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else ""
+
+    def save_summary(self, session_id: str, summary: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO summaries (session_id, summary, updated) VALUES (?, ?, ?)",
+                (session_id, summary, time.time())
+            )
+            self._conn.commit()
+
+    def clear(self, session_id: str):
+        self.delete(session_id)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+            cursor = self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+            self._counts.pop(session_id, None)
+            if cursor.rowcount > 0:
+                self._adjust_totals_locked(-1, -cursor.rowcount)
+            return cursor.rowcount > 0
+
+    def exists(self, session_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM messages WHERE session_id = ? LIMIT 1", (session_id,)
+            ).fetchone() is not None
+    
+    def release(self, session_id: str):
+        """会话换出内存时丢弃它的行数缓存（再次写入时重新读取）"""
+        with self._lock:
+            self._counts.pop(session_id, None)
+
+    def list_sessions(self) -> Dict[str, int]:
+        """会话ID -> 消息数（不读取消息内容）"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, COUNT(*) FROM messages GROUP BY session_id"
+            ).fetchall()
+        return {session_id: min(count, self.max_length) for session_id, count in rows}
+
+    def purge_older_than(self, max_age: float) -> int:
+        """删除最后一条消息早于 max_age 秒之前的会话，返回删除的会话数"""
+        with self._lock:
+            cutoff = time.time() - max_age
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT session_id FROM messages GROUP BY session_id HAVING MAX(created) < ?", (cutoff,)
+            ).fetchall()]
+            for session_id in stale:
+                cursor = self._conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+                self._conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+                self._counts.pop(session_id, None)
+                self._adjust_totals_locked(-1, -cursor.rowcount)
+            self._conn.commit()
+        return len(stale)
+
+    def session_count(self) -> int:
+        """有历史记录的会话数"""
+        with self._lock:
+            return self._load_totals_locked()[0]
+    
+    def get_stats(self) -> dict:
+        with self._lock:
+            sessions, messages = self._load_totals_locked()
+        return {"backend": "sqlite", "path": str(self.db_path), "sessions": sessions, "messages": messages}
+
+
+_history_store = None
+_history_store_lock = threading.Lock()
+
+
+def get_history_store():
+    """
+    获取全局历史存储（按 config.history_backend 创建一次）
+
+    SQLite 不可用时退化为内存存储
+    """
+    global _history_store
+    if config.history_backend not in ("memory", "sqlite"):
+        raise ValueError(f"不支持的聊天历史后端: {config.history_backend}，可选值: ['memory', 'sqlite']")
+    if _history_store is None:
+        with _history_store_lock:
+            if _history_store is None:
+                if config.history_backend == "sqlite":
+                    try:
+                        _history_store = SQLiteHistoryStore(
+                            config.get_history_store_path(), max_length=config.max_history_length
+                        )
+                    except Exception as e:
+                        print(f"⚠️  聊天历史数据库初始化失败，改用内存存储: {e}")
+                if _history_store is None:
+                    _history_store = MemoryHistoryStore(max_length=config.max_history_length)
+    return _history_store
@@ -0,0 +1,201 @@
+"""
+批量文档摄取模块
+遍历目录，用进程池并行解析文件，所有文件的文本块共享嵌入批次，最后统一保存一次
+
+用法:
+    python -m core.ingest <目录或文件> [...] [--workers N] [--store-type TYPE]
+
+注意：请不要在Web服务运行时对同一个向量存储执行批量摄取，两个进程会互相覆盖存储文件
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from pathlib import Path
+from typing import Iterable, Iterator, List
+
+from .config import config
+from .document_loaders import SUPPORTED_EXTENSIONS, iter_document_chunks
+
+
+def iter_files(roots: Iterable[str], recursive: bool = True) -> Iterator[Path]:
+    """遍历目录树，产出支持的文档文件（按路径排序，结果可复现）"""
+    for root in roots:
+        root_path = Path(root)
+        if root_path.is_file():
+            if root_path.suffix.lower() in SUPPORTED_EXTENSIONS:
+                yield root_path
+            continue
+        pattern = "**/*" if recursive else "*"
+        for path in sorted(root_path.glob(pattern)):
+            if path.is_file() and path.suffix.lower() in SUPPORTED_EXTENSIONS:
+                yield path
+
+
+def parse_file(file_path: str, text_splitter) -> list:
+    """
+    在工作进程中解析并切分单个文件（PDF解析是CPU密集型操作，不受主进程GIL限制）
+
+    Returns:
+        文本块列表
+    """
+    return list(iter_document_chunks(file_path, text_splitter))
+
+
+class BulkIngester:
+    """
+    批量摄取器
+    解析：进程池并行；嵌入：所有文件的文本块进入同一条嵌入流水线，批次可以跨文件；
+    写入：复用 SimpleRAGService 的摄取阶段，全部完成后只保存一次
+    """
+
+    def __init__(self, rag_service, parse_workers: int = None):
+        self.rag_service = rag_service
+        self.parse_workers = parse_workers or os.cpu_count() or 1
+        self.stats = {"files": 0, "added": 0, "duplicates": 0, "failed": 0, "chunks": 0}
+        self.failures: List[tuple] = []
+
+    def _parsed_files(self, files: List[Path], root_names: dict) -> Iterator[tuple]:
+        """提交解析任务并按完成顺序产出 (待处理文档, 文本块列表)；在途任务数有上限，避免结果堆积"""
+        service = self.rag_service
+        file_iter = iter(files)
+        futures = {}
+
+        with ProcessPoolExecutor(max_workers=self.parse_workers) as pool:
+            def fill():
+                while len(futures) < self.parse_workers * 2:
+                    path = next(file_iter, None)
+                    if path is None:
+                        return
+                    # 以相对路径作为文件名，以绝对路径作为来源标识：再次摄取同一文件时作为新版本
+                    filename = root_names.get(path, path.name)
+                    try:
+                        existing_id, pending = service.reserve_document(
+                            str(path), filename=filename, source=str(path.resolve())
+                        )
+                    except Exception as e:
+                        self._fail(path, e)
+                        continue
+                    if existing_id is not None:
+                        self.stats["duplicates"] += 1
+                        print(f"📎 {filename}: 与已有文档 {existing_id} 内容相同，跳过")
+                        continue
+                    futures[pool.submit(parse_file, str(path), service.text_splitter)] = pending
+
+            try:
+                fill()
+                while futures:
+                    done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+                    for future in done:
+                        pending = futures.pop(future)
+                        try:
+                            chunks = future.result()
+                        except Exception as e:
+                            service.release_document(pending)
+                            self._fail(pending.file_path, e)
+                            continue
+                        yield pending, chunks
+                    fill()
+            finally:
+                # 提前结束（例如嵌入失败）时释放尚未解析完成的文档
+                for future, pending in futures.items():
+                    future.cancel()
+                    service.release_document(pending)
+
+    def _fail(self, file_path, error: Exception):
+        self.stats["failed"] += 1
+        self.failures.append((str(file_path), str(error)))
+        print(f"❌ {file_path}: {error}")
+
+    def ingest(self, roots: Iterable[str], recursive: bool = True) -> dict:
+        """摄取目录或文件，返回统计信息"""
+        service = self.rag_service
+        root_names = {}
+        files = []
+        for root in roots:
+            base = Path(root) if Path(root).is_dir() else Path(root).parent
+            for path in iter_files([root], recursive):
+                root_names[path] = path.relative_to(base).as_posix()
+                files.append(path)
+        self.stats["files"] = len(files)
+        print(f"📚 共找到 {len(files)} 个文档，使用 {self.parse_workers} 个解析进程")
+
+        started = time.monotonic()
+        in_flight = {}  # 文档ID -> 正在摄取的文档
+        produced_all = set()  # 文本块已全部进入流水线的文档ID
+
+        def try_commit(pending):
+            """文档的所有新文本块都已写入时提交（只记录元数据，不保存）"""
+            if pending.doc_id in produced_all and len(pending.written_ids) == pending.new_chunks:
+                try:
+                    service.commit_document(pending, save=False)
+                    self.stats["added"] += 1
+                    self.stats["chunks"] += len(pending.written_ids)
+                    print(f"✅ {pending.filename}: {len(pending.chunk_ids)} 个文本块"
+                          f"（新写入 {len(pending.written_ids)} 个）")
+                except Exception as e:
+                    service.discard_document(pending)
+                    self._fail(pending.file_path, e)
+                in_flight.pop(pending.doc_id, None)
+                produced_all.discard(pending.doc_id)
+
+        def chunk_stream():
+            for pending, chunks in self._parsed_files(files, root_names):
+                in_flight[pending.doc_id] = pending
+                yield from service.tag_new_chunks(pending, chunks)
+                produced_all.add(pending.doc_id)
+                try_commit(pending)  # 没有新文本块的文档（如内容未变的新版本）直接提交
+
+        try:
+            for batch, vectors in service.embedding_pipeline.iter_batches(chunk_stream()):
+                service.write_chunks(batch, vectors)
+                for chunk in batch:
+                    in_flight[chunk.metadata["document_id"]].written_ids.append(chunk.metadata["chunk_id"])
+                for doc_id in {chunk.metadata["document_id"] for chunk in batch}:
+                    try_commit(in_flight[doc_id])
+        except Exception as e:
+            # 嵌入或写入失败：已提交的文档保留，未完成的文档清理掉已写入的部分
+            print(f"❌ 批量摄取中断: {e}")
+            for pending in list(in_flight.values()):
+                service.discard_document(pending)
+                self._fail(pending.file_path, e)
+            in_flight.clear()
+        finally:
+            print("💾 保存向量存储...")
+            service.save()
+
+        elapsed = time.monotonic() - started
+        self.stats["elapsed_seconds"] = round(elapsed, 2)
+        self.stats["chunks_per_second"] = round(self.stats["chunks"] / elapsed, 2) if elapsed > 0 else 0.0
+        return self.stats
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description="批量摄取目录中的文档到向量存储")
+    parser.add_argument("paths", nargs="+", help="要摄取的目录或文件")
+    parser.add_argument("--workers", type=int, default=None, help="解析进程数（默认CPU核数）")
+    parser.add_argument("--store-type", default=None, help="向量存储类型（默认使用配置文件）")
+    parser.add_argument("--no-recursive", action="store_true", help="不递归子目录")
+    args = parser.parse_args(argv)
+
+    from .simple_rag_service import SimpleRAGService
+
+    rag_service = SimpleRAGService(vector_store_type=args.store_type or config.vector_store_type,
+                                   store_path=config.get_vector_db_path())
+    ingester = BulkIngester(rag_service, parse_workers=args.workers)
+    stats = ingester.ingest(args.paths, recursive=not args.no_recursive)
+
+    print("\n📊 批量摄取完成")
+    print(f"   文档总数: {stats['files']}")
+    print(f"   新增/更新: {stats['added']}")
+    print(f"   重复跳过: {stats['duplicates']}")
+    print(f"   失败: {stats['failed']}")
+    print(f"   写入文本块: {stats['chunks']}（{stats['chunks_per_second']} 块/秒）")
+    print(f"   耗时: {stats['elapsed_seconds']}s")
+    for file_path, error in ingester.failures:
+        print(f"   ❌ {file_path}: {error}")
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
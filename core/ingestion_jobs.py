@@ -0,0 +1,268 @@
+"""
+文档摄取任务模块
+上传的文档在后台工作线程中解析、分块、嵌入和保存，接口立即返回任务ID
+"""
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .config import config
+
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+
+
+@dataclass
+class IngestionJob:
+    """单个文档摄取任务"""
+
+    job_id: str
+    file_path: str
+    filename: str
+    content_hash: Optional[str] = None  # 上传时计算的SHA-256，用于去重
+    replace_document_id: Optional[str] = None  # 要替换的已有文档ID（上传新版本时指定）
+    status: str = JOB_QUEUED
+    stage: str = "queued"  # queued / parsing / embedding / indexing / saving / done
+    chunks_done: int = 0
+    chunks_total: int = 0
+    document_id: Optional[str] = None
+    error: Optional[str] = None
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    elapsed_seconds: float = 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_COMPLETED, JOB_FAILED)
+
+    def to_dict(self) -> dict:
+        """转换为接口返回的字典，附带进度和吞吐量"""
+        data = asdict(self)
+        data["progress"] = round(self.chunks_done / self.chunks_total, 4) if self.chunks_total else 0.0
+        data["throughput"] = (
+            round(self.chunks_done / self.elapsed_seconds, 2) if self.elapsed_seconds > 0 else 0.0
+        )  # 文本块/秒
+        return data
+
+
+class IngestionJobManager:
+    """
+    摄取任务管理器
+    职责：有界的后台工作池、任务状态跟踪与持久化，重启后继续未完成的任务
+    """
+
+    def __init__(self, rag_service, jobs_path: str = None, max_workers: int = None,
+                 max_pending: int = None, max_history: int = None):
+        self.rag_service = rag_service
+        self.jobs_path = Path(jobs_path or config.get_ingestion_jobs_path())
+        self.jobs_path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_pending = max_pending or config.ingestion_max_pending
+        self.max_history = max_history or config.ingestion_job_history
+
+        self.jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.RLock()
+        self._last_persist = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or config.ingestion_workers,
+            thread_name_prefix="ingest"
+        )
+
+        self._load_jobs()
+        self._resume_unfinished()
+
+    # ==================== 持久化 ====================
+
+    def _load_jobs(self):
+        """加载已保存的任务"""
+        try:
+            if self.jobs_path.exists():
+                with open(self.jobs_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                for item in saved:
+                    job = IngestionJob(**item)
+                    self.jobs[job.job_id] = job
+                print(f"📂 已加载 {len(self.jobs)} 个摄取任务")
+        except Exception as e:
+            print(f"⚠️  加载摄取任务时出错: {e}")
+
+    def _persist(self, force: bool = True):
+        """保存任务列表；进度更新时最多每秒写一次"""
+        now = time.monotonic()
+        if not force and now - self._last_persist < 1.0:
+            return
+        with self._lock:
+            self._last_persist = now
+            self._trim_history()
+            data = [asdict(job) for job in self.jobs.values()]
+            try:
+                tmp_path = self.jobs_path.with_suffix(".tmp")
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                tmp_path.replace(self.jobs_path)
+            except Exception as e:
+                print(f"⚠️  保存摄取任务时出错: {e}")
+
+    def _trim_history(self):
+        """只保留最近的已完成任务"""
+        finished = [job for job in self.jobs.values() if job.finished]
+        overflow = len(finished) - self.max_history
+        if overflow > 0:
+            finished.sort(key=lambda job: job.finished_at or job.created_at)
+            for job in finished[:overflow]:
+                del self.jobs[job.job_id]
+
+    def _resume_unfinished(self):
+        """
+        重启后重新排队未完成的任务
+
+        写入不是原子的：中断时已写入的文本块由RAG服务启动时清理（新文档的ID以失败记录保留、
+        不再复用，未提交版本的块被删除），重新处理时会分配新的文档ID或版本号
+        """
+        unfinished = [job for job in self.jobs.values() if not job.finished]
+        for job in sorted(unfinished, key=lambda j: j.created_at):
+            if not Path(job.file_path).exists():
+                self._fail(job, "上传文件已不存在，无法恢复任务")
+                continue
+            job.status = JOB_QUEUED
+            job.stage = "queued"
+            job.chunks_done = 0
+            self._executor.submit(self._run, job.job_id)
+        if unfinished:
+            print(f"🔄 恢复 {len(unfinished)} 个未完成的摄取任务")
+            self._persist()
+
+    # ==================== 任务调度 ====================
+
+    def pending_count(self) -> int:
+        """排队和执行中的任务数"""
+        with self._lock:
+            return sum(1 for job in self.jobs.values() if not job.finished)
+
+    def submit(self, file_path: str, filename: str = None, content_hash: str = None,
+               replace_document_id: str = None) -> IngestionJob:
+        """
+        提交摄取任务，立即返回
+        
+        Args:
+            file_path: 已保存的文件路径
+            filename: 原始文件名
+            content_hash: 文件内容的SHA-256（可选，未提供时由RAG服务计算）
+            replace_document_id: 要替换的已有文档ID（可选，作为该文档的新版本处理）
+
+        Raises:
+            RuntimeError: 排队任务数达到上限
+        """
+        with self._lock:
+            if self.pending_count() >= self.max_pending:
+                raise RuntimeError(f"摄取队列已满（{self.max_pending} 个任务），请稍后再试")
+
+            job = IngestionJob(
+                job_id=uuid.uuid4().hex,
+                file_path=str(file_path),
+                filename=filename or Path(file_path).name,
+                content_hash=content_hash,
+                replace_document_id=replace_document_id
+            )
+            self.jobs[job.job_id] = job
+            self._persist()
+
+        self._executor.submit(self._run, job.job_id)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[IngestionJob]:
+        """获取任务"""
+        return self.jobs.get(job_id)
+
+    def list_jobs(self) -> List[IngestionJob]:
+        """按创建时间倒序列出任务"""
+        return sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def wait(self, job_id: str, timeout: float = None, interval: float = 0.5) -> Optional[IngestionJob]:
+        """阻塞等待任务结束（用于不方便轮询的调用方）"""
+        deadline = time.monotonic() + timeout if timeout else None
+        while True:
+            job = self.get_job(job_id)
+            if job is None or job.finished:
+                return job
+            if deadline and time.monotonic() >= deadline:
+                return job
+            time.sleep(interval)
+
+    def _fail(self, job: IngestionJob, error: str):
+        job.status = JOB_FAILED
+        job.error = error
+        job.finished_at = datetime.now().isoformat()
+
+    def _run(self, job_id: str):
+        """工作线程：执行单个摄取任务"""
+        job = self.jobs.get(job_id)
+        if job is None:
+            return
+
+        started = time.monotonic()
+        job.status = JOB_RUNNING
+        job.started_at = datetime.now().isoformat()
+        self._persist()
+
+        def on_progress(stage: str, done: int, total: int):
+            stage_changed = stage != job.stage
+            job.stage = stage
+            job.chunks_done = done
+            job.chunks_total = total
+            job.elapsed_seconds = round(time.monotonic() - started, 3)
+            self._persist(force=stage_changed)
+
+        try:
+            success, document_id = self.rag_service.process_document(
+                job.file_path, progress_callback=on_progress,
+                filename=job.filename, content_hash=job.content_hash,
+                document_id=job.replace_document_id
+            )
+            job.elapsed_seconds = round(time.monotonic() - started, 3)
+            if success:
+                job.status = JOB_COMPLETED
+                job.stage = "done"
+                job.document_id = document_id
+                job.finished_at = datetime.now().isoformat()
+                self._remove_duplicate_upload(job)
+            else:
+                self._fail(job, document_id or "无法处理文档")
+        except Exception as e:
+            print(f"❌ 摄取任务 {job_id} 失败: {e}")
+            self._fail(job, str(e))
+        finally:
+            self._persist()
+
+    def _remove_duplicate_upload(self, job: IngestionJob):
+        """
+        内容与已有文档相同时，任务直接复用已有文档，删除这次上传保存的文件
+
+        只删除上传目录中的文件；文档记录指向的正是这个文件时（新文档或新版本）保留
+        """
+        info = self.rag_service.document_metadata.get(job.document_id) or {}
+        if info.get("file_path") == job.file_path:
+            return
+        path = Path(job.file_path)
+        try:
+            if path.resolve().parent != Path(config.get_upload_path()).resolve():
+                return
+            path.unlink(missing_ok=True)
+            print(f"🗑️ {job.filename} 与已有文档 {job.document_id} 内容相同，已删除重复上传的文件")
+        except OSError as e:
+            print(f"⚠️ 删除重复上传的文件失败: {e}")
+
+    def shutdown(self, wait: bool = False):
+        """停止工作池（未完成的任务会在下次启动时恢复）"""
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._persist()
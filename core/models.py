@@ -2,34 +2,216 @@
 模型管理模块
 封装LangChain和Ollama的交互逻辑
 """
-from typing import Generator, List, Dict
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import AsyncGenerator, Generator, List, Dict, Optional
 from langchain_community.llms import Ollama
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain.schema.output_parser import StrOutputParser
 
 from .config import config
+from .history_store import get_history_store
+
+try:
+    # langchain-ollama 的客户端持有持久的HTTP连接池（httpx），同一实例的请求复用连接
+    from langchain_ollama import ChatOllama, OllamaLLM as PooledOllama
+except ImportError:  # 未安装时使用 langchain_community 的实现（每次请求新建连接）
+    from langchain_community.chat_models import ChatOllama
+    PooledOllama = None
+
+PROMPT_MODES = ("text", "chat")
 
 
 class ChatModel:
     """
     聊天模型管理类
     职责：专注于与Ollama模型的交互，不管理会话状态
+    
+    实例不保存任何会话状态，可以在所有会话之间共享，请通过 get_chat_model() 获取
+    
+    提示词模式（config.prompt_mode）：
+    - text: 历史和文档上下文拼进一条用户消息，由补全接口生成
+    - chat: 通过聊天接口发送原生消息，顺序固定为 系统提示 → 历史摘要 → 历史消息 → 当前问题（含文档），
+      多轮对话之间前缀不变，Ollama 只需要处理新增的部分
     """
     
-    def __init__(self):
-        self.llm = Ollama(
-            model=config.ollama_model,
-            base_url=config.ollama_base_url
+    def __init__(self, model_name: str = None, keep_alive=None, num_ctx: int = None, num_predict: int = None):
+        """
+        Args:
+            model_name: 模型名，默认 config.ollama_model
+            keep_alive: 模型在Ollama中保留的时长（如 "30m"、秒数；-1 表示一直保留），默认 config.ollama_keep_alive
+            num_ctx: 上下文长度，默认 config.ollama_num_ctx，未设置时不传，使用模型在Ollama中的默认值
+            num_predict: 单次回答最多生成的token数，默认 config.ollama_num_predict
+        """
+        if config.prompt_mode not in PROMPT_MODES:
+            raise ValueError(f"不支持的提示词模式: {config.prompt_mode}，可选值: {list(PROMPT_MODES)}")
+        self.model_name = model_name or config.ollama_model
+        self.prompt_mode = config.prompt_mode
+        self.keep_alive = keep_alive if keep_alive is not None else config.ollama_keep_alive
+        self.num_ctx = num_ctx or config.ollama_num_ctx
+        self.num_predict = num_predict if num_predict is not None else config.ollama_num_predict
+        
+        # num_ctx 与模型默认值不同时 Ollama 会重新加载模型，只在明确配置时才传
+        options = {"keep_alive": self.keep_alive}
+        if self.num_ctx:
+            options["num_ctx"] = self.num_ctx
+        if self.num_predict is not None:
+            options["num_predict"] = self.num_predict
+        llm_class = PooledOllama or Ollama
+        self.llm = llm_class(
+            model=self.model_name,
+            base_url=config.ollama_base_url,
+            **options
         )
         
-        # 创建提示模板
-        self.prompt = ChatPromptTemplate.from_messages([
-            ("system", config.system_prompt),
+        if self.prompt_mode == "chat":
+            # 聊天接口直接接收消息列表，消息由 _prepare_input 组装
+            self.chat_llm = ChatOllama(model=self.model_name, base_url=config.ollama_base_url, **options)
+            self.chain = self.chat_llm | StrOutputParser()
+        else:
+            # 创建提示模板
+            self.prompt = ChatPromptTemplate.from_messages([
+                ("system", config.system_prompt),
+                ("human", "{input}")
+            ])
+            
+            # 构建链
+            self.chain = self.prompt | self.llm | StrOutputParser()
+        
+        # 历史摘要链：把较早的对话压缩成滚动摘要（history_mode="summary" 时使用）
+        self.summary_prompt = ChatPromptTemplate.from_messages([
+            ("system", "你负责压缩对话历史。请把已有摘要和新的对话合并为一段简洁的摘要，"
+                       "保留用户的问题、关键事实、结论和未完成的事项，不要添加对话中没有的内容。"),
             ("human", "{input}")
         ])
+        self.summary_chain = self.summary_prompt | self.llm | StrOutputParser()
+    
+    @staticmethod
+    def _build_message(message: str, context: str = None) -> str:
+        """如果有上下文，将其添加到消息中"""
+        if context:
+            return f"基于以下文档内容回答问题：\n\n{context}\n\n问题：{message}"
+        return message
+    
+    @staticmethod
+    def _format_history(history: List[Dict[str, str]]) -> str:
+        return "\n".join(
+            f"{'用户' if msg['role'] == 'user' else '助手'}: {msg['content']}" for msg in history
+        )
+    
+    @staticmethod
+    def _trim_history(history: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        截取最近的历史（window 模式）：至少保留 select_history_length 条，
+        起点每累计 history_window_block 条才整体前移一次，前移之间提示词前缀保持不变
+        """
+        block = max(config.history_window_block, 1)
+        cut = max(len(history) - config.select_history_length, 0) // block * block
+        return history[cut:]
+    
+    @classmethod
+    def _build_history_message(cls, message: str, history: List[Dict[str, str]],
+                               summary: Optional[str] = None) -> str:
+        """
+        构建包含历史的上下文
+        
+        summary 为 None 时按 _trim_history 截取最近的历史；
+        否则 history 是尚未合并进摘要的消息，全部放入，摘要放在最前面
+        """
+        if summary is None:
+            history = cls._trim_history(history)
+        
+        parts = []
+        if summary:
+            parts.append(f"早期对话摘要：\n{summary}")
+        if history:
+            parts.append("对话历史：\n" + cls._format_history(history))
+        
+        if parts:
+            return "\n\n".join(parts) + f"\n\n当前问题：{message}"
+        return message
+    
+    @staticmethod
+    def _build_chat_messages(message: str, context: str = None, history: List[Dict[str, str]] = None,
+                             summary: Optional[str] = None) -> list:
+        """
+        组装原生聊天消息（chat 模式）
+        
+        变化最少的内容放在最前面：系统提示和摘要只在摘要更新时变化，历史只在末尾追加，
+        每轮都会变化的文档上下文放在最后一条用户消息里
+        """
+        messages = [SystemMessage(content=config.system_prompt)]
+        if history is not None:
+            if summary is None:
+                history = ChatModel._trim_history(history)
+            if summary:
+                messages.append(SystemMessage(content=f"早期对话摘要：\n{summary}"))
+            for msg in history:
+                message_class = HumanMessage if msg["role"] == "user" else AIMessage
+                messages.append(message_class(content=msg["content"]))
+        messages.append(HumanMessage(content=ChatModel._build_message(message, context)))
+        return messages
+    
+    def _prepare_input(self, message: str, context: str = None, history: List[Dict[str, str]] = None,
+                       summary: Optional[str] = None):
+        """按提示词模式生成调用链的输入（history 为 None 表示不带历史）"""
+        if self.prompt_mode == "chat":
+            return self._build_chat_messages(message, context, history, summary)
+        if history is not None:
+            message = self._build_history_message(message, history, summary)
+        return {"input": self._build_message(message, context)}
+    
+    def _invoke(self, chain_input) -> str:
+        try:
+            return self.chain.invoke(chain_input)
+        except Exception as e:
+            return f"生成响应时发生错误：{str(e)}"
+    
+    def _stream(self, chain_input) -> Generator[str, None, None]:
+        try:
+            for chunk in self.chain.stream(chain_input):
+                yield chunk
+        except Exception as e:
+            yield f"生成响应时发生错误：{str(e)}"
+    
+    async def _ainvoke(self, chain_input) -> str:
+        try:
+            return await self.chain.ainvoke(chain_input)
+        except Exception as e:
+            return f"生成响应时发生错误：{str(e)}"
+    
+    async def _astream(self, chain_input) -> AsyncGenerator[str, None]:
+        try:
+            async for chunk in self.chain.astream(chain_input):
+                yield chunk
+        except Exception as e:
+            yield f"生成响应时发生错误：{str(e)}"
+    
+    def _build_summary_request(self, summary: str, messages: List[Dict[str, str]]) -> str:
+        parts = []
+        if summary:
+            parts.append(f"已有摘要：\n{summary}")
+        parts.append("新的对话：\n" + self._format_history(messages))
+        parts.append(f"请输出合并后的摘要，不超过{config.history_summary_max_tokens}字。")
+        return "\n\n".join(parts)
+    
+    def summarize_history(self, summary: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        把移出窗口的消息合并进已有摘要
         
-        # 构建链
-        self.chain = self.prompt | self.llm | StrOutputParser()
+        Returns:
+            新的摘要；生成失败时返回 None（调用方保留旧摘要，之后重试）
+        """
+        try:
+            result = self.summary_chain.invoke({"input": self._build_summary_request(summary, messages)})
+            return result.strip() or None
+        except Exception as e:
+            print(f"⚠️  对话历史摘要生成失败: {e}")
+            return None
     
     def generate_response(self, message: str, context: str = None) -> str:
         """
@@ -42,17 +224,7 @@ class ChatModel:
         Returns:
             生成的响应文本
         """
-        try:
-            # 如果有上下文，将其添加到消息中
-            if context:
-                enhanced_message = f"基于以下文档内容回答问题：\n\n{context}\n\n问题：{message}"
-            else:
-                enhanced_message = message
-                
-            response = self.chain.invoke({"input": enhanced_message})
-            return response
-        except Exception as e:
-            return f"生成响应时发生错误：{str(e)}"
+        return self._invoke(self._prepare_input(message, context))
     
     def generate_stream_response(self, message: str, context: str = None) -> Generator[str, None, None]:
         """
@@ -65,108 +237,282 @@ class ChatModel:
         Yields:
             响应文本块
         """
-        try:
-            # 如果有上下文，将其添加到消息中
-            if context:
-                enhanced_message = f"基于以下文档内容回答问题：\n\n{context}\n\n问题：{message}"
-            else:
-                enhanced_message = message
-                
-            for chunk in self.chain.stream({"input": enhanced_message}):
-                yield chunk
-        except Exception as e:
-            yield f"生成响应时发生错误：{str(e)}"
+        yield from self._stream(self._prepare_input(message, context))
     
-    def generate_with_history(self, message: str, history: List[Dict[str, str]]) -> str:
+    def generate_with_history(self, message: str, history: List[Dict[str, str]],
+                              summary: Optional[str] = None) -> str:
         """
         基于历史记录生成响应
         
         Args:
             message: 用户消息
             history: 历史对话记录
-            
+            summary: 可选的早期对话摘要（给出时 history 为摘要之后的消息）
+        
         Returns:
             生成的响应文本
         """
-        history_length = config.select_history_length
-        # 构建包含历史的上下文
-        context_parts = []
-        for msg in history[-history_length:]:  # 只取最近N条历史
-            role = "用户" if msg["role"] == "user" else "助手"
-            context_parts.append(f"{role}: {msg['content']}")
-        
-        if context_parts:
-            context = "对话历史：\n" + "\n".join(context_parts) + f"\n\n当前问题：{message}"
-        else:
-            context = message
-            
-        return self.generate_response(context)
+        return self._invoke(self._prepare_input(message, history=history, summary=summary))
     
-    def generate_stream_with_history(self, message: str, history: List[Dict[str, str]]) -> Generator[str, None, None]:
+    def generate_stream_with_history(self, message: str, history: List[Dict[str, str]],
+                                     summary: Optional[str] = None) -> Generator[str, None, None]:
         """
         基于历史记录生成流式响应
         
         Args:
             message: 用户消息
             history: 历史对话记录
-            
+            summary: 可选的早期对话摘要（给出时 history 为摘要之后的消息）
+        
         Yields:
             响应文本块
         """
-        history_length = config.select_history_length
+        yield from self._stream(self._prepare_input(message, history=history, summary=summary))
+    
+    # ==================== 异步接口 ====================
+    # LangChain 的 Ollama 在 ainvoke/astream 中使用 aiohttp 直接发起异步HTTP请求，
+    # 生成过程不会占用事件循环，也不会占用线程池
+    
+    async def agenerate_response(self, message: str, context: str = None) -> str:
+        """异步生成普通响应（参数同 generate_response）"""
+        return await self._ainvoke(self._prepare_input(message, context))
+    
+    async def agenerate_stream_response(self, message: str, context: str = None) -> AsyncGenerator[str, None]:
+        """异步生成流式响应（参数同 generate_stream_response）"""
+        async for chunk in self._astream(self._prepare_input(message, context)):
+            yield chunk
+    
+    async def agenerate_with_history(self, message: str, history: List[Dict[str, str]],
+                                     summary: Optional[str] = None) -> str:
+        """异步基于历史记录生成响应"""
+        return await self._ainvoke(self._prepare_input(message, history=history, summary=summary))
+    
+    async def agenerate_stream_with_history(self, message: str, history: List[Dict[str, str]],
+                                            summary: Optional[str] = None) -> AsyncGenerator[str, None]:
+        """异步基于历史记录生成流式响应"""
+        async for chunk in self._astream(self._prepare_input(message, history=history, summary=summary)):
+            yield chunk
+    
+    async def asummarize_history(self, summary: str, messages: List[Dict[str, str]]) -> Optional[str]:
+        """异步合并历史摘要（参数同 summarize_history）"""
+        try:
+            result = await self.summary_chain.ainvoke({"input": self._build_summary_request(summary, messages)})
+            return result.strip() or None
+        except Exception as e:
+            print(f"⚠️  对话历史摘要生成失败: {e}")
+            return None
 
-        # 构建包含历史的上下文
-        context_parts = []
-        for msg in history[-history_length:]:  # 只取最近N条历史
-            role = "用户" if msg["role"] == "user" else "助手"
-            context_parts.append(f"{role}: {msg['content']}")
-        
-        if context_parts:
-            context = "对话历史：\n" + "\n".join(context_parts) + f"\n\n当前问题：{message}"
-        else:
-            context = message
-            
-        yield from self.generate_stream_response(context)
+
+_chat_models: Dict[str, ChatModel] = {}
+_chat_models_lock = threading.Lock()
+
+# 历史摘要在回答返回之后于后台生成，不占用本轮对话的响应时间
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="history-summary")
+_summary_tasks = set()  # 正在运行的异步摘要任务（保留引用，避免任务在完成前被回收）
+
+
+def get_chat_model(model_name: str = None) -> ChatModel:
+    """
+    获取共享的聊天模型实例（按模型名缓存）
+    
+    客户端、提示模板和调用链只在第一次使用某个模型时创建一次，之后所有会话共用
+    """
+    model_name = model_name or config.ollama_model
+    model = _chat_models.get(model_name)
+    if model is None:
+        with _chat_models_lock:
+            model = _chat_models.get(model_name)
+            if model is None:
+                model = _chat_models[model_name] = ChatModel(model_name)
+    return model
 
 
 class ChatSession:
     """
     聊天会话管理类
     职责：管理会话状态、历史记录，协调模型调用
+    
+    会话只保存自己的历史记录，模型实例来自共享池，创建会话几乎没有开销；
+    历史记录写入历史存储后端，内存中只保留最近 max_history_length 条（首次访问时加载）
     """
     
-    def __init__(self, session_id: str):
+    def __init__(self, session_id: str, model_name: str = None, history_store=None):
         self.session_id = session_id
-        self.model = ChatModel()  # 依赖ChatModel进行实际的模型调用
-        self.history: List[Dict[str, str]] = []
+        self.model_name = model_name
+        self.history_store = history_store or get_history_store()
+        self._window = None  # 最近的消息窗口（deque），首次访问时从存储加载
+        self._summary = ""  # 早期对话的滚动摘要（history_mode="summary"）
+        self._unsummarized = 0  # 窗口末尾带入提示词的消息数（summary 模式下即尚未合并进摘要的消息）
+        self._summary_lock = threading.Lock()
+        self._summarizing = False  # 是否有摘要更新正在进行（每个会话同时只运行一个）
+        self._history_epoch = 0  # 清空历史时递增，丢弃清空之前开始的摘要结果
+    
+    def _messages(self) -> deque:
+        if self._window is None:
+            self._window = deque(
+                self.history_store.load(self.session_id, config.max_history_length),
+                maxlen=config.max_history_length
+            )
+            self._summary = self.history_store.load_summary(self.session_id)
+            # 有摘要时认为窗口之前的消息都已合并；没有摘要时整个窗口都待合并
+            if self._summary or not self._summary_mode():
+                self._unsummarized = min(len(self._window), config.select_history_length)
+            else:
+                self._unsummarized = len(self._window)
+        return self._window
+    
+    @staticmethod
+    def _summary_mode() -> bool:
+        if config.history_mode not in ("window", "summary"):
+            raise ValueError(f"不支持的历史上下文模式: {config.history_mode}，可选值: ['window', 'summary']")
+        return config.history_mode == "summary"
+    
+    def _prompt_history(self) -> tuple:
+        """
+        生成回答时使用的 (历史消息, 摘要)，不包括刚加入的当前问题
+        
+        window 模式下摘要为 None，返回最近的 select_history_length 到
+        select_history_length + history_window_block - 1 条（按块前移，见 add_message）；
+        summary 模式下返回尚未合并进摘要的消息（最多 select_history_length + history_summary_batch 条）
+        """
+        history = self.history[:-1]
+        pending = max(self._unsummarized - 1, 0)
+        recent = history[-pending:] if pending else []
+        if not self._summary_mode():
+            return recent, None
+        return recent, self._summary
+    
+    def _pending_summary(self) -> List[Dict[str, str]]:
+        """移出最近窗口、累计达到 history_summary_batch 条的待合并消息；未达到时返回空列表"""
+        if not self._summary_mode():
+            return []
+        keep = config.select_history_length
+        aged = self._unsummarized - keep
+        if aged < max(config.history_summary_batch, 1):
+            return []
+        history = self.history
+        return history[-self._unsummarized:len(history) - keep]
+    
+    def _apply_summary(self, summary: Optional[str], merged: int):
+        """摘要生成成功后保存，并把已合并的消息移出待合并区"""
+        if summary is None:
+            return  # 保留旧摘要，下一轮重试
+        self._summary = summary
+        self._unsummarized -= merged
+        self.history_store.save_summary(self.session_id, summary)
+    
+    def _begin_summary(self) -> Optional[tuple]:
+        """
+        取出本次要合并的 (待合并消息, 当前摘要, 历史版本)；
+        没有需要合并的消息或已有摘要更新在进行时返回 None（剩余的消息由下一轮合并）
+        """
+        with self._summary_lock:
+            if self._summarizing:
+                return None
+            pending = self._pending_summary()
+            if not pending:
+                return None
+            self._summarizing = True
+            return pending, self._summary, self._history_epoch
+    
+    def _finish_summary(self, summary: Optional[str], merged: int, epoch: int):
+        """结束摘要更新；期间历史被清空时丢弃结果"""
+        with self._summary_lock:
+            self._summarizing = False
+            if epoch == self._history_epoch:
+                self._apply_summary(summary, merged)
+    
+    def update_summary(self):
+        """把移出最近窗口的消息增量合并进滚动摘要（阻塞直到摘要生成完成）"""
+        job = self._begin_summary()
+        if job is None:
+            return
+        pending, summary, epoch = job
+        new_summary = None
+        try:
+            new_summary = self.model.summarize_history(summary, pending)
+        finally:
+            self._finish_summary(new_summary, len(pending), epoch)
+    
+    async def aupdate_summary(self):
+        """异步增量更新滚动摘要（等待摘要生成完成）"""
+        job = self._begin_summary()
+        if job is None:
+            return
+        pending, summary, epoch = job
+        new_summary = None
+        try:
+            new_summary = await self.model.asummarize_history(summary, pending)
+        finally:
+            self._finish_summary(new_summary, len(pending), epoch)
+    
+    def schedule_summary_update(self):
+        """在后台线程中更新滚动摘要，立即返回（summary 模式下每轮对话后调用）"""
+        if self._summary_mode() and self._pending_summary():
+            _summary_executor.submit(self.update_summary)
+    
+    def aschedule_summary_update(self):
+        """在当前事件循环中以后台任务更新滚动摘要，立即返回"""
+        if self._summary_mode() and self._pending_summary():
+            task = asyncio.get_running_loop().create_task(self.aupdate_summary())
+            _summary_tasks.add(task)
+            task.add_done_callback(_summary_tasks.discard)
+    
+    @property
+    def history(self) -> List[Dict[str, str]]:
+        """最近的历史记录（按时间顺序）"""
+        return list(self._messages())
+    
+    @property
+    def model(self) -> ChatModel:
+        """共享的聊天模型（依赖ChatModel进行实际的模型调用）"""
+        return get_chat_model(self.model_name)
         
     def add_message(self, role: str, content: str):
-        """添加消息到历史记录"""
-        self.history.append({
+        """添加消息到历史记录（定长窗口自动丢弃最早的消息，存储后端只追加一条）"""
+        message = {
             "role": role, 
             "content": content,
-            "timestamp": __import__('datetime').datetime.now().isoformat()
-        })
-        
-        # 限制历史记录长度
-        if len(self.history) > config.max_history_length:
-            self.history = self.history[-config.max_history_length:]
+            "timestamp": datetime.now().isoformat()
+        }
+        window = self._messages()
+        with self._summary_lock:
+            window.append(message)
+            self._unsummarized += 1
+            if not self._summary_mode():
+                # window 模式下历史起点整块前移，两次前移之间每轮只在末尾追加，前缀可复用KV缓存
+                limit = config.select_history_length + max(config.history_window_block, 1)
+                if self._unsummarized > limit:
+                    self._unsummarized -= max(config.history_window_block, 1)
+            # 窗口已满时最早的消息被丢弃，待合并数不会超过窗口长度
+            self._unsummarized = min(self._unsummarized, len(window))
+        self.history_store.append(self.session_id, message)
     
     def get_history(self) -> List[Dict[str, str]]:
         """获取聊天历史"""
-        return self.history.copy()  # 返回副本，避免外部修改
+        return self.history  # history 每次返回新的列表，外部修改不会影响会话
+    
+    def get_message_count(self) -> int:
+        """当前窗口中的消息数"""
+        return len(self._messages())
     
     def clear_history(self):
         """清空聊天历史"""
-        self.history.clear()
+        with self._summary_lock:
+            self._messages().clear()
+            self._summary = ""
+            self._unsummarized = 0
+            self._history_epoch += 1
+        self.history_store.clear(self.session_id)
     
     def get_history_summary(self) -> str:
         """获取历史记录摘要"""
-        if not self.history:
+        history = self._messages()
+        if not history:
             return "暂无对话历史"
         
-        user_messages = len([msg for msg in self.history if msg["role"] == "user"])
-        assistant_messages = len([msg for msg in self.history if msg["role"] == "assistant"])
+        user_messages = len([msg for msg in history if msg["role"] == "user"])
+        assistant_messages = len([msg for msg in history if msg["role"] == "assistant"])
         
         return f"会话包含 {user_messages} 条用户消息和 {assistant_messages} 条助手回复"
     
@@ -184,17 +530,20 @@ class ChatSession:
         self.add_message("user", message)
         
         # 使用模型生成响应（考虑历史记录）
+        history, summary = self._prompt_history()
         if config.streaming:
             # 如果配置为流式，收集所有块
             response_chunks = []
-            for chunk in self.model.generate_stream_with_history(message, self.history[:-1]):
+            for chunk in self.model.generate_stream_with_history(message, history, summary):
                 response_chunks.append(chunk)
             response = "".join(response_chunks)
         else:
-            response = self.model.generate_with_history(message, self.history[:-1])
+            response = self.model.generate_with_history(message, history, summary)
         
         # 添加AI响应到历史
         self.add_message("assistant", response)
+        # 摘要在后台更新，回答立即返回
+        self.schedule_summary_update()
         
         return response
     
@@ -211,10 +560,11 @@ class ChatSession:
         # 添加用户消息到历史
         self.add_message("user", message)
         
-        # 生成并收集AI响应
+        # 生成并收集AI响应（与 chat 使用相同的历史和提示词模式）
+        history, summary = self._prompt_history()
         response_chunks = []
         try:
-            for chunk in self.model.generate_stream_response(message):
+            for chunk in self.model.generate_stream_with_history(message, history, summary):
                 response_chunks.append(chunk)
                 yield chunk
         except Exception as e:
@@ -225,6 +575,60 @@ class ChatSession:
         # 添加完整响应到历史
         full_response = "".join(response_chunks)
         self.add_message("assistant", full_response)
+        self.schedule_summary_update()
+    
+    async def achat(self, message: str) -> str:
+        """
+        异步进行对话（供 FastAPI 等异步框架使用，不阻塞事件循环）
+        
+        Args:
+            message: 用户消息
+            
+        Returns:
+            AI响应
+        """
+        self.add_message("user", message)
+        
+        history, summary = self._prompt_history()
+        if config.streaming:
+            response_chunks = []
+            async for chunk in self.model.agenerate_stream_with_history(message, history, summary):
+                response_chunks.append(chunk)
+            response = "".join(response_chunks)
+        else:
+            response = await self.model.agenerate_with_history(message, history, summary)
+        
+        self.add_message("assistant", response)
+        self.aschedule_summary_update()
+        
+        return response
+    
+    async def achat_stream(self, message: str) -> AsyncGenerator[str, None]:
+        """
+        异步进行流式对话
+        
+        Args:
+            message: 用户消息
+            
+        Yields:
+            AI响应文本块
+        """
+        self.add_message("user", message)
+        
+        history, summary = self._prompt_history()
+        response_chunks = []
+        try:
+            async for chunk in self.model.agenerate_stream_with_history(message, history, summary):
+                response_chunks.append(chunk)
+                yield chunk
+        except Exception as e:
+            error_msg = f"生成响应时发生错误: {str(e)}"
+            yield error_msg
+            response_chunks.append(error_msg)
+        
+        full_response = "".join(response_chunks)
+        self.add_message("assistant", full_response)
+        self.aschedule_summary_update()
     
     def chat_with_context(self, message: str, context: str) -> str:
         """
@@ -301,9 +705,7 @@ class OllamaModelManager:
         model_name = model_name or self.current_model
         
         if model_name not in self.models:
-            # 临时创建新模型实例
-            # 注意：这里需要动态创建配置，因为每个模型可能有不同配置
-            self.models[model_name] = ChatModel()
+            self.models[model_name] = get_chat_model(model_name)
             
         return self.models[model_name]
     
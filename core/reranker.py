@@ -0,0 +1,201 @@
+"""
+重排序模块
+在向量/混合检索之后、构建上下文之前，对候选文本块重新打分排序，
+提高前几个结果的准确率，从而可以只把更少的上下文交给LLM
+
+- LexicalOverlapReranker: 基于查询词覆盖率的轻量重排序，无需模型
+- CrossEncoderReranker:   本地CPU交叉编码器（需要安装 sentence-transformers）
+- RerankStage:            批量打分、(查询哈希, 块ID) 分数缓存和延迟预算
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+from typing import List, Optional, Tuple
+
+from .bm25_index import tokenize
+from .embedding_cache import text_hash
+
+
+class LexicalOverlapReranker:
+    """
+    词项覆盖率重排序
+
+    分数 = 文本块覆盖的查询词项比例（长词项权重更高），再加上少量词频奖励；
+    分数相同时保持检索原有的顺序
+    """
+
+    name = "lexical"
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        query_terms = Counter(tokenize(query))
+        if not query_terms:
+            return [0.0] * len(texts)
+        weights = {term: len(term) for term in query_terms}
+        total_weight = sum(weights.values())
+
+        scores = []
+        for text in texts:
+            terms = Counter(tokenize(text))
+            covered = sum(weight for term, weight in weights.items() if term in terms)
+            frequency = sum(min(terms[term], 3) for term in query_terms) / (3 * len(query_terms))
+            scores.append(covered / total_weight + 0.1 * frequency)
+        return scores
+
+
+class CrossEncoderReranker:
+    """本地交叉编码器重排序（CPU推理，模型首次使用时加载）"""
+
+    def __init__(self, model_name: str, device: str = "cpu"):
+        from sentence_transformers import CrossEncoder  # 可选依赖，不可用时由调用方降级
+
+        self.name = f"cross_encoder:{model_name}"
+        self.model = CrossEncoder(model_name, device=device)
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        scores = self.model.predict([(query, text) for text in texts], show_progress_bar=False)
+        return [float(s) for s in scores]
+
+
+def create_reranker(reranker_type: str, model_name: str = None):
+    """
+    按类型创建重排序器
+
+    Returns:
+        重排序器实例；reranker_type 为 "none" 时返回 None
+    """
+    if reranker_type in (None, "", "none"):
+        return None
+    if reranker_type == "lexical":
+        return LexicalOverlapReranker()
+    if reranker_type == "cross_encoder":
+        try:
+            return CrossEncoderReranker(model_name)
+        except Exception as e:
+            print(f"⚠️  交叉编码器 {model_name} 不可用，改用词项覆盖率重排序: {e}")
+            return LexicalOverlapReranker()
+    raise ValueError(f"不支持的重排序类型: {reranker_type}")
+
+
+class RerankStage:
+    """
+    重排序阶段
+
+    - 批量打分：未缓存的候选按 batch_size 分批交给重排序器
+    - 分数缓存：按 (重排序器, 查询哈希, 块ID) 缓存分数，重复问题不再重新打分
+    - 延迟预算：预计或实际耗时超过预算时放弃重排序，保持检索原有顺序
+    """
+
+    def __init__(self, reranker, batch_size: int = 16, latency_budget_ms: float = 300,
+                 cache_max_entries: int = 4096):
+        self.reranker = reranker
+        self.batch_size = max(1, batch_size)
+        self.latency_budget = latency_budget_ms / 1000.0 if latency_budget_ms and latency_budget_ms > 0 else None
+        self.cache_max_entries = cache_max_entries
+
+        self._cache: "OrderedDict[tuple, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._seconds_per_item: Optional[float] = None  # 单个候选打分耗时的滑动平均
+        self.stats = {"reranked": 0, "skipped": 0, "cache_hits": 0, "cache_misses": 0}
+
+    @staticmethod
+    def _chunk_key(doc) -> str:
+        return doc.metadata.get("chunk_id") or text_hash(doc.page_content)
+
+    def _cache_get(self, key: tuple) -> Optional[float]:
+        with self._lock:
+            score = self._cache.get(key)
+            if score is not None:
+                self._cache.move_to_end(key)
+            return score
+
+    def _cache_put(self, items: dict):
+        with self._lock:
+            for key, score in items.items():
+                self._cache[key] = score
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_max_entries:
+                self._cache.popitem(last=False)
+
+    def _record_latency(self, seconds: float, items: int):
+        per_item = seconds / items
+        if self._seconds_per_item is None:
+            self._seconds_per_item = per_item
+        else:
+            self._seconds_per_item = 0.8 * self._seconds_per_item + 0.2 * per_item
+
+    def rerank(self, query: str, hits: List[Tuple[object, float]], top_k: int) -> List[Tuple[object, float]]:
+        """
+        重排序候选结果
+
+        Args:
+            query: 用户问题
+            hits: 检索得到的 (文档块, 分数) 列表，按检索相关性排序
+            top_k: 返回的结果数
+
+        Returns:
+            按重排序分数降序的前 top_k 个 (文档块, 重排序分数)；放弃重排序时返回原顺序的前 top_k 个
+        """
+        if len(hits) <= 1:
+            return hits[:top_k]
+
+        started = time.monotonic()
+        query_key = text_hash(query)
+        keys = [(self.reranker.name, query_key, self._chunk_key(doc)) for doc, _ in hits]
+        scores = {}
+        missing = []
+        for index, key in enumerate(keys):
+            cached = self._cache_get(key)
+            if cached is None:
+                missing.append(index)
+            else:
+                scores[index] = cached
+        self.stats["cache_hits"] += len(hits) - len(missing)
+        self.stats["cache_misses"] += len(missing)
+
+        # 按历史耗时预计本次打分会超出预算时直接跳过
+        if (missing and self.latency_budget is not None and self._seconds_per_item is not None
+                and self._seconds_per_item * len(missing) > self.latency_budget):
+            self.stats["skipped"] += 1
+            # 逐步降低预计耗时，使偶发的慢调用（如模型预热）之后还能重新尝试
+            self._seconds_per_item *= 0.9
+            return hits[:top_k]
+
+        new_scores = {}
+        try:
+            for start in range(0, len(missing), self.batch_size):
+                batch = missing[start:start + self.batch_size]
+                batch_started = time.monotonic()
+                batch_scores = self.reranker.score(query, [hits[i][0].page_content for i in batch])
+                self._record_latency(time.monotonic() - batch_started, len(batch))
+                for index, score in zip(batch, batch_scores):
+                    scores[index] = score
+                    new_scores[keys[index]] = score
+                if (self.latency_budget is not None and start + self.batch_size < len(missing)
+                        and time.monotonic() - started > self.latency_budget):
+                    print(f"⏱️ 重排序超出延迟预算 {self.latency_budget * 1000:.0f}ms，保持检索顺序")
+                    self.stats["skipped"] += 1
+                    return hits[:top_k]
+        except Exception as e:
+            print(f"⚠️  重排序失败，保持检索顺序: {e}")
+            self.stats["skipped"] += 1
+            return hits[:top_k]
+        finally:
+            # 已经算出的分数即使本次放弃重排序也可以缓存
+            if new_scores:
+                self._cache_put(new_scores)
+
+        self.stats["reranked"] += 1
+        # sorted 是稳定排序：分数相同的候选保持检索原有的顺序
+        order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)
+        return [(hits[i][0], scores[i]) for i in order[:top_k]]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            cache_entries = len(self._cache)
+        return {
+            "enabled": True,
+            "reranker": self.reranker.name,
+            "cache_entries": cache_entries,
+            "avg_ms_per_item": round(self._seconds_per_item * 1000, 3) if self._seconds_per_item else None,
+            **self.stats
+        }
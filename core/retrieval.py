@@ -0,0 +1,43 @@
+"""
+检索结果模块
+封装一次向量检索的命中结果，供生成回答和展示来源共同使用
+"""
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Tuple
+
+
+@dataclass
+class RetrievalResult:
+    """一次检索的结果：查询文本和按相关性排序的 (文档块, 分数) 列表"""
+
+    query: str
+    hits: List[Tuple[Any, float]] = field(default_factory=list)
+    # 文档块 -> 归一化到 [0, 1] 的检索相关度（越大越相关）。分数的含义随检索方式变化
+    # （向量距离、融合分数、重排序分数），前端展示使用这个统一的值
+    relevance: Dict[int, float] = field(default_factory=dict)  # id(文档块) -> 相关度
+
+    @property
+    def documents(self) -> list:
+        """命中的文档块"""
+        return [doc for doc, _ in self.hits]
+
+    @property
+    def has_context(self) -> bool:
+        """是否检索到了可用的上下文"""
+        return bool(self.hits)
+
+    def to_sources(self, preview_length: int = 100) -> List[dict]:
+        """转换为前端展示用的来源列表"""
+        sources = []
+        for doc, score in self.hits:
+            content = doc.page_content
+            preview = content[:preview_length] + "..." if len(content) > preview_length else content
+            relevance = self.relevance.get(id(doc))
+            sources.append({
+                "preview": preview,
+                "score": float(score),
+                "relevance": round(relevance, 4) if relevance is not None else None,
+                "document_id": doc.metadata.get("document_id"),
+                "filename": doc.metadata.get("filename")
+            })
+        return sources
@@ -1,38 +1,137 @@
 """
 会话管理模块
 管理多个聊天会话和用户状态
+
+常驻内存的会话数有上限：超过上限或空闲超时的会话按LRU顺序换出内存。
+会话的每条消息都已写入历史存储（core.history_store），换出时不需要额外保存，
+再次访问时从历史存储透明地恢复
 """
-from typing import Dict, Optional
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Set
+
+from .config import config
+from .history_store import get_history_store
 from .models import ChatSession
 
 
 class SessionManager:
-    """会话管理器"""
-    
-    def __init__(self):
-        self.sessions: Dict[str, ChatSession] = {}
-    
+    """
+    会话管理器
+
+    - sessions: 常驻内存的会话（LRU顺序，最近访问的在末尾）
+    - 超过 max_sessions 或空闲超过 idle_ttl 的会话换出内存，历史记录保留在历史存储中
+    - 仍被进行中的请求持有的已换出会话可以继续使用：它的消息同样直接写入历史存储
+    """
+
+    def __init__(self, max_sessions: int = None, idle_ttl: float = None, history_store=None,
+                 retention_ttl: float = None):
+        self.max_sessions = config.max_resident_sessions if max_sessions is None else max_sessions
+        self.idle_ttl = config.session_idle_ttl if idle_ttl is None else idle_ttl
+        self.retention_ttl = config.session_retention_ttl if retention_ttl is None else retention_ttl
+        self.history_store = history_store or get_history_store()
+        self.sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._last_access: Dict[str, float] = {}
+        self._unsaved: Set[str] = set()  # 常驻内存、创建时历史存储中还没有记录的会话（计数用）
+        self._last_sweep = time.monotonic()
+        self._lock = threading.RLock()
+        self.stats = {"created": 0, "evicted": 0, "rehydrated": 0}
+
+    def _evict_locked(self, session_id: str):
+        """把会话换出内存（调用方持有锁）"""
+        self.sessions.pop(session_id, None)
+        self._last_access.pop(session_id, None)
+        self._unsaved.discard(session_id)
+        self.history_store.release(session_id)
+        self.stats["evicted"] += 1
+
+    def _sweep_locked(self):
+        """换出超出上限和空闲超时的会话，并定期清理超过保留期的历史"""
+        now = time.monotonic()
+        if self.idle_ttl and self.idle_ttl > 0 and now - self._last_sweep >= min(60.0, self.idle_ttl):
+            self._last_sweep = now
+            for session_id in [sid for sid, accessed in self._last_access.items() if now - accessed >= self.idle_ttl]:
+                self._evict_locked(session_id)
+            if self.retention_ttl and self.retention_ttl > 0:
+                try:
+                    self.history_store.purge_older_than(self.retention_ttl)
+                except Exception as e:
+                    print(f"⚠️  清理过期聊天历史失败: {e}")
+        while self.max_sessions > 0 and len(self.sessions) > self.max_sessions:
+            self._evict_locked(next(iter(self.sessions)))
+
     def get_session(self, session_id: str) -> ChatSession:
-        """获取或创建会话"""
-        if session_id not in self.sessions:
-            self.sessions[session_id] = ChatSession(session_id)
-        return self.sessions[session_id]
-    
+        """获取或创建会话（已换出或重启前的会话会从历史存储恢复）"""
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                # 历史记录在第一次使用时才加载
+                session = ChatSession(session_id, history_store=self.history_store)
+                if self.history_store.exists(session_id):
+                    self.stats["rehydrated"] += 1
+                else:
+                    self.stats["created"] += 1
+                    self._unsaved.add(session_id)
+                self.sessions[session_id] = session
+            self.sessions.move_to_end(session_id)
+            self._last_access[session_id] = time.monotonic()
+            self._sweep_locked()
+            return session
+
+    def has_session(self, session_id: str) -> bool:
+        """会话是否存在（常驻或有历史记录），不会创建会话"""
+        with self._lock:
+            if session_id in self.sessions:
+                return True
+        return self.history_store.exists(session_id)
+
     def delete_session(self, session_id: str) -> bool:
-        """删除会话"""
-        if session_id in self.sessions:
-            del self.sessions[session_id]
-            return True
-        return False
-    
+        """删除会话及其历史记录"""
+        with self._lock:
+            found = self.sessions.pop(session_id, None) is not None
+            self._last_access.pop(session_id, None)
+            self._unsaved.discard(session_id)
+        return self.history_store.delete(session_id) or found
+
+    def list_session_info(self) -> Dict[str, int]:
+        """会话ID -> 消息数，包括不在内存中的会话（不会恢复或创建会话）"""
+        info = self.history_store.list_sessions()
+        with self._lock:
+            for session_id in self.sessions:
+                info.setdefault(session_id, 0)  # 还没有消息的新会话
+        return info
+
     def list_sessions(self) -> list:
         """列出所有会话ID"""
-        return list(self.sessions.keys())
-    
+        return list(self.list_session_info().keys())
+
     def get_session_count(self) -> int:
-        """获取当前会话数量"""
-        return len(self.sessions)
+        """
+        获取当前会话数量
+        
+        历史存储维护有记录的会话数，再加上常驻内存但还没有消息的新会话；
+        不扫描消息表，/health 等频繁调用的接口可以直接使用
+        """
+        with self._lock:
+            # 新会话写入第一条消息后已计入历史存储，不再单独计数
+            for session_id in [sid for sid in self._unsaved if self.sessions[sid].get_message_count()]:
+                self._unsaved.discard(session_id)
+            unsaved = len(self._unsaved)
+        return self.history_store.session_count() + unsaved
+
+    def get_stats(self) -> dict:
+        """获取会话存储统计信息"""
+        with self._lock:
+            resident = len(self.sessions)
+        return {
+            "resident": resident,
+            "max_sessions": self.max_sessions,
+            "idle_ttl": self.idle_ttl,
+            "history_store": self.history_store.get_stats(),
+            **self.stats
+        }
 
 
 # 全局会话管理器实例
-session_manager = SessionManager()
\ No newline at end of file
+session_manager = SessionManager()
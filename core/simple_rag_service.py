@@ -4,28 +4,58 @@
 整合向量存储和文档处理功能
 """
 
-from typing import List, Generator
+import asyncio
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field
+from typing import Dict, List, Generator, AsyncGenerator, Callable, Optional
 from pathlib import Path
 from datetime import datetime
 
 try:
     from langchain_community.embeddings import OllamaEmbeddings
-    from langchain.text_splitter import RecursiveCharacterTextSplitter
     from langchain.schema import Document
-    from langchain_community.document_loaders import PyPDFLoader, TextLoader, Docx2txtLoader
     DEPENDENCIES_AVAILABLE = True
 except ImportError as e:
     print(f"❌ RAG服务依赖不可用: {e}")
     DEPENDENCIES_AVAILABLE = False
 
 from .config import config
-from .models import ChatModel
+from .models import get_chat_model
+from .embedding_pipeline import EmbeddingPipeline
+from .embedding_cache import EmbeddingCache, QueryEmbeddingCache, CachedEmbeddings, text_hash
+from .retrieval import RetrievalResult
+from .bm25_index import BM25Index, reciprocal_rank_fusion
+from .reranker import RerankStage, create_reranker
+from .document_loaders import SUPPORTED_EXTENSIONS, iter_document_chunks
+from .chunking import create_text_splitter, get_chunker_version, count_tokens
+from .context_builder import ContextBuilder
+from .answer_cache import AnswerLookup, SemanticAnswerCache
 from vector_stores.memory_vector_store import MemoryVectorStore
 from vector_stores.faiss_vector_store import FAISSVectorStore
 from vector_stores.chromadb_vector_store import ChromaDBVectorStore
 from vector_stores.vector_config import get_store_config, list_available_stores
 
 
+@dataclass
+class PendingDocument:
+    """正在摄取的文档"""
+    
+    doc_id: str
+    file_path: str
+    filename: str
+    content_hash: str
+    source: Optional[str] = None  # 稳定的来源标识（如批量摄取时的绝对路径），同一来源的新内容视为新版本
+    revision: int = 0  # 0 表示新文档，>0 表示已有文档的新版本
+    previous_chunks: Dict[str, str] = field(default_factory=dict)  # 上一版本：内容哈希 -> 块ID
+    chunk_ids: Dict[str, str] = field(default_factory=dict)  # 本版本：内容哈希 -> 块ID
+    new_chunks: int = 0  # 本版本需要新写入的块数
+    written_ids: List[str] = field(default_factory=list)  # 已写入向量存储的块ID
+
+
 class SimpleRAGService:
     """简化的RAG服务"""
     
@@ -39,6 +69,35 @@ class SimpleRAGService:
             model=config.ollama_embedding_model
         )
         
+        # 嵌入缓存：包装嵌入模型后交给所有向量存储，重复内容不再重新嵌入
+        # - 文档缓存：持久化到磁盘，按内容哈希寻址
+        # - 查询缓存：进程内LRU+TTL，所有存储的检索路径都会经过 embed_query
+        self.embedding_cache = None
+        self.query_embedding_cache = None
+        if config.embedding_cache_enabled:
+            try:
+                self.embedding_cache = EmbeddingCache(
+                    config.get_embedding_cache_path(),
+                    max_entries=config.embedding_cache_max_entries
+                )
+            except Exception as e:
+                print(f"⚠️  嵌入缓存初始化失败，将直接调用嵌入模型: {e}")
+        if config.query_cache_enabled:
+            self.query_embedding_cache = QueryEmbeddingCache(
+                max_entries=config.query_cache_max_entries,
+                ttl=config.query_cache_ttl
+            )
+        if self.embedding_cache or self.query_embedding_cache:
+            self.embeddings = CachedEmbeddings(
+                self.embeddings,
+                model_name=config.ollama_embedding_model,
+                cache=self.embedding_cache,
+                query_cache=self.query_embedding_cache
+            )
+        
+        # 批量并发嵌入流水线（上传文档时使用）
+        self.embedding_pipeline = EmbeddingPipeline(self.embeddings)
+        
         # 使用配置文件中的向量存储类型，如果未指定的话
         if vector_store_type is None:
             vector_store_type = config.vector_store_type
@@ -56,18 +115,71 @@ class SimpleRAGService:
         data_dir.mkdir(exist_ok=True)
         
         self.metadata_file_path = Path(config.get_document_metadata_path())
+        # 预留日志：reserve_document 逐行追加预留的文档ID/版本，保存元数据时只保留尚未了结的预留，
+        # 重启时据此清理中断的摄取（预留时不重写整个元数据文件）
+        self.reservation_log_path = self.metadata_file_path.with_name(
+            self.metadata_file_path.stem + "_reservations.log"
+        )
+        self._unresolved = {}  # 文档ID -> 尚未了结的预留记录（提交或清理完成后移除）
         self.document_metadata = self._load_document_metadata()  # 尝试加载已保存的metadata
         self.next_doc_id = self._get_next_doc_id()  # 基于现有metadata确定下一个ID
         
+        # BM25关键词索引：与向量存储同步增量维护，检索时与向量结果融合
+        self.keyword_index = self._create_keyword_index() if config.hybrid_search_enabled else None
+        
+        # 重排序阶段：对检索候选重新打分，只把最相关的几个文本块交给LLM
+        self.rerank_stage = None
+        reranker = create_reranker(config.reranker_type, config.reranker_model)
+        if reranker is not None:
+            self.rerank_stage = RerankStage(
+                reranker,
+                batch_size=config.rerank_batch_size,
+                latency_budget_ms=config.rerank_latency_budget_ms,
+                cache_max_entries=config.rerank_cache_max_entries
+            )
+        
+        # 上下文构建：去重、合并相邻文本块，并按token预算截断
+        self.context_builder = ContextBuilder(
+            max_tokens=config.rag_context_max_tokens,
+            min_tail_tokens=config.rag_context_min_tail_tokens
+        )
+        
+        # 语义回答缓存：相近问题命中同一批文本块时跳过LLM调用
+        self.answer_cache = None
+        if config.answer_cache_enabled:
+            self.answer_cache = SemanticAnswerCache(
+                similarity_threshold=config.answer_cache_similarity,
+                max_entries=config.answer_cache_max_entries,
+                ttl=config.answer_cache_ttl
+            )
+        
+        # 写锁：分配文档ID、写入向量存储和保存元数据需要串行执行（后台任务会并发处理文档）
+        self._write_lock = threading.RLock()
+        
+        # 正在处理的文档：文档ID -> PendingDocument，用于并发去重和在完成前隐藏新文档
+        self._ingesting = {}
+        
+        # 清理上次运行中断时未提交版本写入的文本块
+        self._recover_interrupted_writes()
+        
+        # 后台压缩状态（清理软删除文档的向量）
+        self._vacuum_thread = None
+        self._vacuum_lock = threading.Lock()  # 同时只运行一次压缩
+        self.last_vacuum = None
+        
         # 初始化聊天模型
-        self.chat_model = ChatModel()
+        self.chat_model = get_chat_model()
         
-        # 文本分割器
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
+        # 异步接口使用的有界线程池：嵌入、向量检索、文档解析等没有异步客户端的阻塞操作在这里执行
+        self._executor = ThreadPoolExecutor(
+            max_workers=config.rag_executor_workers,
+            thread_name_prefix="rag"
         )
         
+        # 文本分割器（按配置的分块模式和大小），版本号记录在每个文档的元数据中
+        self.text_splitter = create_text_splitter()
+        self.chunker_version = get_chunker_version()
+        
         print(f"SUCCESS: RAG服务初始化完成，使用: {self._get_current_store_name()}")
     
     def _load_document_metadata(self):
@@ -84,14 +196,54 @@ class SimpleRAGService:
         return {}
     
     def _save_document_metadata(self):
-        """保存文档metadata"""
+        """保存文档metadata（同时把预留日志压缩为尚未了结的预留）"""
         try:
             import json
             with open(self.metadata_file_path, 'w', encoding='utf-8') as f:
                 json.dump(self.document_metadata, f, ensure_ascii=False, indent=2)
+            self._rewrite_reservation_log()
         except Exception as e:
             print(f"⚠️  保存metadata时出错: {e}")
     
+    def _append_reservation(self, record: dict):
+        """把一条预留记录追加到预留日志并刷盘"""
+        import json
+        self.reservation_log_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.reservation_log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self._unresolved[record["doc_id"]] = record
+    
+    def _rewrite_reservation_log(self):
+        """元数据已落盘：已提交的预留不再需要，日志只保留尚未了结的预留"""
+        import json
+        if not self._unresolved:
+            if self.reservation_log_path.exists():
+                os.unlink(self.reservation_log_path)
+            return
+        tmp_path = self.reservation_log_path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for record in self._unresolved.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.reservation_log_path)
+    
+    def _load_reservations(self) -> List[dict]:
+        """读取预留日志（忽略进程中断留下的不完整尾行）"""
+        import json
+        records = []
+        if not self.reservation_log_path.exists():
+            return records
+        with open(self.reservation_log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        return records
+    
     def _get_next_doc_id(self):
         """基于现有metadata确定下一个文档ID"""
         if not self.document_metadata:
@@ -126,7 +278,12 @@ class SimpleRAGService:
         elif store_type.startswith("faiss_"):
             store_config = get_store_config(store_type)
             index_type = store_config.get("index_type", "IndexFlatL2")
-            vector_store = FAISSVectorStore(self.embeddings, index_type, store_path)
+            vector_store = FAISSVectorStore(
+                self.embeddings, index_type, store_path,
+                persistence_mode=config.faiss_persistence_mode,
+                compact_threshold=config.faiss_wal_compact_threshold,
+                index_params=config.get_faiss_index_params()
+            )
             # 尝试加载现有存储
             vector_store.load()
             return vector_store
@@ -151,148 +308,662 @@ class SimpleRAGService:
         else:
             raise ValueError(f"不支持的向量存储类型: {store_type}")
     
+    def _create_keyword_index(self):
+        """创建BM25索引；索引文件不存在时从向量存储中已有的文本块重建"""
+        index_path = None if isinstance(self.vector_store, MemoryVectorStore) else config.get_bm25_index_path()
+        keyword_index = BM25Index(index_path, k1=config.bm25_k1, b=config.bm25_b,
+                                  compact_threshold=config.bm25_compact_threshold)
+        if keyword_index.load() or not hasattr(self.vector_store, 'iter_documents'):
+            return keyword_index
+        
+        try:
+            batch = []
+            for doc in self.vector_store.iter_documents():
+                batch.append(doc)
+                if len(batch) >= 1000:
+                    keyword_index.add_documents(batch)
+                    batch = []
+            keyword_index.add_documents(batch)
+            if len(keyword_index):
+                print(f"🔤 已从向量存储重建BM25索引: {len(keyword_index)} 个文本块")
+                keyword_index.save()
+        except Exception as e:
+            print(f"⚠️  重建BM25索引失败，关键词检索只覆盖之后上传的文档: {e}")
+        return keyword_index
+    
     def _get_current_store_name(self) -> str:
         """获取当前存储类型的显示名称"""
         info = self.vector_store.get_info()
         return info.get("type", "unknown")
     
-    def process_document(self, file_path: str, file_content: bytes = None) -> tuple[bool, str]:
-        """处理文档并添加到向量存储，返回(成功状态, 文档ID)"""
+    @staticmethod
+    def _file_hash(file_path: str) -> str:
+        """分块计算文件内容的SHA-256"""
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                hasher.update(block)
+        return hasher.hexdigest()
+    
+    def _find_document(self, content_hash: str = None, source: str = None):
+        """
+        按内容哈希或来源标识查找未删除的文档（内容哈希也会匹配正在处理的文档），返回文档ID
+        
+        不按文件名匹配：不同来源的同名文件（例如两个 report.pdf）是不同的文档
+        """
+        if content_hash:
+            for doc_id, pending in list(self._ingesting.items()):
+                if pending.content_hash == content_hash:
+                    return doc_id
+        for doc_id, info in self.document_metadata.items():
+            if info.get("deleted", False):
+                continue
+            if content_hash and info.get("content_hash") == content_hash:
+                return doc_id
+            if source and info.get("source") == source:
+                return doc_id
+        return None
+    
+    def process_document(self, file_path: str, file_content: bytes = None,
+                         progress_callback: Callable[[str, int, int], None] = None,
+                         filename: str = None, content_hash: str = None,
+                         document_id: str = None, source: str = None) -> tuple[bool, str]:
+        """
+        处理文档并添加到向量存储，返回(成功状态, 文档ID)
+        
+        文档按页/按块惰性解析和切分，文本块边解析边嵌入，每个批次嵌入完成后立即写入向量存储，
+        内存占用与文件大小无关；文档处理完成前，新文档的文本块不会出现在检索结果中
+        
+        去重规则：
+        - 内容与已有文档完全相同：直接返回已有文档ID，不解析、不嵌入、不写索引
+        - 已有文档的新版本（显式指定 document_id，或 source 与已有文档相同）：沿用原文档ID，
+          只嵌入和写入新增的文本块，移除已不存在的文本块；仅文件名相同不视为新版本
+        
+        Args:
+            file_path: 文档路径
+            file_content: 保留参数
+            progress_callback: 进度回调 (阶段, 已完成块数, 已解析块数)，
+                阶段依次为 parsing / embedding / indexing / saving
+            filename: 原始文件名（上传时保存的文件名带有随机前缀），默认取 file_path 的文件名
+            content_hash: 文件内容的SHA-256（上传时已计算），未提供时在这里计算
+            document_id: 要替换的已有文档ID（上传新版本时指定）
+            source: 稳定的来源标识（如文件的绝对路径），同一来源再次摄取时作为新版本
+        """
+        def report(stage: str, done: int = 0, total: int = 0):
+            if progress_callback:
+                progress_callback(stage, done, total)
+        
+        # 检查文件是否存在
+        if not Path(file_path).exists():
+            return False, None
+        if Path(file_path).suffix.lower() not in SUPPORTED_EXTENSIONS:
+            return False, None
+        
         try:
-            # 检查文件是否存在
-            if not Path(file_path).exists():
-                return False, None
-            
-            filename = Path(file_path).name
+            # 文档级去重：相同内容直接复用已有文档
+            existing_id, pending = self.reserve_document(file_path, filename, content_hash,
+                                                         document_id=document_id, source=source)
+            if existing_id is not None:
+                print(f"📎 文档内容与已有文档 {existing_id} 相同，跳过处理")
+                return True, existing_id
+        except Exception as e:
+            print(f"❌ 处理文档时出现异常: {e}")
+            return False, str(e)
+        
+        try:
+            report("parsing")
+            chunks = self.tag_new_chunks(pending, iter_document_chunks(file_path, self.text_splitter))
             
-            # 加载文档
-            file_extension = Path(file_path).suffix.lower() #后缀
+            # 解析、嵌入与写入流水线：嵌入不持有写锁，每个批次完成后短暂持锁写入
+            print(f"🧮 流式嵌入文本块（每批 {self.embedding_pipeline.batch_size}，"
+                  f"并发 {self.embedding_pipeline.max_workers}）...")
+            for batch, vectors in self.embedding_pipeline.iter_batches(chunks):
+                self.write_chunks(batch, vectors)
+                pending.written_ids.extend(chunk.metadata["chunk_id"] for chunk in batch)
+                report("embedding", len(pending.written_ids), len(pending.chunk_ids))
             
-            if file_extension == '.pdf':
-                loader = PyPDFLoader(file_path)
-                documents = loader.load()   # 加载（每页一个 Document）
-            elif file_extension == '.txt':
-                # 直接读取文本文件内容，支持多种编码
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, 'r', encoding='gbk') as f:
-                            content = f.read()
-                    except UnicodeDecodeError:
-                        with open(file_path, 'r', encoding='latin1') as f:
-                            content = f.read()
-                
-                # 创建Document对象
-                from langchain.schema import Document
-                documents = [Document(page_content=content, metadata={"source": file_path})]
-            elif file_extension in ['.doc', '.docx']:
-                # 处理 Word 文档
-                try:
-                    loader = Docx2txtLoader(file_path)
-                    documents = loader.load()
-                except Exception as e:
-                    print(f"❌ Word 文档加载失败: {e}")
-                    return False, f"Word 文档处理失败: {str(e)}"
-            else:
-                return False, None
-
-            # 分割文档
-            chunks = self.text_splitter.split_documents(documents)
+            report("indexing", len(pending.written_ids), len(pending.chunk_ids))
+            self.commit_document(pending, save=False)
             
-            # 为每个chunk添加document_id到metadata
-            doc_id = str(self.next_doc_id)
-            for chunk in chunks:
-                chunk.metadata["document_id"] = doc_id
-                chunk.metadata["filename"] = filename
+            report("saving", len(pending.written_ids), len(pending.chunk_ids))
+            self.save()
+            return True, pending.doc_id
             
-            # 添加到向量存储
-            success = self.vector_store.add_documents(chunks)
+        except Exception as e:
+            print(f"❌ 处理文档时出现异常: {e}")
+            import traceback
+            traceback.print_exc()
+            self.discard_document(pending)
+            return False, str(e)
+        finally:
+            self.release_document(pending)
+    
+    # ==================== 文档摄取阶段（单文档和批量摄取共用） ====================
+    
+    def reserve_document(self, file_path: str, filename: str = None, content_hash: str = None,
+                         document_id: str = None, source: str = None):
+        """
+        摄取第一阶段：文档级去重并预留文档ID
+        
+        Args:
+            document_id: 要替换的已有文档ID；不存在或已删除时抛出 ValueError
+            source: 稳定的来源标识，与已有文档相同时作为该文档的新版本
+        
+        Returns:
+            (已有文档ID, None)：内容与已有（或正在处理的）文档相同
+            (None, PendingDocument)：需要处理的文档
+        """
+        content_hash = content_hash or self._file_hash(file_path)
+        filename = filename or Path(file_path).name
+        
+        with self._write_lock:
+            existing_id = self._find_document(content_hash=content_hash)
+            if existing_id is not None:
+                existing = self.document_metadata.get(existing_id)
+                rechunkable = (existing is not None and existing.get("chunk_ids")
+                               and hasattr(self.vector_store, 'delete_chunks'))
+                if not rechunkable or existing.get("chunker") == self.chunker_version:
+                    return existing_id, None
+                # 内容相同但分块配置已变化：按新分块器重新切分，作为该文档的新版本处理
+                print(f"✂️ 文档 {existing_id} 由 {existing.get('chunker', '旧版分块器')} 切分，"
+                      f"按 {self.chunker_version} 重新处理")
+                previous_id = existing_id
+            elif document_id is not None:
+                # 显式替换已有文档：新版本只处理新增的文本块（需要存储支持按块删除旧块）
+                target = self.document_metadata.get(document_id)
+                if target is None or target.get("deleted", False):
+                    raise ValueError(f"要替换的文档 {document_id} 不存在或已删除")
+                previous_id = document_id
+            else:
+                # 同一来源再次摄取时作为新版本；上传的文件没有稳定来源，只按内容去重
+                previous_id = self._find_document(source=source) if source else None
+            previous_chunks = {}
+            if previous_id is not None and hasattr(self.vector_store, 'delete_chunks'):
+                previous_chunks = dict(self.document_metadata[previous_id].get("chunk_ids", {}))
             
-            if success:
-                # 记录文档信息
-                self.document_metadata[doc_id] = {
-                    "filename": filename,
-                    "chunks": len(chunks),
-                    "timestamp": datetime.now().isoformat(),
-                    "file_path": file_path,
-                    "deleted": False  # 软删除标记位
-                }
+            if previous_chunks:
+                doc_id = previous_id
+                if doc_id in self._ingesting:
+                    # 同一文档的两个新版本同时处理会互相覆盖预留记录，后到的直接拒绝
+                    raise RuntimeError(f"文档 {doc_id} 的另一个版本正在处理中，请稍后再试")
+                info = self.document_metadata[doc_id]
+                # 版本号跳过中断或失败的版本：它们的块ID可能仍以墓碑形式留在索引中
+                revision = max(info.get("revision", 0), info.get("revision_reserved", 0)) + 1
+                info["revision_reserved"] = revision
+            else:
+                # 预留新的文档ID
+                doc_id = str(self.next_doc_id)
                 self.next_doc_id += 1
-                
-                if hasattr(self.vector_store, 'save'):
-                    save_result = self.vector_store.save()
-
-                
-                # 保存document metadata
-                self._save_document_metadata()
-                
-                return True, doc_id
+                revision = 0
+            # 写入前先把预留记入日志：进程中断时重启据此清理已写入的块，ID和版本号也不会被复用
+            self._append_reservation({
+                "doc_id": doc_id,
+                "revision": revision,
+                "filename": filename,
+                "file_path": file_path
+            })
+            
+            pending = PendingDocument(
+                doc_id=doc_id,
+                file_path=file_path,
+                filename=filename,
+                content_hash=content_hash,
+                source=source,
+                revision=revision,
+                previous_chunks=previous_chunks
+            )
+            self._ingesting[doc_id] = pending
+            return None, pending
+    
+    def tag_new_chunks(self, pending: "PendingDocument", chunks) -> Generator:
+        """摄取第二阶段：去掉文档内重复和上一版本已有的文本块，为新文本块补充元数据"""
+        for chunk in chunks:
+            h = text_hash(chunk.page_content)
+            if h in pending.chunk_ids:
+                continue
+            if h in pending.previous_chunks:
+                pending.chunk_ids[h] = pending.previous_chunks[h]
+                continue
+            # chunk_id 带上版本号：旧版本删除的块在新版本中重新出现时不会与墓碑ID冲突
+            chunk_id = f"{pending.doc_id}_{pending.revision}_{h[:16]}"
+            pending.chunk_ids[h] = chunk_id
+            pending.new_chunks += 1
+            chunk.metadata["document_id"] = pending.doc_id
+            chunk.metadata["filename"] = pending.filename
+            chunk.metadata["chunk_id"] = chunk_id
+            yield chunk
+    
+    def write_chunks(self, chunks: list, vectors: list):
+        """摄取第三阶段：写入一个批次的文本块和向量（不保存到磁盘）"""
+        with self._write_lock:
+            if hasattr(self.vector_store, 'add_embeddings'):
+                success = self.vector_store.add_embeddings(chunks, vectors)
             else:
-                print(f"❌ 向量存储添加失败")
+                success = self.vector_store.add_documents(chunks)
+            if not success:
+                raise RuntimeError("向量存储添加失败")
+            if self.keyword_index is not None:
+                self.keyword_index.add_documents(chunks)
+    
+    def commit_document(self, pending: "PendingDocument", save: bool = True):
+        """摄取第四阶段：移除旧版本已不存在的文本块并记录文档信息，使文档对检索可见"""
+        with self._write_lock:
+            stale_chunk_ids = []
+            if pending.revision > 0:
+                print(f"🔁 文档 {pending.doc_id} 的新版本：新增 {len(pending.written_ids)} 个文本块，"
+                      f"复用 {len(pending.chunk_ids) - len(pending.written_ids)} 个")
+                if self.document_metadata.get(pending.doc_id, {}).get("deleted", True):
+                    # 只嵌入了新增的块，旧版本已被删除时无法补齐复用的块
+                    raise RuntimeError("被替换的文档在处理期间被删除，请重新上传")
+                stale_chunk_ids = [cid for h, cid in pending.previous_chunks.items() if h not in pending.chunk_ids]
+                if stale_chunk_ids:
+                    print(f"🗑️ 移除 {len(stale_chunk_ids)} 个已不存在的文本块")
+                    if not self.vector_store.delete_chunks(stale_chunk_ids).get("success", False):
+                        raise RuntimeError("移除旧版本文本块失败")
+                    if self.keyword_index is not None:
+                        self.keyword_index.remove_chunks(stale_chunk_ids)
             
-            return False, None
+            # 记录文档信息
+            self.document_metadata[pending.doc_id] = {
+                "filename": pending.filename,
+                "chunks": len(pending.chunk_ids),
+                "timestamp": datetime.now().isoformat(),
+                "file_path": pending.file_path,
+                "content_hash": pending.content_hash,
+                "source": pending.source,  # 稳定的来源标识（上传的文件为 None）
+                "chunk_ids": pending.chunk_ids,  # 文本块内容哈希 -> 块ID
+                "revision": pending.revision,
+                "chunker": self.chunker_version,  # 切分该文档的分块器版本
+                "deleted": False  # 软删除标记位
+            }
+            self._release_reservation(pending)
+            self._resolve_reservation(pending)
+            if pending.revision > 0:
+                self._invalidate_answers(pending.doc_id)
             
+            if save:
+                self.save()
+            if stale_chunk_ids:
+                # 被替换的块以墓碑形式留在索引中，积累较多时在后台物理清理
+                self._maybe_auto_vacuum()
+    
+    def save(self):
+        """保存向量存储和文档元数据"""
+        with self._write_lock:
+            if hasattr(self.vector_store, 'save'):
+                self.vector_store.save()
+            if self.keyword_index is not None:
+                self.keyword_index.save()
+            self._save_document_metadata()
+    
+    def release_document(self, pending: "PendingDocument"):
+        """结束摄取（无论成功与否），不再把文档视为处理中；没有写入任何块的预留随之了结"""
+        with self._write_lock:
+            if self._ingesting.get(pending.doc_id) is pending:
+                self._release_reservation(pending)
+                if not pending.written_ids:
+                    self._resolve_reservation(pending)
+    
+    def _release_reservation(self, pending: "PendingDocument"):
+        """移除预留记录（只移除本次摄取自己的记录，不影响同一文档ID的其他预留）"""
+        if self._ingesting.get(pending.doc_id) is pending:
+            del self._ingesting[pending.doc_id]
+    
+    def _resolve_reservation(self, pending: "PendingDocument"):
+        """预留已了结（已提交或写入的块已清理），下次保存元数据时从预留日志中移除"""
+        record = self._unresolved.get(pending.doc_id)
+        if record is not None and record["revision"] == pending.revision:
+            del self._unresolved[pending.doc_id]
+    
+    def discard_document(self, pending: "PendingDocument"):
+        """处理失败时清理已经写入的文本块"""
+        with self._write_lock:
+            self._release_reservation(pending)
+            if not pending.written_ids:
+                self._resolve_reservation(pending)
+                return
+            try:
+                if self.keyword_index is not None:
+                    self.keyword_index.remove_chunks(pending.written_ids)
+                if pending.revision > 0:
+                    # 新版本失败：移除本次新增的块，保留上一版本
+                    if self.vector_store.delete_chunks(pending.written_ids).get("success", False):
+                        self._resolve_reservation(pending)
+                    self._invalidate_answers(pending.doc_id)
+                else:
+                    # 新文档失败：记录为已删除，检索时排除，压缩时物理移除
+                    self.document_metadata[pending.doc_id] = {
+                        "filename": pending.filename,
+                        "chunks": len(pending.written_ids),
+                        "timestamp": datetime.now().isoformat(),
+                        "file_path": pending.file_path,
+                        "deleted": True,
+                        "deleted_timestamp": datetime.now().isoformat(),
+                        "failed": True  # 处理失败留下的部分文本块
+                    }
+                    self._resolve_reservation(pending)
+                self.save()
+                print(f"🧹 已标记文档 {pending.doc_id} 处理失败时写入的 {len(pending.written_ids)} 个文本块")
+            except Exception as e:
+                print(f"⚠️ 清理部分写入的文本块失败: {e}")
+        self._maybe_auto_vacuum()
+    
+    def _recover_interrupted_writes(self):
+        """
+        启动时清理上次运行中断的摄取（预留日志中仍未了结、且元数据中没有提交结果的预留）
+        
+        - 新文档：记录为已删除的失败文档，已写入的块在检索中被排除、压缩时物理移除，ID不再复用
+        - 新版本：删除该版本已写入的文本块（块ID以 "<文档ID>_<版本号>_" 开头），上一版本保持不变
+        """
+        try:
+            records = self._load_reservations()
         except Exception as e:
-            print(f"❌ 处理文档时出现异常: {e}")
-            import traceback
-            traceback.print_exc()
-            return False, None
+            print(f"⚠️ 读取预留日志失败: {e}")
+            return
+        interrupted_docs, interrupted_revisions = [], []
+        for record in records:
+            doc_id, revision = record["doc_id"], record["revision"]
+            info = self.document_metadata.get(doc_id)
+            if revision == 0 and info is None:
+                interrupted_docs.append(record)
+            elif revision > 0 and info is not None and info.get("revision", 0) < revision:
+                interrupted_revisions.append(record)
+        
+        orphan_ids = []
+        try:
+            prefixes = tuple(f"{r['doc_id']}_{r['revision']}_" for r in interrupted_revisions)
+            if prefixes and hasattr(self.vector_store, 'iter_documents') and hasattr(self.vector_store, 'delete_chunks'):
+                orphan_ids = [
+                    doc.metadata["chunk_id"] for doc in self.vector_store.iter_documents()
+                    if str(doc.metadata.get("chunk_id", "")).startswith(prefixes)
+                ]
+                if orphan_ids:
+                    if not self.vector_store.delete_chunks(orphan_ids).get("success", False):
+                        raise RuntimeError("删除未提交版本的文本块失败")
+                    if self.keyword_index is not None:
+                        self.keyword_index.remove_chunks(orphan_ids)
+                    print(f"🧹 删除上次中断时未提交版本写入的 {len(orphan_ids)} 个文本块")
+            
+            for record in interrupted_revisions:
+                info = self.document_metadata[record["doc_id"]]
+                info["revision_reserved"] = max(info.get("revision_reserved", 0), record["revision"])
+            now = datetime.now().isoformat()
+            for record in interrupted_docs:
+                self.document_metadata[record["doc_id"]] = {
+                    "filename": record.get("filename"),
+                    "chunks": 0,  # 中断前写入的块数未知
+                    "timestamp": now,
+                    "file_path": record.get("file_path"),
+                    "deleted": True,
+                    "deleted_timestamp": now,
+                    "failed": True
+                }
+            self.next_doc_id = self._get_next_doc_id()
+            
+            # 保存元数据的同时清空预留日志
+            if orphan_ids:
+                self.save()
+            elif records:
+                self._save_document_metadata()
+            if interrupted_docs or interrupted_revisions:
+                print(f"🩹 已恢复 {len(interrupted_docs) + len(interrupted_revisions)} 个中断的文档摄取")
+        except Exception as e:
+            # 保留这些预留，之后保存元数据时不会把它们从日志中丢掉
+            self._unresolved.update({record["doc_id"]: record for record in records})
+            print(f"⚠️ 清理中断的摄取失败，下次启动时重试: {e}")
     
-    def rag_chat(self, query: str, use_context: bool = True) -> str:
-        """RAG聊天"""
+    def retrieve(self, query: str, k: int = 3) -> RetrievalResult:
+        """
+        检索相关文档块 - 已删除的文档在向量存储内部排除
+        启用混合检索时同时进行BM25关键词检索，与向量检索结果按倒数排名融合；
+        启用重排序时再对候选重新打分，返回重排序后的前 k 个
+        
+        返回的 RetrievalResult 可以直接传给 rag_chat / rag_chat_stream，
+        调用方复用同一批命中结果展示来源，无需再检索一次
+        """
+        excluded = self._excluded_document_ids()
+        # 启用重排序时多取一些候选，由重排序选出前 k 个
+        pool = max(k, config.rerank_candidates) if self.rerank_stage else k
+        hybrid = self.keyword_index is not None and len(self.keyword_index) > 0
+        if not hybrid:
+            results = self.vector_store.similarity_search_with_score(query, k=pool, exclude_document_ids=excluded)
+        else:
+            # 混合检索：两路各取较多候选，按倒数排名融合（分数为融合分数，越大越相关）
+            candidates = max(pool, config.hybrid_candidate_k)
+            vector_hits = self.vector_store.similarity_search_with_score(
+                query, k=candidates, exclude_document_ids=excluded
+            )
+            keyword_hits = self.keyword_index.search(query, k=candidates, exclude_document_ids=excluded)
+            results = reciprocal_rank_fusion([vector_hits, keyword_hits], k=config.rrf_k)
+        # 存储层已经排除，这里只是兜底（例如检索期间有文档刚被删除）
+        filtered_results = self._filter_deleted_documents(results)[:pool]
+        relevance = {id(doc): self._relevance(score, hybrid) for doc, score in filtered_results}
+        if self.rerank_stage:
+            hits = self.rerank_stage.rerank(query, filtered_results, k)
+        else:
+            hits = filtered_results[:k]
+        return RetrievalResult(query=query, hits=hits, relevance=relevance)
+    
+    def _relevance(self, score: float, hybrid: bool) -> float:
+        """
+        把检索分数归一化为 [0, 1] 的相关度
+        
+        - 混合检索：倒数排名融合分数除以两路都排第一时的最大值 2 / (rrf_k + 1)
+        - 向量检索：由向量存储按自己的距离度量换算；不支持时把分数当作距离，取 1 / (1 + 距离)
+        """
+        if hybrid:
+            return min(float(score) * (config.rrf_k + 1) / 2, 1.0)
+        if hasattr(self.vector_store, 'relevance_score'):
+            relevance = self.vector_store.relevance_score(score)
+            if relevance is not None:
+                return relevance
+        return 1.0 / (1.0 + max(float(score), 0.0))
+    
+    @staticmethod
+    def _context_budget(query: str) -> int:
+        """文档上下文的token预算：不超过配置上限，也不能挤占系统提示词、问题和回答的空间"""
+        # 64 为提示模板自身的估计开销
+        available = (config.llm_context_window - config.llm_answer_reserve_tokens
+                     - count_tokens(config.system_prompt) - count_tokens(query) - 64)
+        return max(0, min(config.rag_context_max_tokens, available))
+    
+    def _build_context(self, retrieval: RetrievalResult) -> str:
+        """根据检索结果构建上下文（去重、合并相邻块，按token预算截断低分尾部）"""
+        no_context = "注意：没有找到相关文档，请基于常识回答。"
+        if not retrieval.has_context:
+            return no_context
+        
+        budget = self._context_budget(retrieval.query)
+        if budget <= 0:
+            print(f"⚠️  上下文预算为 0：问题和提示词已占满上下文窗口，丢弃 {len(retrieval.hits)} 个文本块")
+            return "注意：问题过长，超出了上下文预算，检索到的文档无法放入，请基于常识回答。"
+        
+        context, stats = self.context_builder.build(retrieval.hits, budget)
+        print(f"📦 上下文: {stats.hits} 个文本块 -> {stats.segments} 段，"
+              f"{stats.tokens}/{stats.budget} tokens（丢弃 {stats.dropped} 个）")
+        return context or no_context
+    
+    # ==================== 语义回答缓存 ====================
+    
+    def _invalidate_answers(self, document_id: str):
+        """文档删除或重新摄取后，使用过该文档的缓存回答全部失效"""
+        if self.answer_cache is not None:
+            self.answer_cache.invalidate_documents([document_id])
+    
+    def _lookup_answer(self, retrieval: RetrievalResult):
+        """
+        按 (模型, 检索到的块ID集合, 查询向量) 查找缓存回答
+        
+        Returns:
+            AnswerLookup；未启用缓存或无法计算查询向量时返回 None
+        """
+        if self.answer_cache is None:
+            return None
+        try:
+            # 检索时已经计算过查询向量，这里通常直接命中查询向量缓存
+            vector = self.embeddings.embed_query(retrieval.query)
+        except Exception as e:
+            print(f"⚠️  回答缓存无法获取查询向量: {e}")
+            return None
+        chunk_ids = [doc.metadata.get("chunk_id") or text_hash(doc.page_content) for doc in retrieval.documents]
+        key = self.answer_cache.make_key(config.ollama_model, chunk_ids)
+        lookup = AnswerLookup(key=key, vector=vector, epoch=self.answer_cache.epoch)
+        lookup.cached = self.answer_cache.get(key, vector)
+        if lookup.cached is not None:
+            print(f"⚡ 命中回答缓存（原问题: '{lookup.cached.query[:30]}'）")
+        return lookup
+    
+    @staticmethod
+    def _is_generation_error(text: str) -> bool:
+        """模型调用失败时，聊天模型以错误提示代替（或接在部分输出之后）返回"""
+        return text.startswith("生成响应时发生错误")
+    
+    def _store_answer(self, lookup, retrieval: RetrievalResult, answer: str, chunks: List[str] = None):
+        """缓存新生成的回答（生成失败的回答不缓存）"""
+        if lookup is None or not answer or self._is_generation_error(answer):
+            return
+        document_ids = {doc.metadata.get("document_id") for doc in retrieval.documents} - {None}
+        self.answer_cache.put(lookup.key, retrieval.query, lookup.vector, answer,
+                              chunks or [answer], document_ids, lookup.epoch)
+    
+    def rag_chat(self, query: str, use_context: bool = True, retrieval: RetrievalResult = None) -> str:
+        """
+        RAG聊天
+        
+        Args:
+            query: 用户问题
+            use_context: 是否使用文档上下文
+            retrieval: 已有的检索结果，传入时不再重复检索
+        """
         if not use_context:
             return self.chat_model.generate_response(query)
         
         try:
-            # 检索相关文档 - 过滤已删除的文档
-            search_k = min(9, 20)  # 搜索更多结果以应对删除过滤
-            results = self.vector_store.similarity_search_with_score(query, k=search_k) #过滤已删除的文档
-            filtered_results = self._filter_deleted_documents(results)
-            filtered_results = filtered_results[:3]  # 限制最终结果为3个
-            
-            if not filtered_results:
-                return self.chat_model.generate_response(query, "注意：没有找到相关文档，请基于常识回答。")
-            
-            # 构建上下文
-            context_parts = []
-            for doc, score in filtered_results:
-                context_parts.append(f"文档内容：{doc.page_content}")
-            
-            context = "\n\n".join(context_parts)
-            
-            return self.chat_model.generate_response(query, context)
+            if retrieval is None:
+                retrieval = self.retrieve(query, k=3)
+            lookup = self._lookup_answer(retrieval)
+            if lookup is not None and lookup.cached is not None:
+                return lookup.cached.answer
+            context = self._build_context(retrieval)
+            answer = self.chat_model.generate_response(query, context)
+            self._store_answer(lookup, retrieval, answer)
+            return answer
             
         except Exception as e:
             return self.chat_model.generate_response(query)
     
-    def rag_chat_stream(self, query: str, use_context: bool = True) -> Generator[str, None, None]:
-        """RAG流式聊天"""
+    def rag_chat_stream(self, query: str, use_context: bool = True,
+                        retrieval: RetrievalResult = None) -> Generator[str, None, None]:
+        """
+        RAG流式聊天
+        
+        Args:
+            query: 用户问题
+            use_context: 是否使用文档上下文
+            retrieval: 已有的检索结果，传入时不再重复检索（调用方可先 retrieve 再复用其来源信息）
+        """
         if not use_context:
             yield from self.chat_model.generate_stream_response(query)
             return
         
         try:
-            # 检索相关文档 - 过滤已删除的文档
-            search_k = min(9, 20)  # 搜索更多结果以应对删除过滤
-            results = self.vector_store.similarity_search_with_score(query, k=search_k)
-            filtered_results = self._filter_deleted_documents(results)
-            filtered_results = filtered_results[:3]  # 限制最终结果为3个
-            
-            if not filtered_results:
-                yield from self.chat_model.generate_stream_response(query, "注意：没有找到相关文档，请基于常识回答。")
-            else:
-                # 构建上下文
-                context_parts = []
-                for doc, score in filtered_results:
-                    context_parts.append(f"文档内容：{doc.page_content}")
-                
-                context = "\n\n".join(context_parts)
-                yield from self.chat_model.generate_stream_response(query, context)
-            
+            if retrieval is None:
+                retrieval = self.retrieve(query, k=3)
+            lookup = self._lookup_answer(retrieval)
+            if lookup is None or lookup.cached is None:
+                context = self._build_context(retrieval)
         except Exception as e:
             yield from self.chat_model.generate_stream_response(query)
+            return
+        
+        if lookup is not None and lookup.cached is not None:
+            # 命中缓存：按原来的分块回放
+            yield from lookup.cached.chunks
+            return
+        
+        chunks = []
+        failed = False  # 错误提示可能出现在部分输出之后，整段回答都不能缓存
+        for chunk in self.chat_model.generate_stream_response(query, context):
+            failed = failed or self._is_generation_error(chunk)
+            chunks.append(chunk)
+            yield chunk
+        if not failed:
+            self._store_answer(lookup, retrieval, "".join(chunks), chunks)
+    
+    # ==================== 异步接口 ====================
+    # 供 FastAPI 等异步框架调用：LLM 生成走异步HTTP，其余阻塞操作放到有界线程池，
+    # 不会阻塞事件循环，并发用户之间互不排队
+    
+    async def _run_blocking(self, func, *args, **kwargs):
+        """在有界线程池中执行阻塞函数"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, partial(func, *args, **kwargs))
+    
+    async def aretrieve(self, query: str, k: int = 3) -> RetrievalResult:
+        """异步检索相关文档块（参数同 retrieve）"""
+        return await self._run_blocking(self.retrieve, query, k)
+    
+    async def asearch_documents(self, query: str, k: int = 3) -> list:
+        """异步搜索相关文档（参数同 search_documents）"""
+        return await self._run_blocking(self.search_documents, query, k)
+    
+    async def aprocess_document(self, file_path: str, file_content: bytes = None,
+                                progress_callback: Callable[[str, int, int], None] = None,
+                                filename: str = None, content_hash: str = None,
+                                document_id: str = None, source: str = None) -> tuple[bool, str]:
+        """异步处理文档（参数同 process_document，progress_callback 在工作线程中调用）"""
+        return await self._run_blocking(self.process_document, file_path, file_content, progress_callback,
+                                        filename=filename, content_hash=content_hash,
+                                        document_id=document_id, source=source)
+    
+    async def arag_chat(self, query: str, use_context: bool = True, retrieval: RetrievalResult = None) -> str:
+        """异步RAG聊天（参数同 rag_chat）"""
+        if not use_context:
+            return await self.chat_model.agenerate_response(query)
+        
+        try:
+            if retrieval is None:
+                retrieval = await self.aretrieve(query, k=3)
+            lookup = await self._run_blocking(self._lookup_answer, retrieval)
+            if lookup is not None and lookup.cached is not None:
+                return lookup.cached.answer
+            context = await self._run_blocking(self._build_context, retrieval)
+        except Exception as e:
+            return await self.chat_model.agenerate_response(query)
+        
+        answer = await self.chat_model.agenerate_response(query, context)
+        self._store_answer(lookup, retrieval, answer)
+        return answer
+    
+    async def arag_chat_stream(self, query: str, use_context: bool = True,
+                               retrieval: RetrievalResult = None) -> AsyncGenerator[str, None]:
+        """异步RAG流式聊天（参数同 rag_chat_stream）"""
+        context = None
+        lookup = None
+        if use_context:
+            try:
+                if retrieval is None:
+                    retrieval = await self.aretrieve(query, k=3)
+                lookup = await self._run_blocking(self._lookup_answer, retrieval)
+                if lookup is not None and lookup.cached is not None:
+                    # 命中缓存：按原来的分块回放
+                    for chunk in lookup.cached.chunks:
+                        yield chunk
+                    return
+                # 计算token数和合并文本块都是CPU密集操作，放到线程池中，不阻塞事件循环
+                context = await self._run_blocking(self._build_context, retrieval)
+            except Exception as e:
+                context = None
+                lookup = None
+        
+        chunks = []
+        failed = False  # 错误提示可能出现在部分输出之后，整段回答都不能缓存
+        async for chunk in self.chat_model.agenerate_stream_response(query, context):
+            failed = failed or self._is_generation_error(chunk)
+            chunks.append(chunk)
+            yield chunk
+        if not failed:
+            self._store_answer(lookup, retrieval, "".join(chunks), chunks)
     
     def get_status(self) -> dict:
         """获取RAG服务状态"""
@@ -306,9 +977,30 @@ class SimpleRAGService:
             "available": True,
             "vector_store": store_info,
             "embedding_model": config.ollama_embedding_model,
-            "chat_model": config.ollama_model
+            "embedding_cache": self.embedding_cache.get_stats() if self.embedding_cache else {"enabled": False},
+            "query_embedding_cache": (self.query_embedding_cache.get_stats()
+                                      if self.query_embedding_cache else {"enabled": False}),
+            "keyword_index": self.keyword_index.get_stats() if self.keyword_index else {"enabled": False},
+            "answer_cache": self.answer_cache.get_stats() if self.answer_cache else {"enabled": False},
+            "reranker": self.rerank_stage.get_stats() if self.rerank_stage else {"enabled": False},
+            "chat_model": config.ollama_model,
+            "vacuum": {
+                "running": self.vacuum_running(),
+                "deleted_chunks": self._deleted_chunk_stats()[0],
+                "last_result": self.last_vacuum
+            }
         }
     
+    def _deleted_document_ids(self) -> List[str]:
+        """已软删除的文档ID"""
+        return [doc_id for doc_id, info in self.document_metadata.items() if info.get('deleted', False)]
+    
+    def _excluded_document_ids(self) -> List[str]:
+        """检索时需要排除的文档ID：已软删除的文档和尚未处理完成的新文档"""
+        excluded = self._deleted_document_ids()
+        excluded.extend(doc_id for doc_id, pending in list(self._ingesting.items()) if pending.revision == 0)
+        return excluded
+
     def _filter_deleted_documents(self, search_results):
         """过滤已删除的文档"""
         filtered_results = []
@@ -327,18 +1019,10 @@ class SimpleRAGService:
     def search_documents(self, query: str, k: int = 3) -> list:
         """搜索相关文档 - 自动过滤已删除的文档"""
         try:
-            # 获取更多结果以应对删除过滤
-            search_k = min(k * 3, 20)  # 搜索更多结果，但限制在合理范围内
-            results = self.vector_store.similarity_search_with_score(query, k=search_k)
-            
-            # 过滤已删除的文档
-            filtered_results = self._filter_deleted_documents(results)
-            
-            # 限制返回结果数量
-            filtered_results = filtered_results[:k]
+            retrieval = self.retrieve(query, k=k)
             
             documents = []
-            for doc, score in filtered_results:
+            for doc, score in retrieval.hits:
                 documents.append({
                     "content": doc.page_content,
                     "metadata": doc.metadata,
@@ -353,129 +1037,244 @@ class SimpleRAGService:
         软删除文档 - 通过标记位实现（适用于不支持删除的向量数据库如FAISS）
         文档仍保留在向量存储中，但通过metadata标记为已删除，搜索时会被过滤
         """
-        try:
-            # 检查文档是否存在
-            if document_id not in self.document_metadata:
-                available_ids = list(self.document_metadata.keys())
+        # 与后台摄取共用写锁：检查、修改和保存元数据之间不能插入其他写入
+        with self._write_lock:
+            try:
+                # 检查文档是否存在
+                if document_id not in self.document_metadata:
+                    available_ids = list(self.document_metadata.keys())
+                    return {
+                        "success": False,
+                        "message": f"文档ID {document_id} 不存在",
+                        "error": f"当前可用的文档ID: {available_ids}。总共有 {len(available_ids)} 个文档。"
+                    }
+                
+                doc_info = self.document_metadata[document_id]
+                
+                # 检查是否已经被删除
+                if doc_info.get("deleted", False):
+                    return {
+                        "success": False,
+                        "message": f"文档 '{doc_info['filename']}' 已经被删除",
+                        "error": "此文档已被标记为删除状态"
+                    }
+                
+                # 软删除：标记为删除状态
+                self.document_metadata[document_id]["deleted"] = True
+                self.document_metadata[document_id]["deleted_timestamp"] = datetime.now().isoformat()
+                
+                # 保存更新的metadata
+                self._save_document_metadata()
+                self._invalidate_answers(document_id)
+                
+                # 已删除的块积累较多时，在后台物理清理
+                self._maybe_auto_vacuum()
+                
                 return {
-                    "success": False,
-                    "message": f"文档ID {document_id} 不存在",
-                    "error": f"当前可用的文档ID: {available_ids}。总共有 {len(available_ids)} 个文档。"
+                    "success": True,
+                    "message": f"文档 '{doc_info['filename']}' 已成功软删除",
+                    "detail": "文档已被标记为删除，不会在搜索中出现"
                 }
-            
-            doc_info = self.document_metadata[document_id]
-            
-            # 检查是否已经被删除
-            if doc_info.get("deleted", False):
+                    
+            except Exception as e:
                 return {
                     "success": False,
-                    "message": f"文档 '{doc_info['filename']}' 已经被删除",
-                    "error": "此文档已被标记为删除状态"
+                    "message": "软删除文档时发生错误",
+                    "error": f"技术详情: {str(e)}"
                 }
-            
-            # 软删除：标记为删除状态
-            self.document_metadata[document_id]["deleted"] = True
-            self.document_metadata[document_id]["deleted_timestamp"] = datetime.now().isoformat()
-            
-            # 保存更新的metadata
-            self._save_document_metadata()
-            
+    
+    def _deleted_chunk_stats(self) -> tuple:
+        """返回 (已删除块数, 总块数)，包括新版本替换掉、仍以墓碑形式留在索引中的块"""
+        deleted = total = 0
+        for info in self.document_metadata.values():
+            chunks = info.get("chunks", 0)
+            total += chunks
+            if info.get("deleted", False):
+                deleted += chunks
+        tombstones = self._tombstone_count()
+        return deleted + tombstones, total + tombstones
+    
+    def _tombstone_count(self) -> int:
+        """向量存储中已按块删除、尚未物理移除的块数（不属于任何已删除文档）"""
+        if not hasattr(self.vector_store, 'vacuum'):
+            return 0
+        try:
+            return self.vector_store.get_info().get("deleted_chunks", 0)
+        except Exception:
+            return 0
+    
+    def _maybe_auto_vacuum(self):
+        """已删除块的比例超过阈值时自动启动后台压缩"""
+        if not config.vacuum_auto_enabled or not hasattr(self.vector_store, 'vacuum'):
+            return
+        deleted, total = self._deleted_chunk_stats()
+        if deleted >= config.vacuum_min_deleted_chunks and total and deleted / total >= config.vacuum_deleted_ratio:
+            print(f"🧹 已删除块占比 {deleted}/{total}，自动启动后台压缩")
+            self.start_vacuum()
+    
+    def vacuum_deleted_documents(self) -> dict:
+        """
+        压缩向量存储：物理移除已软删除文档的向量和文档块，以及新版本替换掉的墓碑块
+        （复用已存储的向量，不重新嵌入）。完成后已删除文档的记录会被移除，相当于硬删除
+        """
+        if not hasattr(self.vector_store, 'vacuum'):
             return {
-                "success": True,
-                "message": f"文档 '{doc_info['filename']}' 已成功软删除",
-                "detail": "文档已被标记为删除，不会在搜索中出现"
+                "success": False,
+                "message": f"当前向量存储 ({self._get_current_store_name()}) 不需要或不支持压缩",
+                "error": "向量存储不支持压缩"
             }
-                
-        except Exception as e:
+        
+        if not self._vacuum_lock.acquire(blocking=False):
+            return {"success": True, "message": "压缩任务已在运行", "started": False}
+        try:
+            with self._write_lock:
+                deleted_ids = self._deleted_document_ids()
+                if not deleted_ids and not self._tombstone_count():
+                    return {"success": True, "message": "没有已删除的文档或文本块需要清理", "removed": 0}
+            
+            # 向量存储分批重建，期间写入和查询照常进行，重建期间的写入在切换时重放到新索引；
+            # 服务层只在最后移除文档记录时持有写锁
+            result = self.vector_store.vacuum(deleted_ids)
+            if result.get("success"):
+                with self._write_lock:
+                    for doc_id in deleted_ids:
+                        self.document_metadata.pop(doc_id, None)
+                        if self.keyword_index is not None:
+                            self.keyword_index.remove_document(doc_id)
+                    if self.keyword_index is not None:
+                        self.keyword_index.save()
+                    self._save_document_metadata()
+                result["documents_removed"] = len(deleted_ids)
+        finally:
+            self._vacuum_lock.release()
+        
+        self.last_vacuum = {**result, "finished_at": datetime.now().isoformat()}
+        return result
+    
+    def start_vacuum(self) -> dict:
+        """在后台线程中执行压缩，已有压缩在运行时不重复启动"""
+        if not hasattr(self.vector_store, 'vacuum'):
+            return self.vacuum_deleted_documents()
+        if self.vacuum_running():
+            return {"success": True, "message": "压缩任务已在运行", "started": False}
+        
+        self._vacuum_thread = threading.Thread(
+            target=self.vacuum_deleted_documents, name="rag-vacuum", daemon=True
+        )
+        self._vacuum_thread.start()
+        return {"success": True, "message": "已在后台启动压缩任务", "started": True}
+    
+    def vacuum_running(self) -> bool:
+        """是否有压缩任务正在运行"""
+        return self._vacuum_thread is not None and self._vacuum_thread.is_alive()
+    
+    def retrain_index(self) -> dict:
+        """
+        按配置的目标参数重新训练 IVF 类索引（复用已存储的向量，不重新嵌入）
+        用于早期因训练样本不足而缩小了 nlist / nbits 的索引
+        """
+        if not hasattr(self.vector_store, 'retrain'):
             return {
                 "success": False,
-                "message": "软删除文档时发生错误",
-                "error": f"技术详情: {str(e)}"
+                "message": f"当前向量存储 ({self._get_current_store_name()}) 不需要或不支持重新训练",
+                "error": "向量存储不支持重新训练"
             }
+        
+        # 重建期间不能写入新向量，否则新索引会漏掉它们；查询仍在旧索引上进行
+        with self._write_lock:
+            return self.vector_store.retrain()
     
     def delete_document(self, document_id: str) -> dict:
         """
         硬删除文档 - 从向量存储中完全删除（适用于支持删除的数据库如ChromaDB）
         如果向量存储不支持删除操作，将自动降级为软删除
         """
-        try:
-            # 检查文档是否存在
-            if document_id not in self.document_metadata:
-                available_ids = list(self.document_metadata.keys())
-                return {
-                    "success": False,
-                    "message": f"文档ID {document_id} 不存在",
-                    "error": f"当前可用的文档ID: {available_ids}。总共有 {len(available_ids)} 个文档。"
-                }
-            
-            doc_info = self.document_metadata[document_id]
-            
-            # 检查是否已经被删除
-            if doc_info.get("deleted", False):
-                return {
-                    "success": False,
-                    "message": f"文档 '{doc_info['filename']}' 已经被删除",
-                    "error": "此文档已被标记为删除状态"
-                }
-            
-            # 尝试硬删除：从向量存储中删除
-            hard_delete_success = False
-            deleted_chunks = 0
-            
-            if hasattr(self.vector_store, 'delete_by_metadata'):
-                # 向量存储支持删除操作（如 ChromaDB）
-                print(f"🗑️ 从向量存储中硬删除文档 {document_id}...")
-                delete_result = self.vector_store.delete_by_metadata({"document_id": document_id})
+        # 与后台摄取共用写锁：正在提交的新版本不会与硬删除交错
+        with self._write_lock:
+            try:
+                # 检查文档是否存在
+                if document_id not in self.document_metadata:
+                    available_ids = list(self.document_metadata.keys())
+                    return {
+                        "success": False,
+                        "message": f"文档ID {document_id} 不存在",
+                        "error": f"当前可用的文档ID: {available_ids}。总共有 {len(available_ids)} 个文档。"
+                    }
                 
-                if delete_result.get("success"):
-                    hard_delete_success = True
-                    deleted_chunks = delete_result.get("deleted_count", 0)
-                    print(f"✅ 成功从向量存储删除 {deleted_chunks} 个文档块")
-                else:
-                    print(f"⚠️ 向量存储删除失败: {delete_result.get('message', '未知错误')}")
-            else:
-                # 向量存储不支持删除（如 FAISS），降级为软删除
-                print(f"⚠️ 当前向量存储 ({self.vector_store_type}) 不支持硬删除，将使用软删除")
-                return self.soft_delete_document(document_id)
-            
-            if hard_delete_success:
-                # 从 metadata 中移除文档记录（硬删除）
-                del self.document_metadata[document_id]
+                doc_info = self.document_metadata[document_id]
                 
-                # 保存更新的metadata
-                self._save_document_metadata()
+                # 检查是否已经被删除
+                if doc_info.get("deleted", False):
+                    return {
+                        "success": False,
+                        "message": f"文档 '{doc_info['filename']}' 已经被删除",
+                        "error": "此文档已被标记为删除状态"
+                    }
+                
+                # 尝试硬删除：从向量存储中删除
+                hard_delete_success = False
+                deleted_chunks = 0
                 
-                # 尝试保存向量存储（如果支持）
-                if hasattr(self.vector_store, 'save'):
-                    save_result = self.vector_store.save()
-                    if save_result:
-                        print(f"💾 向量存储已保存")
+                if hasattr(self.vector_store, 'delete_by_metadata'):
+                    # 向量存储支持删除操作（如 ChromaDB）
+                    print(f"🗑️ 从向量存储中硬删除文档 {document_id}...")
+                    delete_result = self.vector_store.delete_by_metadata({"document_id": document_id})
+                    
+                    if delete_result.get("success"):
+                        hard_delete_success = True
+                        deleted_chunks = delete_result.get("deleted_count", 0)
+                        print(f"✅ 成功从向量存储删除 {deleted_chunks} 个文档块")
+                    else:
+                        print(f"⚠️ 向量存储删除失败: {delete_result.get('message', '未知错误')}")
+                else:
+                    # 向量存储不支持删除（如 FAISS），降级为软删除
+                    print(f"⚠️ 当前向量存储 ({self.vector_store_type}) 不支持硬删除，将使用软删除")
+                    return self.soft_delete_document(document_id)
                 
+                if hard_delete_success:
+                    # 从 metadata 中移除文档记录（硬删除）
+                    del self.document_metadata[document_id]
+                    if self.keyword_index is not None:
+                        self.keyword_index.remove_document(document_id)
+                        self.keyword_index.save()
+                    self._invalidate_answers(document_id)
+                    
+                    # 保存更新的metadata
+                    self._save_document_metadata()
+                    
+                    # 尝试保存向量存储（如果支持）
+                    if hasattr(self.vector_store, 'save'):
+                        save_result = self.vector_store.save()
+                        if save_result:
+                            print(f"💾 向量存储已保存")
+                    
+                    return {
+                        "success": True,
+                        "message": f"文档 '{doc_info['filename']}' 已成功删除",
+                        "detail": f"已从向量存储中删除 {deleted_chunks} 个文档块，并清除所有记录"
+                    }
+                else:
+                    # 硬删除失败，降级为软删除
+                    print(f"⚠️ 硬删除失败，降级为软删除")
+                    return self.soft_delete_document(document_id)
+                    
+            except Exception as e:
+                print(f"❌ 删除文档时发生异常: {e}")
+                import traceback
+                traceback.print_exc()
                 return {
-                    "success": True,
-                    "message": f"文档 '{doc_info['filename']}' 已成功删除",
-                    "detail": f"已从向量存储中删除 {deleted_chunks} 个文档块，并清除所有记录"
+                    "success": False,
+                    "message": "删除文档时发生错误",
+                    "error": f"技术详情: {str(e)}"
                 }
-            else:
-                # 硬删除失败，降级为软删除
-                print(f"⚠️ 硬删除失败，降级为软删除")
-                return self.soft_delete_document(document_id)
-                
-        except Exception as e:
-            print(f"❌ 删除文档时发生异常: {e}")
-            import traceback
-            traceback.print_exc()
-            return {
-                "success": False,
-                "message": "删除文档时发生错误",
-                "error": f"技术详情: {str(e)}"
-            }
     
     def list_documents(self, include_deleted: bool = False) -> list:
         """列出文档（默认不包含已删除的文档）"""
         try:
             documents = []
-            for doc_id, doc_info in self.document_metadata.items():
+            with self._write_lock:
+                items = list(self.document_metadata.items())
+            for doc_id, doc_info in items:
                 # 如果不包含已删除文档，则跳过已删除的
                 if not include_deleted and doc_info.get("deleted", False):
                     continue
@@ -497,6 +1296,11 @@ class SimpleRAGService:
         try:
             # 重新创建空的向量存储
             self._create_vector_store(self.store_type, self.store_path)
+            if self.keyword_index is not None:
+                self.keyword_index.clear()
+                self.keyword_index.save()
+            if self.answer_cache is not None:
+                self.answer_cache.clear()
             return {
                 "success": True,
                 "message": "向量存储已清空"
@@ -3,12 +3,16 @@ Gradio 界面模块 V2 - 全新设计
 左侧固定侧边栏 + 右侧对话区，类似 ChatGPT 风格
 """
 import gradio as gr
+import shutil
+import uuid
 from typing import List, Tuple, Optional
 from pathlib import Path
 
+from core.config import config
 from core.models import ChatModel
 from core.session_manager import SessionManager
 from core.simple_rag_service import SimpleRAGService
+from core.ingestion_jobs import IngestionJobManager
 
 
 class GradioInterface:
@@ -17,10 +21,12 @@ class GradioInterface:
     采用左右分栏布局，模式切换在左侧
     """
     
-    def __init__(self, chat_model: ChatModel, session_manager: SessionManager, rag_service: SimpleRAGService):
+    def __init__(self, chat_model: ChatModel, session_manager: SessionManager, rag_service: SimpleRAGService,
+                 job_manager: Optional[IngestionJobManager] = None):
         self.chat_model = chat_model
         self.session_manager = session_manager
         self.rag_service = rag_service
+        self.job_manager = job_manager  # 与 HTTP 上传接口共用的后台摄取队列
         self.current_session_id = None
         self.current_rag_session_id = None
         self.current_mode = "chat"  # "chat" 或 "rag"
@@ -496,35 +502,59 @@ class GradioInterface:
                     return [], [], chat_session_id, new_id
             
             def upload_document(file_path: Optional[str]):
-                """上传文档"""
+                """上传文档（生成器：通过后台队列处理时逐步刷新进度）"""
                 if not file_path:
-                    return "⚠️ 请先选择文件", None
+                    yield "⚠️ 请先选择文件", None
+                    return
                 
                 file_path_str = str(file_path).strip() if isinstance(file_path, str) else str(file_path)
                 
                 if not file_path_str:
-                    return "⚠️ 请先选择文件", None
+                    yield "⚠️ 请先选择文件", None
+                    return
                 
                 file_obj = Path(file_path_str)
                 if not file_obj.exists():
-                    return "❌ 文件不存在", None
+                    yield "❌ 文件不存在", None
+                    return
                 
                 if file_obj.stat().st_size == 0:
-                    return "❌ 文件为空", None
+                    yield "❌ 文件为空", None
+                    return
                 
                 try:
                     file_name = file_obj.name
-                    success, doc_id = self.rag_service.process_document(file_path_str)
                     
-                    if success:
-                        return (
-                            f"✅ 上传成功！\n📄 {file_name}\n🆔 {doc_id}",
-                            None
-                        )
+                    if self.job_manager is None:
+                        success, doc_id = self.rag_service.process_document(file_path_str)
+                        if success:
+                            yield f"✅ 上传成功！\n📄 {file_name}\n🆔 {doc_id}", None
+                        else:
+                            yield f"❌ 上传失败: {doc_id}", None
+                        return
+                    
+                    # Gradio 的临时文件可能在重启后被清理，先复制到上传目录，保证任务可以恢复
+                    uploads_dir = Path(config.get_upload_path())
+                    uploads_dir.mkdir(parents=True, exist_ok=True)
+                    save_path = uploads_dir / f"{uuid.uuid4().hex[:8]}_{file_name}"
+                    shutil.copyfile(file_path_str, save_path)
+                    
+                    job = self.job_manager.submit(str(save_path), filename=file_name)
+                    
+                    # 轮询任务进度，逐步刷新上传状态
+                    while True:
+                        job = self.job_manager.wait(job.job_id, timeout=1.0)
+                        if job.finished:
+                            break
+                        percent = job.to_dict()["progress"] * 100
+                        yield f"⏳ 处理中: {file_name}\n📊 {job.stage} {percent:.0f}%", None
+                    
+                    if job.status == "completed":
+                        yield f"✅ 上传成功！\n📄 {file_name}\n🆔 {job.document_id}", None
                     else:
-                        return f"❌ 上传失败: {doc_id}", None
+                        yield f"❌ 上传失败: {job.error}", None
                 except Exception as e:
-                    return f"❌ 上传失败: {str(e)}", None
+                    yield f"❌ 上传失败: {str(e)}", None
             
             def get_document_list():
                 """获取文档列表（HTML卡片格式）"""
@@ -667,7 +697,8 @@ class GradioInterface:
 
 
 def create_gradio_app(chat_model: ChatModel, session_manager: SessionManager, 
-                      rag_service: SimpleRAGService) -> gr.Blocks:
+                      rag_service: SimpleRAGService,
+                      job_manager: Optional[IngestionJobManager] = None) -> gr.Blocks:
     """创建 Gradio 应用的工厂函数"""
-    gradio_interface = GradioInterface(chat_model, session_manager, rag_service)
+    gradio_interface = GradioInterface(chat_model, session_manager, rag_service, job_manager)
     return gradio_interface.create_interface()
@@ -6,13 +6,15 @@ ChromaDB向量存储模块
 
 import os
 import uuid
-from typing import List, Tuple, Optional
+from typing import Iterable, List, Tuple, Optional
 from langchain.schema import Document
 
 
 class ChromaDBVectorStore:
     """ChromaDB向量存储实现，支持本地和远程服务器"""
-    
+
+    ADD_BATCH_SIZE = 1000  # 单次 collection.add 写入的最大条数
+
     def __init__(self, embeddings, collection_name: str = "default_collection", 
                  store_path: str = "chroma_store",
                  remote_host: str = None,
@@ -91,7 +93,7 @@ class ChromaDBVectorStore:
             
             # 提取文档内容和元数据
             texts = [doc.page_content for doc in documents]
-            metadatas = [doc.metadata for doc in documents]
+            metadatas = [self._metadata(doc) for doc in documents]
             
             print(f"📝 提取了 {len(texts)} 个文本块")
             
@@ -136,7 +138,9 @@ class ChromaDBVectorStore:
         
         try:
             print(f"📝 向现有向量存储添加 {len(documents)} 个文档...")
-            self.store.add_documents(documents)
+            self.store.add_documents(
+                [Document(page_content=doc.page_content, metadata=self._metadata(doc)) for doc in documents]
+            )
             print("✅ 文档添加成功")
             return True
         except Exception as e:
@@ -145,6 +149,66 @@ class ChromaDBVectorStore:
             traceback.print_exc()
             return False
     
+    @staticmethod
+    def _metadata(doc: Document) -> dict:
+        """
+        写入集合的元数据，保证每个块都带 document_id 键：
+        ChromaDB 的 $nin 条件会把缺少该键的块一并过滤掉，检索时排除文档会误伤这些块
+        """
+        metadata = dict(doc.metadata)
+        metadata.setdefault("document_id", "")
+        return metadata
+
+    def _open_store(self):
+        """打开（或创建）集合对应的 Chroma 实例，不写入任何文档"""
+        if self.is_remote:
+            return self.Chroma(
+                collection_name=self.collection_name,
+                embedding_function=self.embeddings,
+                client=self._get_chroma_client()
+            )
+        os.makedirs(self.store_path, exist_ok=True)
+        return self.Chroma(
+            collection_name=self.collection_name,
+            embedding_function=self.embeddings,
+            persist_directory=self.store_path
+        )
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]]) -> bool:
+        """添加已经计算好向量的文档，直接写入集合，不再调用嵌入模型"""
+        if not self.available:
+            print("❌ ChromaDB不可用")
+            return False
+
+        try:
+            if not self.store:
+                print("📝 第一次添加文档，创建新的向量存储...")
+                self.store = self._open_store()
+
+            collection = self.store._collection
+            # 文档块自带 chunk_id 时用作ChromaDB的ID，便于之后按块删除
+            ids = [doc.metadata.get("chunk_id") or str(uuid.uuid4()) for doc in documents]
+            texts = [doc.page_content for doc in documents]
+            metadatas = [self._metadata(doc) for doc in documents]
+
+            # ChromaDB 对单次写入数量有上限，分段提交
+            for start in range(0, len(ids), self.ADD_BATCH_SIZE):
+                end = start + self.ADD_BATCH_SIZE
+                collection.add(
+                    ids=ids[start:end],
+                    embeddings=embeddings[start:end],
+                    metadatas=metadatas[start:end],
+                    documents=texts[start:end]
+                )
+
+            print(f"✅ 写入 {len(ids)} 个预计算向量成功")
+            return True
+        except Exception as e:
+            print(f"❌ 写入预计算向量失败: {e}")
+            import traceback
+            traceback.print_exc()
+            return False
+
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """相似性搜索"""
         if not self.store:
@@ -159,20 +223,41 @@ class ChromaDBVectorStore:
             print(f"❌ 搜索失败: {e}")
             return []
     
-    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
-        """相似性搜索并返回分数"""
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     exclude_document_ids: Iterable[str] = None) -> List[Tuple[Document, float]]:
+        """相似性搜索并返回分数，exclude_document_ids 通过 where 条件在ChromaDB服务端排除"""
         if not self.store:
             return []
         
         try:
             print(f"🔍 在ChromaDB中搜索相似文档（带分数），查询: '{query[:50]}...'")
-            results = self.store.similarity_search_with_score(query, k=k)
+            excluded = sorted(set(exclude_document_ids or []))
+            # 没有要排除的文档时不加条件；写入时保证了 document_id 键存在（见 _metadata），$nin 不会误伤
+            where = {"document_id": {"$nin": excluded}} if excluded else None
+            results = self.store.similarity_search_with_score(query, k=k, filter=where)
             print(f"📄 找到 {len(results)} 个相似文档（带分数）")
             return results
         except Exception as e:
             print(f"❌ 搜索失败: {e}")
             return []
     
+    def iter_documents(self, batch_size: int = ADD_BATCH_SIZE) -> Iterable[Document]:
+        """分批遍历集合中的全部文档块，用于重建关键词索引"""
+        if not self.store:
+            return
+        collection = self.store._collection
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=["documents", "metadatas"])
+            ids = batch.get("ids") or []
+            if not ids:
+                return
+            for chunk_id, text, metadata in zip(ids, batch["documents"], batch["metadatas"]):
+                metadata = dict(metadata or {})
+                metadata.setdefault("chunk_id", chunk_id)
+                yield Document(page_content=text or "", metadata=metadata)
+            offset += len(ids)
+
     def similarity_search_with_relevance_scores(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
         """相似性搜索并返回相关性分数（0-1之间）"""
         if not self.store:
@@ -187,6 +272,16 @@ class ChromaDBVectorStore:
             print(f"❌ 搜索失败: {e}")
             return []
     
+    def relevance_score(self, score: float) -> Optional[float]:
+        """把 similarity_search_with_score 的分数换算为 [0, 1] 的相关度（按存储的距离度量），无法换算时返回 None"""
+        if not self.store:
+            return None
+        try:
+            relevance = self.store._select_relevance_score_fn()(float(score))
+        except Exception:
+            return None
+        return min(max(relevance, 0.0), 1.0)
+    
     def get_info(self) -> dict:
         """获取存储信息"""
         if not self.store:
@@ -328,10 +423,10 @@ class ChromaDBVectorStore:
         try:
             if self.store and hasattr(self.store, '_collection'):
                 # 获取所有文档ID
-                all_data = self.store._collection.get()
+                all_data = self.store._collection.get(include=[])
                 if all_data and 'ids' in all_data and all_data['ids']:
                     # 删除所有文档
-                    self.store._collection.delete(ids=all_data['ids'])
+                    self._delete_ids(self.store._collection, all_data['ids'])
                     print(f"✅ 清空集合 '{self.collection_name}' 成功")
                     return True
                 else:
@@ -341,9 +436,23 @@ class ChromaDBVectorStore:
             print(f"❌ 清空集合失败: {e}")
             return False
     
+    @staticmethod
+    def _build_where(metadata_filter: dict) -> dict:
+        """把简单的 {键: 值} 过滤条件转换为ChromaDB的 where 语法"""
+        conditions = [{key: value} for key, value in metadata_filter.items()]
+        return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+    def _delete_ids(self, collection, ids: List[str]):
+        """按ID分批删除"""
+        for start in range(0, len(ids), self.ADD_BATCH_SIZE):
+            collection.delete(ids=ids[start:start + self.ADD_BATCH_SIZE])
+
     def delete_by_metadata(self, metadata_filter: dict) -> dict:
         """
         根据metadata过滤条件删除文档
+
+        先用 where 条件取回匹配的ID（不取向量和文本），再按ID分批删除，删除数量即ID个数；
+        集合可能被其他客户端写入，因此不依赖本地记录的块ID
         
         Args:
             metadata_filter: 元数据过滤条件，例如 {"document_id": "123"}
@@ -359,50 +468,32 @@ class ChromaDBVectorStore:
                     "deleted_count": 0
                 }
             
-            collection = self.store._collection
-            
-            # 获取所有文档
-            all_data = collection.get()
-            
-            if not all_data or 'ids' not in all_data or not all_data['ids']:
+            if not metadata_filter:
                 return {
-                    "success": True,
-                    "message": "集合为空，无需删除",
+                    "success": False,
+                    "message": "删除条件不能为空",
                     "deleted_count": 0
                 }
             
-            # 找到匹配的文档ID
-            ids_to_delete = []
-            metadatas = all_data.get('metadatas', [])
+            collection = self.store._collection
             
-            for i, metadata in enumerate(metadatas):
-                # 检查是否匹配所有过滤条件
-                match = True
-                for key, value in metadata_filter.items():
-                    if metadata.get(key) != value:
-                        match = False
-                        break
-                
-                if match:
-                    ids_to_delete.append(all_data['ids'][i])
+            ids = collection.get(where=self._build_where(metadata_filter), include=[])["ids"]
+            self._delete_ids(collection, ids)
+            deleted_count = len(ids)
             
-            if not ids_to_delete:
+            if not deleted_count:
                 return {
                     "success": True,
                     "message": "未找到匹配的文档",
                     "deleted_count": 0
                 }
             
-            # 删除匹配的文档
-            collection.delete(ids=ids_to_delete)
-            
-            print(f"✅ 成功删除 {len(ids_to_delete)} 个文档（metadata过滤: {metadata_filter}）")
+            print(f"✅ 成功删除 {deleted_count} 个文档（metadata过滤: {metadata_filter}）")
             
             return {
                 "success": True,
-                "message": f"成功删除 {len(ids_to_delete)} 个文档块",
-                "deleted_count": len(ids_to_delete),
-                "deleted_ids": ids_to_delete
+                "message": f"成功删除 {deleted_count} 个文档块",
+                "deleted_count": deleted_count
             }
             
         except Exception as e:
@@ -416,6 +507,19 @@ class ChromaDBVectorStore:
                 "deleted_count": 0
             }
 
+    def delete_chunks(self, chunk_ids: List[str]) -> dict:
+        """按块ID删除文档块"""
+        try:
+            if not self.store or not hasattr(self.store, '_collection'):
+                return {"success": False, "message": "向量存储未初始化", "deleted_count": 0}
+
+            chunk_ids = list(chunk_ids)
+            self._delete_ids(self.store._collection, chunk_ids)
+            return {"success": True, "deleted_count": len(chunk_ids)}
+        except Exception as e:
+            print(f"❌ 删除文档块失败: {e}")
+            return {"success": False, "message": "删除文档块时发生错误", "error": str(e), "deleted_count": 0}
+
 
 def create_chromadb_store(embeddings, collection_name: str = "default_collection", store_path: str = "chroma_store"):
     """创建ChromaDB向量存储的便捷函数"""
@@ -2,120 +2,468 @@
 """
 FAISS向量存储模块 - 精简版
 支持多种FAISS索引类型的向量存储实现
+
+持久化模式：
+- snapshot: 每次保存都用 save_local 完整重写 index.faiss / index.pkl
+- append:   新增向量追加写入预写日志（WAL），累计到阈值后再压缩为快照；
+            加载时先读取最近的快照，再重放日志
+
+并发：查询持有共享锁，写入（添加、删除、压缩后替换索引、加载）持有独占锁，
+FAISS 索引和 docstore 映射不会在查询过程中被修改
 """
 
 import os
-from typing import List, Tuple
+import json
+import shutil
+import pickle
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Iterable, List, Optional, Tuple
 from langchain.schema import Document
 
 
+class _ReadWriteLock:
+    """读写锁：多个读者可以同时持有；写者独占，且有写者等待时新的读者排队（避免写者饥饿）"""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
 class FAISSVectorStore:
     """FAISS向量存储实现"""
-    
-    def __init__(self, embeddings, index_type: str = "IndexFlatL2", store_path: str = "vector_store"):
+
+    WAL_FILENAME = "wal.log"  # 预写日志文件名（位于 faiss_index 目录下）
+    PARAMS_FILENAME = "index_params.json"  # 索引构建参数（与快照一起保存）
+    TOMBSTONES_FILENAME = "tombstones.json"  # 已删除但尚未压缩的块ID（与快照一起保存）
+    IVF_INDEX_TYPES = ("IndexIVFFlat", "IndexIVFPQ")  # 需要训练的索引类型
+    VACUUM_BATCH_SIZE = 4096  # 压缩时每批取回并写入新索引的向量数
+
+    # 索引默认参数，可通过 index_params 覆盖
+    DEFAULT_INDEX_PARAMS = {
+        "hnsw_m": 32,  # HNSW每个节点的邻居数
+        "hnsw_ef_construction": 200,  # HNSW建图时的候选队列长度
+        "hnsw_ef_search": 64,  # HNSW查询时的候选队列长度，越大召回越高、越慢
+        "ivf_nlist": 1024,  # IVF聚类中心数
+        "ivf_nprobe": 16,  # IVF查询时访问的聚类数
+        "pq_m": 16,  # PQ子量化器数量
+        "pq_nbits": 8,  # 每个子量化器的编码位数
+        "train_sample_size": 50000  # IVF训练最多使用的向量数
+    }
+
+    def __init__(self, embeddings, index_type: str = "IndexFlatL2", store_path: str = "vector_store",
+                 persistence_mode: str = "snapshot", compact_threshold: int = 20000,
+                 index_params: dict = None):
+        """
+        Args:
+            embeddings: 嵌入模型
+            index_type: FAISS索引类型
+            store_path: 存储目录
+            persistence_mode: 持久化模式，"snapshot" 或 "append"
+            compact_threshold: append 模式下，日志中累计多少个向量后压缩为快照
+            index_params: HNSW/IVF/PQ 索引参数，见 DEFAULT_INDEX_PARAMS
+        """
         self.embeddings = embeddings
         self.index_type = index_type
         self.store_path = store_path
+        self.persistence_mode = persistence_mode
+        self.compact_threshold = compact_threshold
+        # configured_params 是配置的目标参数；index_params 是当前索引实际使用的参数
+        # （训练样本不足时 nlist / nbits 会被缩小，重新训练时仍按目标参数计算）
+        self.configured_params = {**self.DEFAULT_INDEX_PARAMS, **(index_params or {})}
+        self.index_params = dict(self.configured_params)
         self.store = None    # FAISS向量存储实例
-        
+
+        # append 模式的状态
+        self._pending_records = []  # 尚未写入日志的记录
+        self._wal_vectors = 0  # 自上次快照以来日志中的向量数
+        self._positions_by_document = None  # document_id -> 索引位置，用于查询时排除文档
+        self._tombstones = set()  # 已删除的块ID（docstore ID），查询时排除，压缩时物理移除
+        self._tombstone_positions = None  # 墓碑块在索引中的位置（缓存）
+        self._vacuum_adds = None  # 压缩重建期间写入旧索引的向量，切换时重放到新索引（未在压缩时为 None）
+        self._lock = _ReadWriteLock()  # 查询共享，写入独占
+        self._save_lock = threading.RLock()  # 快照和日志的磁盘写入串行执行（压缩可能与服务层的保存同时进行）
+
         try:
             import faiss
+            import numpy as np
             from langchain_community.vectorstores import FAISS
+            from langchain_community.docstore.in_memory import InMemoryDocstore
+            from langchain_community.vectorstores.utils import DistanceStrategy
             self.faiss = faiss
+            self.np = np
             self.FAISS = FAISS
+            self.InMemoryDocstore = InMemoryDocstore
+            self.DistanceStrategy = DistanceStrategy
             self.available = True
         except ImportError as e:
             print(f"❌ FAISS不可用: {e}")
             self.available = False
-    
+
+    @property
+    def index_dir(self) -> str:
+        """快照和日志所在目录"""
+        return os.path.join(self.store_path, "faiss_index")
+
+    @property
+    def wal_path(self) -> str:
+        return os.path.join(self.index_dir, self.WAL_FILENAME)
+
+    def _snapshot_exists(self) -> bool:
+        return (os.path.exists(os.path.join(self.index_dir, "index.faiss"))
+                and os.path.exists(os.path.join(self.index_dir, "index.pkl")))
+
+    def _training_threshold(self) -> int:
+        """
+        IVF 类索引开始训练所需的向量数
+        足够按目标 nlist 训练（每个聚类中心约39个点），且不超过训练样本上限
+        """
+        params = self.configured_params
+        return max(1, min(params["train_sample_size"], params["ivf_nlist"] * 39))
+
+    def _is_staging(self, index) -> bool:
+        """IVF 类存储是否仍在用平面索引暂存（尚未训练）"""
+        return self.index_type in self.IVF_INDEX_TYPES and not hasattr(index, "nprobe")
+
+    def _training_due(self) -> bool:
+        return (self.store is not None and self._is_staging(self.store.index)
+                and self.store.index.ntotal >= self._training_threshold())
+
+    def _build_index(self, vectors, force_train: bool = False) -> object:
+        """
+        按索引类型构建原始FAISS索引
+
+        IVF 类索引在向量数达到训练阈值前先使用平面索引暂存（精确检索），
+        达到阈值后用全部已存储的向量训练并迁移（见 retrain）；
+        force_train 时立即训练，样本较少时自动缩小 nlist / nbits，避免训练失败
+        """
+        faiss = self.faiss
+        sample = self.np.asarray(vectors, dtype="float32")
+        dim = sample.shape[1]
+        params = dict(self.configured_params)
+
+        if self.index_type == "IndexFlatIP":
+            index = faiss.IndexFlatIP(dim)
+        elif self.index_type == "IndexHNSWFlat":
+            index = faiss.IndexHNSWFlat(dim, params["hnsw_m"])
+            index.hnsw.efConstruction = params["hnsw_ef_construction"]
+        elif self.index_type in self.IVF_INDEX_TYPES and not force_train and len(sample) < self._training_threshold():
+            print(f"📥 向量数不足 {self._training_threshold()} 个，{self.index_type} 先用平面索引暂存，达到后再训练")
+            index = faiss.IndexFlatL2(dim)
+        elif self.index_type in self.IVF_INDEX_TYPES:
+            if len(sample) > params["train_sample_size"]:
+                rows = self.np.random.default_rng(0).choice(len(sample), params["train_sample_size"], replace=False)
+                sample = sample[rows]
+            # FAISS建议每个聚类中心至少有约39个训练点
+            nlist = max(1, min(params["ivf_nlist"], len(sample) // 39))
+            if nlist < params["ivf_nlist"]:
+                print(f"⚠️ 训练样本只有 {len(sample)} 个，nlist 从 {params['ivf_nlist']} 调整为 {nlist}")
+            params["ivf_nlist"] = nlist
+            quantizer = faiss.IndexFlatL2(dim)
+            if self.index_type == "IndexIVFFlat":
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+            else:
+                # 子量化器数量必须整除向量维度，码本大小不能超过训练样本数
+                pq_m = max(m for m in range(1, min(params["pq_m"], dim) + 1) if dim % m == 0)
+                nbits = max(1, min(params["pq_nbits"], int(self.np.log2(len(sample)))))
+                params["pq_m"], params["pq_nbits"] = pq_m, nbits
+                index = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, nbits)
+            print(f"🏋️ 使用 {len(sample)} 个向量训练 {self.index_type} 索引...")
+            index.train(sample)
+        else:
+            index = faiss.IndexFlatL2(dim)
+
+        self.index_params = params
+        self._apply_search_params(index)
+        return index
+
+    def _apply_search_params(self, index):
+        """设置查询期参数（efSearch / nprobe 只影响查询，可以随时调整）"""
+        if hasattr(index, "hnsw"):
+            index.hnsw.efSearch = self.index_params["hnsw_ef_search"]
+        if hasattr(index, "nprobe"):
+            index.nprobe = min(self.index_params["ivf_nprobe"], getattr(index, "nlist", 1))
+
+    def _distance_strategy(self, index):
+        """根据索引的实际度量选择 LangChain 的距离策略"""
+        if index.metric_type == self.faiss.METRIC_INNER_PRODUCT:
+            # 内积相似度，值越大越相似
+            return self.DistanceStrategy.MAX_INNER_PRODUCT
+        # 默认使用L2距离，衡量两点空间中直线距离，值越小越相似
+        return self.DistanceStrategy.EUCLIDEAN_DISTANCE
+
+    def _create_store(self, text_embeddings: list, metadatas: list, ids: list):
+        """根据索引类型创建新的 LangChain FAISS 实例"""
+        print(f"🔧 创建 {self.index_type} 向量存储...")
+        index = self._build_index([vector for _, vector in text_embeddings])
+        store = self.FAISS(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=self.InMemoryDocstore(),
+            index_to_docstore_id={},
+            distance_strategy=self._distance_strategy(index)
+        )
+        store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        return store
+
+    def _apply_add(self, texts: list, vectors: list, metadatas: list, ids: list):
+        """把一批向量写入内存中的索引（不记录日志）"""
+        text_embeddings = list(zip(texts, vectors))
+        start = self.store.index.ntotal if self.store else 0
+        if not self.store:
+            self.store = self._create_store(text_embeddings, metadatas, ids)
+        else:
+            self.store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+        if self._vacuum_adds is not None:
+            self._vacuum_adds.append((text_embeddings, metadatas, ids))
+
+        # LangChain 按顺序追加向量，新向量的位置从写入前的 ntotal 开始
+        if self._positions_by_document is not None:
+            for offset, metadata in enumerate(metadatas):
+                document_id = (metadata or {}).get("document_id")
+                if document_id is not None:
+                    self._positions_by_document.setdefault(document_id, []).append(start + offset)
+
+    def _document_positions(self) -> dict:
+        """document_id -> 向量在FAISS索引中的位置列表（首次使用时从docstore构建）"""
+        if self._positions_by_document is None:
+            positions = {}
+            docstore = self.store.docstore._dict if self.store else {}
+            for position, docstore_id in self.store.index_to_docstore_id.items() if self.store else []:
+                doc = docstore.get(docstore_id)
+                document_id = doc.metadata.get("document_id") if doc else None
+                if document_id is not None:
+                    positions.setdefault(document_id, []).append(position)
+            self._positions_by_document = positions
+        return self._positions_by_document
+
+    def _excluded_positions(self, exclude_document_ids: Iterable[str] = None) -> list:
+        """查询时需要排除的索引位置：指定文档的全部块 + 已删除的块"""
+        positions = self._document_positions()
+        excluded = [p for doc_id in (exclude_document_ids or []) for p in positions.get(doc_id, [])]
+        if self._tombstones:
+            if self._tombstone_positions is None:
+                self._tombstone_positions = [
+                    position for position, docstore_id in self.store.index_to_docstore_id.items()
+                    if docstore_id in self._tombstones
+                ]
+            excluded.extend(self._tombstone_positions)
+        return excluded
+
+    def delete_chunks(self, chunk_ids: Iterable[str]) -> dict:
+        """
+        删除指定的文档块
+
+        FAISS 的部分索引类型（如HNSW）不支持原地删除，这里先记录墓碑：查询时排除，
+        下次压缩（vacuum）时物理移除
+        """
+        with self._lock.write():
+            if not self.store:
+                return {"success": True, "deleted_count": 0}
+
+            existing = self.store.docstore._dict
+            ids = [chunk_id for chunk_id in chunk_ids if chunk_id in existing and chunk_id not in self._tombstones]
+            if ids:
+                self._tombstones.update(ids)
+                self._tombstone_positions = None
+                if self.persistence_mode == "append":
+                    self._pending_records.append({"op": "delete", "ids": ids})
+            return {"success": True, "deleted_count": len(ids)}
+
+    def _search_parameters(self, excluded_positions: list):
+        """构造排除指定向量的查询参数（在索引内部过滤，而不是取回后再丢弃）"""
+        faiss = self.faiss
+        selector = faiss.IDSelectorNot(faiss.IDSelectorBatch(self.np.asarray(excluded_positions, dtype="int64")))
+        index = self.store.index
+        # 专用参数类型会覆盖索引上的 efSearch / nprobe，因此需要显式带上
+        if hasattr(index, "hnsw"):
+            params = faiss.SearchParametersHNSW(sel=selector, efSearch=self.index_params["hnsw_ef_search"])
+        elif hasattr(index, "nprobe"):
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=index.nprobe)
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        return params, selector
+
     def create_from_documents(self, documents: List[Document]) -> bool:
         """从文档创建向量存储"""
         if not self.available:
             print("❌ FAISS不可用")
             return False
-        
+
+        print(f"🔧 创建FAISS向量存储，处理 {len(documents)} 个文档...")
+        with self._lock.write():
+            self.store = None
+            self._positions_by_document = None
+            self._tombstones = set()
+            self._tombstone_positions = None
+        return self.add_documents(documents)
+
+    def add_documents(self, documents: List[Document]) -> bool:
+        """添加文档到现有存储（先嵌入再写入，与 add_embeddings 走同一条写入路径）"""
+        if not self.available:
+            print("❌ FAISS不可用")
+            return False
+
         try:
-            print(f"🔧 创建FAISS向量存储，处理 {len(documents)} 个文档...")
             '''page_content: 字符串类型，表示文档的主要内容。
             metadata: 字典类型，用于存储文档的元数据，如来源、页码、标题等。'''
             texts = [doc.page_content for doc in documents]
-            metadatas = [doc.metadata for doc in documents]
-            
             print(f"📝 提取了 {len(texts)} 个文本块")
-            
-            # 根据索引类型选择不同的距离度量
-            if self.index_type == "IndexFlatIP":
-                print("🔧 使用内积相似度创建向量存储...")
-                # 用传入的embeddings 模型将所有 texts 转换为向量,并且绑定metadata。
-                self.store = self.FAISS.from_texts(
-                    texts,
-                    self.embeddings,
-                    metadatas=metadatas,
-                    distance_strategy="INNER_PRODUCT" 
-                    # 内积相似度，值越大越相似
-                )
-            else:
-                print("🔧 使用L2距离创建向量存储...")
-                # 默认使用L2距离，衡量两点空间中直线距离，值越小越相似
-                self.store = self.FAISS.from_texts(
-                    texts,
-                    self.embeddings, 
-                    metadatas=metadatas
-                )
-            print("✅ FAISS向量存储创建成功")
-            return True
-            
+            vectors = self.embeddings.embed_documents(texts)
+            return self.add_embeddings(documents, vectors)
         except Exception as e:
-            print(f"❌ 创建FAISS向量存储失败: {e}")
+            print(f"❌ 添加文档失败: {e}")
             import traceback
             traceback.print_exc()
             return False
-    
-    def add_documents(self, documents: List[Document]) -> bool:
-        """添加文档到现有存储"""
-        if not self.store:
-            print("📝 第一次添加文档，创建新的向量存储...")
-            return self.create_from_documents(documents)
-        
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]]) -> bool:
+        """添加已经计算好向量的文档，不再调用嵌入模型"""
+        if not self.available:
+            print("❌ FAISS不可用")
+            return False
+
         try:
-            print(f"📝 向现有向量存储添加 {len(documents)} 个文档...")
-            self.store.add_documents(documents)
-            print("✅ 文档添加成功")
+            texts = [doc.page_content for doc in documents]
+            metadatas = [doc.metadata for doc in documents]
+            # 文档块自带 chunk_id 时用作 docstore ID，便于之后按块删除
+            ids = [doc.metadata.get("chunk_id") or str(uuid.uuid4()) for doc in documents]
+
+            if not self.store:
+                print(f"🔧 使用预计算向量创建FAISS向量存储，共 {len(documents)} 个文档块...")
+            else:
+                print(f"📝 向现有向量存储写入 {len(documents)} 个预计算向量...")
+            with self._lock.write():
+                self._apply_add(texts, embeddings, metadatas, ids)
+
+                if self.persistence_mode == "append":
+                    self._pending_records.append({
+                        "op": "add",
+                        "ids": ids,
+                        "texts": texts,
+                        "metadatas": metadatas,
+                        "vectors": self.np.asarray(embeddings, dtype="float32")
+                    })
+
+            print("✅ 向量写入成功")
+            self._maybe_train()
             return True
         except Exception as e:
-            print(f"❌ 添加文档失败: {e}")
+            print(f"❌ 写入预计算向量失败: {e}")
             import traceback
             traceback.print_exc()
             return False
-    
+
     def similarity_search(self, query: str, k: int = 4) -> List[Document]:
         """相似性搜索"""
         if not self.store:
             return []
-        
+
         try:
-            return self.store.similarity_search(query, k=k)
+            with self._lock.read():
+                return self.store.similarity_search(query, k=k)
         except Exception as e:
             print(f"搜索失败: {e}")
             return []
-    
-    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
-        """相似性搜索并返回分数"""
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     exclude_document_ids: Iterable[str] = None) -> List[Tuple[Document, float]]:
+        """
+        相似性搜索并返回分数
+
+        Args:
+            exclude_document_ids: 需要排除的文档ID（如已软删除的文档），在FAISS索引内部过滤，
+                结果仍是剩余向量中精确的前 k 个（已删除的块总是被排除）
+        """
         if not self.store:
             return []
-        
+
         try:
-            # similarity_search_with_score faiss的同名函数
-            return self.store.similarity_search_with_score(query, k=k)
+            # 查询向量在加锁前计算，嵌入调用期间不阻塞写入
+            query_vector = self.np.asarray([self.embeddings.embed_query(query)], dtype="float32")
+            with self._lock.read():
+                excluded = self._excluded_positions(exclude_document_ids)
+                if not excluded:
+                    # 与 LangChain 的 similarity_search_with_score 相同，只是复用已计算的查询向量
+                    return self.store.similarity_search_with_score_by_vector(query_vector[0].tolist(), k=k)
+
+                params, _selector = self._search_parameters(excluded)  # 持有selector引用，避免被提前回收
+                scores, indices = self.store.index.search(query_vector, k, params=params)
+
+                results = []
+                for position, score in zip(indices[0], scores[0]):
+                    if position == -1:
+                        continue  # 剩余向量不足 k 个
+                    doc = self.store.docstore.search(self.store.index_to_docstore_id[int(position)])
+                    results.append((doc, float(score)))
+                return results
         except Exception as e:
             print(f"搜索失败: {e}")
             return []
+
+    def iter_documents(self) -> Iterable[Document]:
+        """遍历存储中的全部文档块（不含已删除的块），用于重建关键词索引"""
+        if not self.store:
+            return
+        with self._lock.read():
+            items = list(self.store.docstore._dict.items())
+            tombstones = set(self._tombstones)
+        for docstore_id, doc in items:
+            if docstore_id in tombstones:
+                continue
+            if doc.metadata.get("chunk_id"):
+                yield doc
+            else:
+                # 早期写入的块没有 chunk_id，以docstore ID代替
+                yield Document(page_content=doc.page_content, metadata={**doc.metadata, "chunk_id": docstore_id})
+
+    def relevance_score(self, score: float) -> Optional[float]:
+        """把 similarity_search_with_score 的分数换算为 [0, 1] 的相关度（按存储的距离度量），无法换算时返回 None"""
+        if not self.store:
+            return None
+        try:
+            relevance = self.store._select_relevance_score_fn()(float(score))
+        except Exception:
+            return None
+        return min(max(relevance, 0.0), 1.0)
     
     def get_info(self) -> dict:
         """获取存储信息"""
         if not self.store:
             return {"type": f"FAISS-{self.index_type}", "documents": 0, "available": self.available}
-        
+
         # 尝试获取文档数量
         doc_count = 0
         try:
@@ -123,53 +471,386 @@ class FAISSVectorStore:
                 doc_count = self.store.index.ntotal
         except:
             pass
-            
+
         return {
             "type": f"FAISS-{self.index_type}",
             "documents": doc_count,
             "available": True,
-            "persistent": True
+            "persistent": True,
+            "persistence_mode": self.persistence_mode,
+            "wal_vectors": self._wal_vectors,
+            "deleted_chunks": len(self._tombstones),
+            "training_pending": self._is_staging(self.store.index),
+            "index_params": self.index_params
         }
-    
-    def save(self) -> bool:
-        """保存向量存储到磁盘"""
+
+    # ==================== 压缩（清理已删除文档） ====================
+
+    def _reconstruct_vectors(self, index, positions: list):
+        """
+        从索引中取回指定位置已存储的向量（不重新调用嵌入模型）
+        IVF 索引需要先建立 direct map；IVF-PQ 取回的是解码后的近似向量
+        """
+        keys = self.np.asarray(positions, dtype="int64")
+        if hasattr(index, "reconstruct_batch"):
+            return index.reconstruct_batch(keys)
+        return self.np.vstack([index.reconstruct(int(key)) for key in keys])
+
+    def vacuum(self, exclude_document_ids: Iterable[str]) -> dict:
+        """
+        物理移除指定文档的向量和docstore记录（同时移除已删除的块）
+
+        复用索引中已存储的向量重建一个新索引（沿用原索引的训练结果）：只取回保留的向量，
+        每批 VACUUM_BATCH_SIZE 个，批与批之间写入和查询都可以继续在旧索引上进行。
+        重建期间新写入的向量和新删除的块在切换时重放到新索引，只有切换时短暂独占
+        """
         if not self.store:
-            print("❌ 没有向量存储可保存")
-            return False
-        
+            return {"success": True, "message": "向量存储为空，无需压缩", "removed": 0}
+
         try:
-            print(f"💾 保存向量存储到: {self.store_path}")
-            os.makedirs(self.store_path, exist_ok=True)
-            save_path = os.path.join(self.store_path, "faiss_index")
-            self.store.save_local(save_path)
-            print(f"✅ 向量存储保存成功: {save_path}")
-            return True
+            with self._lock.write():
+                removed_positions = set(self._excluded_positions(exclude_document_ids))
+                if not removed_positions:
+                    return {"success": True, "message": "没有需要清理的向量", "removed": 0}
+
+                old_store = self.store
+                old_index = old_store.index
+                keep = [p for p in range(old_index.ntotal) if p not in removed_positions]
+                removed_tombstones = set(self._tombstones)
+                if hasattr(old_index, "make_direct_map"):
+                    # IVF 索引需要 direct map 才能按位置取回向量，建立 direct map 会修改索引
+                    old_index.make_direct_map()
+                new_index = self.faiss.clone_index(old_index)
+                # 从这里开始记录写入旧索引的向量，切换时重放
+                self._vacuum_adds = []
+            print(f"🧹 压缩FAISS索引: 移除 {len(removed_positions)} 个向量，保留 {len(keep)} 个...")
+
+            new_index.reset()
+            docstore = {}
+            docstore_ids = []
+            for start in range(0, len(keep), self.VACUUM_BATCH_SIZE):
+                batch = keep[start:start + self.VACUUM_BATCH_SIZE]
+                with self._lock.read():
+                    if self.store is not old_store:
+                        break
+                    vectors = self._reconstruct_vectors(old_index, batch)
+                    ids = [old_store.index_to_docstore_id[p] for p in batch]
+                    docstore.update((i, old_store.docstore.search(i)) for i in ids)
+                new_index.add(vectors)
+                docstore_ids.extend(ids)
+            self._apply_search_params(new_index)
+
+            # 整体替换：等待正在进行的查询和写入结束后，重放重建期间的写入，再切换到新实例
+            with self._lock.write():
+                adds, self._vacuum_adds = self._vacuum_adds, None
+                if self.store is not old_store:
+                    # 重建期间索引被整体替换（重新训练、清空或重新加载），本次结果作废
+                    return {"success": False, "message": "压缩期间向量存储被替换，请稍后重试",
+                            "error": "向量存储已被替换", "removed": 0}
+                new_store = self.FAISS(
+                    embedding_function=self.embeddings,
+                    index=new_index,
+                    docstore=self.InMemoryDocstore(docstore),
+                    index_to_docstore_id=dict(enumerate(docstore_ids)),
+                    distance_strategy=old_store.distance_strategy
+                )
+                for text_embeddings, metadatas, ids in adds:
+                    new_store.add_embeddings(text_embeddings, metadatas=metadatas, ids=ids)
+                self.store = new_store
+                self._positions_by_document = None
+                # 重建期间新删除、且仍在新索引中的块保留为墓碑
+                self._tombstones = {
+                    chunk_id for chunk_id in self._tombstones - removed_tombstones
+                    if chunk_id in new_store.docstore._dict
+                }
+                self._tombstone_positions = None
+                remaining = new_index.ntotal
+            if not self.compact():
+                return {"success": False, "message": "压缩后保存快照失败", "removed": len(removed_positions)}
+
+            print(f"✅ FAISS索引压缩完成，当前 {remaining} 个向量")
+            return {
+                "success": True,
+                "message": f"已移除 {len(removed_positions)} 个向量",
+                "removed": len(removed_positions),
+                "remaining": remaining
+            }
         except Exception as e:
-            print(f"❌ 保存FAISS索引失败: {e}")
+            with self._lock.write():
+                self._vacuum_adds = None
+            print(f"❌ 压缩FAISS索引失败: {e}")
             import traceback
             traceback.print_exc()
-            return False
-    
+            return {"success": False, "message": "压缩FAISS索引时发生错误", "error": str(e), "removed": 0}
+
+    def _maybe_train(self):
+        """暂存的向量达到训练阈值时训练 IVF 索引并迁移（调用方保证期间没有其他写入）"""
+        if self._training_due():
+            print(f"🏋️ 已暂存 {self.store.index.ntotal} 个向量，训练 {self.index_type} 索引并迁移...")
+            result = self.retrain()
+            if not result.get("success"):
+                print(f"⚠️ 训练失败，继续使用平面索引: {result.get('error')}")
+
+    def retrain(self) -> dict:
+        """
+        用索引中已存储的全部向量重新训练并重建 IVF 类索引（不重新嵌入）
+
+        建索引时训练样本较少会缩小 nlist / nbits，向量增多后可调用本方法按配置的目标参数重新训练；
+        向量位置不变，docstore 和映射直接沿用。IVF-PQ 只能取回解码后的近似向量，重建会带来少量精度损失。
+        调用方需保证重建期间没有写入（服务层持有写锁）；重建期间查询继续使用旧索引
+        """
+        if self.index_type not in self.IVF_INDEX_TYPES:
+            return {"success": False, "message": f"{self.index_type} 索引不需要训练", "error": "索引类型不需要训练"}
+        if not self.store or not self.store.index.ntotal:
+            return {"success": True, "message": "向量存储为空，无需训练", "vectors": 0}
+
+        try:
+            old_store = self.store
+            old_index = old_store.index
+            if hasattr(old_index, "make_direct_map"):
+                with self._lock.write():
+                    old_index.make_direct_map()
+            with self._lock.read():
+                vectors = old_index.reconstruct_n(0, old_index.ntotal)
+                index_to_docstore_id = dict(old_store.index_to_docstore_id)
+
+            new_index = self._build_index(vectors, force_train=True)
+            new_index.add(vectors)
+
+            with self._lock.write():
+                self.store = self.FAISS(
+                    embedding_function=self.embeddings,
+                    index=new_index,
+                    docstore=old_store.docstore,
+                    index_to_docstore_id=index_to_docstore_id,
+                    distance_strategy=self._distance_strategy(new_index)
+                )
+                self._positions_by_document = None
+                self._tombstone_positions = None
+            if not self.compact():
+                return {"success": False, "message": "重新训练后保存快照失败", "error": "保存快照失败"}
+
+            print(f"✅ {self.index_type} 索引已用 {len(vectors)} 个向量重新训练，nlist={self.index_params['ivf_nlist']}")
+            return {
+                "success": True,
+                "message": f"已用 {len(vectors)} 个向量重新训练索引",
+                "vectors": len(vectors),
+                "index_params": self.index_params
+            }
+        except Exception as e:
+            print(f"❌ 重新训练FAISS索引失败: {e}")
+            import traceback
+            traceback.print_exc()
+            return {"success": False, "message": "重新训练FAISS索引时发生错误", "error": str(e)}
+
+    # ==================== 持久化 ====================
+
+    def save(self) -> bool:
+        """
+        保存向量存储到磁盘
+        snapshot 模式完整重写；append 模式只追加新记录，累计到阈值后压缩为快照
+        """
+        with self._save_lock:
+            if not self.store:
+                print("❌ 没有向量存储可保存")
+                return False
+
+            if self.persistence_mode != "append" or not self._snapshot_exists():
+                return self.compact()
+
+            try:
+                if self._pending_records:
+                    # 写日志期间可能有新的写入（压缩不再独占服务层写锁），只移除已写入日志的记录
+                    records = list(self._pending_records)
+                    self._append_wal(records)
+                    appended = sum(len(r["ids"]) for r in records if r["op"] == "add")
+                    self._wal_vectors += appended
+                    del self._pending_records[:len(records)]
+                    print(f"💾 追加 {appended} 个向量到日志（自上次快照累计 {self._wal_vectors} 个）")
+
+                if self._wal_vectors >= self.compact_threshold:
+                    print(f"🗜️ 日志累计 {self._wal_vectors} 个向量，压缩为快照...")
+                    return self.compact()
+                return True
+            except Exception as e:
+                print(f"❌ 追加FAISS日志失败: {e}")
+                import traceback
+                traceback.print_exc()
+                return False
+
+    def compact(self) -> bool:
+        """
+        把当前索引完整写为快照，并清空日志
+
+        依次：写入 <index>.tmp -> 旧快照改名为 <index>.old -> .tmp 改名为正式目录 -> 删除 .old。
+        两次改名之间中断时，加载时由 _recover_snapshot 根据留下的目录恢复
+        """
+        with self._save_lock:
+            if not self.store:
+                print("❌ 没有向量存储可保存")
+                return False
+
+            try:
+                print(f"💾 保存向量存储到: {self.store_path}")
+                os.makedirs(self.store_path, exist_ok=True)
+                save_path = self.index_dir
+                tmp_path = save_path + ".tmp"
+                old_path = save_path + ".old"
+
+                # 先写到临时目录，再整体替换，避免中途失败留下损坏的快照
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                with self._lock.read():
+                    # 快照包含此刻之前的全部写入；之后写入的记录留在内存中，由下次保存写入日志
+                    saved_records = len(self._pending_records)
+                    self.store.save_local(tmp_path)
+                    with open(os.path.join(tmp_path, self.PARAMS_FILENAME), "w", encoding="utf-8") as f:
+                        json.dump({"index_type": self.index_type, **self.index_params}, f, indent=2)
+                    with open(os.path.join(tmp_path, self.TOMBSTONES_FILENAME), "w", encoding="utf-8") as f:
+                        json.dump(sorted(self._tombstones), f)
+                if os.path.exists(save_path):
+                    shutil.rmtree(old_path, ignore_errors=True)
+                    os.replace(save_path, old_path)
+                os.replace(tmp_path, save_path)
+                shutil.rmtree(old_path, ignore_errors=True)
+
+                # 新快照已包含这些记录，日志随旧目录一起移除
+                del self._pending_records[:saved_records]
+                self._wal_vectors = 0
+                print(f"✅ 向量存储保存成功: {save_path}")
+                return True
+            except Exception as e:
+                print(f"❌ 保存FAISS索引失败: {e}")
+                import traceback
+                traceback.print_exc()
+                return False
+
+    def _append_wal(self, records: list):
+        """把记录追加到日志并刷盘"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        with open(self.wal_path, "ab") as f:
+            for record in records:
+                pickle.dump(record, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _replay_wal(self) -> int:
+        """在当前索引上重放日志，返回重放的向量数"""
+        if not os.path.exists(self.wal_path):
+            return 0
+
+        replayed = 0
+        valid_offset = 0
+        with open(self.wal_path, "rb") as f:
+            while True:
+                try:
+                    record = pickle.load(f)
+                except EOFError:
+                    break
+                except Exception as e:
+                    # 最后一条记录可能因进程中断而不完整，丢弃它
+                    print(f"⚠️ 日志尾部记录损坏，已忽略: {e}")
+                    break
+                valid_offset = f.tell()
+
+                if record.get("op") == "add":
+                    # 快照替换和日志清理之间中断时，日志里可能有快照已包含的记录，按ID去重
+                    existing = self.store.docstore._dict if self.store else {}
+                    keep = [i for i, doc_id in enumerate(record["ids"]) if doc_id not in existing]
+                    if keep:
+                        self._apply_add(
+                            [record["texts"][i] for i in keep],
+                            [record["vectors"][i] for i in keep],
+                            [record["metadatas"][i] for i in keep],
+                            [record["ids"][i] for i in keep]
+                        )
+                        replayed += len(keep)
+                    self._wal_vectors += len(record["ids"])
+                elif record.get("op") == "delete":
+                    self._tombstones.update(record["ids"])
+
+        # 截掉损坏的尾部，后续追加从完整记录之后开始
+        if valid_offset < os.path.getsize(self.wal_path):
+            with open(self.wal_path, "r+b") as f:
+                f.truncate(valid_offset)
+        return replayed
+
+    def _load_index_params(self):
+        """读取快照的构建参数；查询期参数（efSearch / nprobe）以当前配置为准"""
+        params_path = os.path.join(self.index_dir, self.PARAMS_FILENAME)
+        if not os.path.exists(params_path):
+            return
+        with open(params_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        saved_type = saved.pop("index_type", self.index_type)
+        if saved_type != self.index_type:
+            print(f"⚠️ 快照索引类型为 {saved_type}，与配置的 {self.index_type} 不一致，按快照加载")
+        for key in ("hnsw_ef_search", "ivf_nprobe"):
+            saved.pop(key, None)
+        self.index_params.update(saved)
+
     def load(self) -> bool:
-        """从磁盘加载向量存储"""
+        """从磁盘加载向量存储（快照 + 日志重放）"""
         if not self.available:
             return False
-        
+
+        with self._lock.write():
+            loaded = self._load_locked()
+        if loaded:
+            self._maybe_train()
+        return loaded
+
+    def _recover_snapshot(self):
+        """
+        恢复 compact 中断留下的目录（调用方持有写锁）
+
+        - 正式目录缺失、.old 存在：旧快照已移走，说明 .tmp 已完整写入，提升 .tmp；
+          .tmp 不可用时退回 .old
+        - 正式目录存在：替换已完成或尚未开始，残留的 .tmp（可能不完整）和 .old 直接删除
+        """
+        save_path = self.index_dir
+        tmp_path = save_path + ".tmp"
+        old_path = save_path + ".old"
+        if not os.path.exists(save_path) and os.path.exists(old_path):
+            tmp_complete = (os.path.exists(os.path.join(tmp_path, "index.faiss"))
+                            and os.path.exists(os.path.join(tmp_path, "index.pkl")))
+            if tmp_complete:
+                print("🩹 检测到中断的快照替换，使用已写完的新快照")
+                os.replace(tmp_path, save_path)
+            else:
+                print("🩹 检测到中断的快照替换，恢复旧快照")
+                os.replace(old_path, save_path)
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+    def _load_locked(self) -> bool:
         try:
-            save_path = os.path.join(self.store_path, "faiss_index")
+            self._recover_snapshot()
+            save_path = self.index_dir
             # 检查实际的文件名（FAISS保存时会使用index作为前缀）
-            index_faiss_path = os.path.join(save_path, "index.faiss")
-            index_pkl_path = os.path.join(save_path, "index.pkl")
-            
-            if os.path.exists(index_faiss_path) and os.path.exists(index_pkl_path):
+            self._positions_by_document = None
+            self._tombstones = set()
+            self._tombstone_positions = None
+            if self._snapshot_exists():
+                self._load_index_params()
+                tombstones_path = os.path.join(save_path, self.TOMBSTONES_FILENAME)
+                if os.path.exists(tombstones_path):
+                    with open(tombstones_path, "r", encoding="utf-8") as f:
+                        self._tombstones = set(json.load(f))
                 self.store = self.FAISS.load_local(save_path, self.embeddings, allow_dangerous_deserialization=True)
-                return True
+                self.store.distance_strategy = self._distance_strategy(self.store.index)
+                self._apply_search_params(self.store.index)
+
+            self._wal_vectors = 0
+            replayed = self._replay_wal()
+            if replayed:
+                print(f"🔁 从日志重放 {replayed} 个向量")
+            return self.store is not None
         except Exception as e:
             print(f"加载FAISS索引失败: {e}")
-        
+
         return False
 
 
 def create_faiss_store(embeddings, index_type: str = "IndexFlatL2", store_path: str = "vector_store"):
     """创建FAISS向量存储的便捷函数"""
-    return FAISSVectorStore(embeddings, index_type, store_path)
\ No newline at end of file
+    return FAISSVectorStore(embeddings, index_type, store_path)
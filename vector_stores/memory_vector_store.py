@@ -4,7 +4,7 @@
 基于DocArrayInMemorySearch的向量存储实现
 """
 
-from typing import List, Tuple
+from typing import Iterable, List, Optional, Tuple
 from langchain.schema import Document
 
 
@@ -46,18 +46,86 @@ class MemoryVectorStore:
         except Exception as e:
             print(f"添加文档失败: {e}")
             return False
-    
-    def similarity_search_with_score(self, query: str, k: int = 4) -> List[Tuple[Document, float]]:
-        """相似性搜索并返回分数"""
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]]) -> bool:
+        """添加已经计算好向量的文档，不再调用嵌入模型"""
+        if not self.available:
+            return False
+
+        try:
+            if not self.store:
+                self.store = self.DocArrayInMemorySearch.from_params(self.embeddings)
+
+            # DocArrayInMemorySearch.add_texts 会重新嵌入，这里直接按其文档结构写入索引
+            new_docs = []
+            for doc, vector in zip(documents, embeddings):
+                fields = {"text": doc.page_content, "embedding": vector, "metadata": doc.metadata}
+                if doc.metadata.get("chunk_id"):
+                    fields["id"] = doc.metadata["chunk_id"]  # 用块ID作为文档ID，便于之后按块删除
+                new_docs.append(self.store.doc_cls(**fields))
+            self.store.doc_index.index(new_docs)
+            return True
+        except Exception as e:
+            print(f"写入预计算向量失败: {e}")
+            return False
+
+    def delete_chunks(self, chunk_ids: List[str]) -> dict:
+        """按块ID删除文档块"""
+        if not self.store:
+            return {"success": True, "deleted_count": 0}
+
+        try:
+            chunk_ids = list(chunk_ids)
+            del self.store.doc_index[chunk_ids]
+            return {"success": True, "deleted_count": len(chunk_ids)}
+        except Exception as e:
+            print(f"删除文档块失败: {e}")
+            return {"success": False, "error": str(e), "deleted_count": 0}
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     exclude_document_ids: Iterable[str] = None) -> List[Tuple[Document, float]]:
+        """相似性搜索并返回分数，exclude_document_ids 中的文档不参与排序"""
         if not self.store:
             return []
         
         try:
-            return self.store.similarity_search_with_score(query, k=k)
+            excluded = set(exclude_document_ids or [])
+            if not excluded:
+                return self.store.similarity_search_with_score(query, k=k)
+
+            return self._filtered_search(query, k, excluded)
         except Exception as e:
             print(f"搜索失败: {e}")
             return []
     
+    def _filtered_search(self, query: str, k: int, excluded: set) -> List[Tuple[Document, float]]:
+        """先用 DocArray 过滤掉已排除文档的向量，再在剩余向量上取前 k 个（不对全部文档打分排序）"""
+        import numpy as np
+        
+        doc_index = self.store.doc_index
+        vector = np.array(self.embeddings.embed_query(query))
+        q = (
+            doc_index.build_query()
+            .filter(filter_query={"metadata__document_id": {"$nin": list(excluded)}})
+            .find(query=vector, search_field="embedding")
+            .build(limit=k)
+        )
+        docs, scores = doc_index.execute_query(q)
+        return [
+            (Document(page_content=doc.text, metadata=doc.metadata), float(score))
+            for doc, score in zip(docs, scores)
+        ]
+    
+    def relevance_score(self, score: float) -> Optional[float]:
+        """把 similarity_search_with_score 的分数换算为 [0, 1] 的相关度（按存储的距离度量），无法换算时返回 None"""
+        if not self.store:
+            return None
+        try:
+            relevance = self.store._select_relevance_score_fn()(float(score))
+        except Exception:
+            return None
+        return min(max(relevance, 0.0), 1.0)
+    
     def get_info(self) -> dict:
         """获取存储信息"""
         if not self.store:
@@ -32,6 +32,20 @@ VECTOR_STORES = {
         "index_type": "IndexHNSWFlat",
         "persistent": True
     },
+    "faiss_ivf": {
+        "name": "FAISS IVF索引",
+        "module": "faiss_vector_store",
+        "class": "FAISSVectorStore",
+        "index_type": "IndexIVFFlat",
+        "persistent": True
+    },
+    "faiss_ivfpq": {
+        "name": "FAISS IVF-PQ压缩索引",
+        "module": "faiss_vector_store",
+        "class": "FAISSVectorStore",
+        "index_type": "IndexIVFPQ",
+        "persistent": True
+    },
     "chromadb": {
         "name": "ChromaDB向量存储",
         "module": "chromadb_vector_store",
@@ -72,7 +86,7 @@ def list_available_stores() -> list:
     try:
         import faiss
         from langchain_community.vectorstores import FAISS
-        available.extend(["faiss_l2", "faiss_ip", "faiss_hnsw"])
+        available.extend(["faiss_l2", "faiss_ip", "faiss_hnsw", "faiss_ivf", "faiss_ivfpq"])
     except ImportError:
         pass
     